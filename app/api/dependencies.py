@@ -2,7 +2,7 @@ import logging
 from app.core.security import verify_jwt_token
 from app.logs.logger_config import log
 from typing import Annotated
-from fastapi import Depends, Request
+from fastapi import Depends, Request, WebSocket
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from app.db.crud import get_user
@@ -53,4 +53,24 @@ async def get_current_user(request: Request, db: db_dependancy):
             return None
     except Exception as e:
         log(f"Error during get_current_user - {str(e)}", logging.ERROR, debug=True)
-        return None
\ No newline at end of file
+        return None
+
+# Get the current user of a WebSocket from its token, sent in the 'token' query parameter (browsers can't set the headers of a WebSocket)
+# or in the Authorization header. Returns None for anonymous connections and invalid tokens
+async def get_websocket_user(websocket: WebSocket, db: db_dependancy):
+    try:
+        token = websocket.query_params.get("token")
+        authorization = websocket.headers.get("Authorization")
+        if not token and authorization and authorization.startswith("Bearer "):
+            token = authorization.split()[1]
+        if not token:
+            return None
+
+        payload = verify_jwt_token(token)
+        if payload is None or not payload.get("sub") or not payload.get("email"):
+            log(f"WebSocket token is invalid", logging.INFO, debug=True)
+            return None
+        return get_user(db, payload.get("sub"), email=payload.get("email"))
+    except Exception as e:
+        log(f"Error during get_websocket_user - {str(e)}", logging.ERROR, debug=True)
+        return None
@@ -1,24 +1,39 @@
 from typing import Annotated
-from fastapi import APIRouter, HTTPException, UploadFile, File, Depends
-from app.api.dependencies import get_current_user
-from app.db.database import get_db
-from app.schemas import PredictRequest, PredictResponse, EncodedImageString, user_schemas
+from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, WebSocket, WebSocketDisconnect
+from app.api.dependencies import get_current_user, get_websocket_user
+from app.db.database import get_db, SessionLocal
+from app.schemas import PredictRequest, PredictResponse, BatchPredictRequest, BatchPredictResponse, CurrencyInfo, EncodedImageString, ModelSwapRequest, user_schemas
 from app.ml.model import MyModel
-from fastapi.responses import HTMLResponse, JSONResponse
+from app.ml.image_decode import decode_image, decoded_pixels
+from app.ml.topology import topology
+from app.core.tracing import span
+from app.core.profiling import list_profiles, profile_path
+from app.core.memory import memory_stats
+from app.services.inference_scheduler import inference_scheduler
+from app.services.admission_controller import admission_controller, AdmissionRejected, priority_class
+from app.services.prediction_cache import prediction_cache
+from app.services.model_registry import model_registry
+from app.services.live_session import LiveSession
+from app.ml.inference_executor import inference_executor
+from app.services.prediction_jobs import prediction_jobs, report_stage, JobQueueFull
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, StreamingResponse
 from app.core.config import settings
 from app.logs import log
 from app.db import crud
 
 import logging
 from requests import Session, RequestException
+import asyncio
 import base64
 import io
+import json
 
 model = MyModel()
 router = APIRouter()
 
 db_dependency = Annotated[Session, Depends(get_db)]
 user_dependency = Annotated[user_schemas.User | None, Depends(get_current_user)]
+websocket_user_dependency = Annotated[user_schemas.User | None, Depends(get_websocket_user)]
 
 # ----------------------------------------------------------- Model routes ----------------------------------------------------------- #
 from PIL import Image
@@ -27,6 +42,7 @@ from PIL import Image
 # If a user is logged in, save image to user's images, if not, save it to the general images
 @router.post("/predict", response_model=PredictResponse)
 async def predict(request: PredictRequest, user: user_dependency, db: db_dependency):
+    admitted_pixels = None
     try:
         # Check that return currency is valid
         if request.return_currency not in exchange_service.CURRENCIES:
@@ -35,46 +51,211 @@ async def predict(request: PredictRequest, user: user_dependency, db: db_depende
             else:
                 raise ValueError("Invalid return currency")
         try:
-            # Decode base64 image
-            image_data = base64.b64decode(request.image)
-            image = Image.open(io.BytesIO(image_data))
-            image = image.convert('RGB')
+            with span("base64_decode"):
+                image_data = base64.b64decode(request.image)
+            pixels = decoded_pixels(image_data) # From the image's header
         except Exception as e:
             raise ValueError("Invalid image - Unable to decode the image")
-        
-        # Detect, classify objects, anotate image and get the detected counts with the requested currency's conversion rate
+
+        # Wait for the admission controller, it bounds the images decoded and inferred at the same time and their pixels (503 when overloaded)
+        # Queued requests are admitted by their user's priority class
+        with span("admission_queue"):
+            admitted_pixels = await admission_controller.acquire(pixels, priority_class(user))
         try:
-            annotated_image , currencies = model.predict_image(image, request.return_currency)
+            # Decode base64 image into the RGB array shared by every stage (downscaled and EXIF-oriented once)
+            with span("image_decode"):
+                image = await asyncio.to_thread(decode_image, image_data)
         except Exception as e:
-            raise ValueError(f"Could not predict the image. Please try again later.")
+            raise ValueError("Invalid image - Unable to decode the image")
         
-        # Convert annotated image to base64
+        # Detect, classify objects (batched with concurrent requests, reused for identical images), anotate image and get the detected counts with the requested currency's conversion rate
+        # In the detections and overlay response modes the client draws the detections itself, the image isn't annotated nor encoded
         try:
-            buffered = io.BytesIO()
-            annotated_image.save(buffered, format="JPEG")
-            annotated_image_base64 = base64.b64encode(buffered.getvalue()).decode()
+            confidence_threshold = 0.5
+            with span("inference"):
+                detections = await prediction_cache.get_or_compute(image, confidence_threshold, lambda: inference_scheduler.predict(image, confidence_threshold))
         except Exception as e:
-            raise ValueError(f"Error in encoding the image - {str(e)}")
+            raise ValueError(f"Could not predict the image. Please try again later.")
+        report_stage("detected", objects=len(detections))
+        response, currencies = await prediction_response(image, detections, request.return_currency, request.response_mode)
+        report_stage("classified", currencies={currency: currency_info.quantity for currency, currency_info in currencies.items()})
         
-        # Save the image to the user's images
+        # Save the image to the user's images (the uploaded photo when no annotated image was made)
         try:
             if user:
                 # Parse the currencies to a dictionary of [currency(str): amount(int)]
                 currency_db_compatible = {currency: currency_info.quantity for currency, currency_info in currencies.items()}
-                image_id = crud.save_image(db, annotated_image_base64, user.id, currencies= currency_db_compatible)
-                return PredictResponse(currencies= currencies, image= annotated_image_base64, image_id= image_id)
+                saved_image = response.image if response.image is not None else request.image
+                with span("save_image"):
+                    response.image_id = crud.save_image(db, saved_image, user.id, currencies= currency_db_compatible, model_version= detections.model_version)
+                report_stage("saved", image_id=response.image_id)
         except Exception as e:
             log(f"Error in saving the image - {str(e)}", logging.ERROR)
 
-        return PredictResponse(currencies= currencies, image= annotated_image_base64, image_id= None)
+        return response
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except ValueError as e:
         log(f"Error in prediction - {str(e)}", logging.ERROR)
         raise HTTPException(status_code=400, detail=f"{str(e)}")
     except Exception as e:
         log(f"General error - {str(e)}", logging.CRITICAL)
         raise HTTPException(status_code=500, detail=f"General error - {str(e)}")
+    finally:
+        if admitted_pixels is not None:
+            admission_controller.release(admitted_pixels)
     
 
+# Predict many images in a single request (e.g. a business's photos of the day) and return each image's response with the counts and total across the images
+# The batch is admitted as one request with a concurrency slot per image and the images' total pixels, its images are inferred together (as batches of up to INFERENCE_MAX_BATCH_SIZE)
+# and, if a user is logged in, all of them are saved to the user's images in a single transaction
+@router.post("/predict/batch", response_model=BatchPredictResponse)
+async def predict_batch(request: BatchPredictRequest, user: user_dependency, db: db_dependency):
+    admitted_pixels = None
+    try:
+        # Check that return currency is valid
+        if request.return_currency not in exchange_service.CURRENCIES:
+            if request.return_currency == "NIS":
+                request.return_currency = "ILS"
+            else:
+                raise ValueError("Invalid return currency")
+        if not request.images:
+            raise ValueError("No images to predict")
+        if len(request.images) > settings.PREDICT_BATCH_MAX_IMAGES:
+            raise ValueError(f"Too many images - at most {settings.PREDICT_BATCH_MAX_IMAGES} images per batch")
+        images_data, pixels = [], 0
+        with span("base64_decode", batch_size=len(request.images)):
+            for index, image_base64 in enumerate(request.images):
+                try:
+                    images_data.append(base64.b64decode(image_base64))
+                    pixels += decoded_pixels(images_data[-1])
+                except Exception as e:
+                    raise ValueError(f"Invalid image {index} - Unable to decode the image")
+
+        # The batch takes a concurrency slot per image (all of them past ADMISSION_MAX_CONCURRENT images), and decodes as many images at a time
+        with span("admission_queue"):
+            admitted_pixels = await admission_controller.acquire(pixels, priority_class(user), images=len(images_data))
+        decode_slots = asyncio.Semaphore(admission_controller.slots(len(images_data)))
+        async def decode(image_data):
+            async with decode_slots:
+                return await asyncio.to_thread(decode_image, image_data)
+        with span("image_decode", batch_size=len(images_data)):
+            decoded = await asyncio.gather(*(decode(image_data) for image_data in images_data), return_exceptions=True)
+        for index, image in enumerate(decoded):
+            if isinstance(image, Exception):
+                raise ValueError(f"Invalid image {index} - Unable to decode the image")
+
+        # Queued together, the images run through the inference scheduler as true batches
+        try:
+            confidence_threshold = 0.5
+            with span("inference", batch_size=len(decoded)):
+                all_detections = await asyncio.gather(*(prediction_cache.get_or_compute(image, confidence_threshold, lambda image=image: inference_scheduler.predict(image, confidence_threshold))
+                                                        for image in decoded))
+        except Exception as e:
+            raise ValueError(f"Could not predict the images. Please try again later.")
+        predictions = await asyncio.gather(*(prediction_response(image, detections, request.return_currency, request.response_mode)
+                                             for image, detections in zip(decoded, all_detections)))
+        results = [response for response, _ in predictions]
+
+        # The counts of every currency across the images
+        currencies = {}
+        for _, image_currencies in predictions:
+            for currency, currency_info in image_currencies.items():
+                quantity = currency_info.quantity + (currencies[currency].quantity if currency in currencies else 0)
+                currencies[currency] = CurrencyInfo(quantity= quantity, return_currency_value= currency_info.return_currency_value)
+        total = round(sum(currency_info.quantity * currency_info.return_currency_value for currency_info in currencies.values()), 2)
+
+        # Save all the images to the user's images in one transaction (the uploaded photos when no annotated image was made)
+        try:
+            if user:
+                saved_images = [(response.image if response.image is not None else image_base64,
+                                 {currency: currency_info.quantity for currency, currency_info in image_currencies.items()}, detections.model_version)
+                                for (response, image_currencies), image_base64, detections in zip(predictions, request.images, all_detections)]
+                with span("save_image", batch_size=len(saved_images)):
+                    image_ids = crud.save_images(db, saved_images, user.id)
+                for response, image_id in zip(results, image_ids):
+                    response.image_id = image_id
+        except Exception as e:
+            log(f"Error in saving the images - {str(e)}", logging.ERROR)
+
+        return BatchPredictResponse(results= results, currencies= currencies, total= total)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ValueError as e:
+        log(f"Error in batch prediction - {str(e)}", logging.ERROR)
+        raise HTTPException(status_code=400, detail=f"{str(e)}")
+    except Exception as e:
+        log(f"General error - {str(e)}", logging.CRITICAL)
+        raise HTTPException(status_code=500, detail=f"General error - {str(e)}")
+    finally:
+        if admitted_pixels is not None:
+            admission_controller.release(admitted_pixels, len(request.images))
+
+# Count an image's detections in the return currency and make its response in the requested mode, returns the response and the counts
+# image: the annotated image (base64 JPEG), detections: the detections as JSON, overlay: the detections and a transparent PNG of the annotations
+async def prediction_response(image, detections, return_currency: str, response_mode: str):
+    try:
+        if response_mode == "image":
+            annotated_image , currencies = await asyncio.to_thread(model.annotate_and_count, image, detections, return_currency)
+        else:
+            with span("count"):
+                currencies = await asyncio.to_thread(model.get_detected_counts, detections, return_currency)
+    except Exception as e:
+        raise ValueError(f"Could not predict the image. Please try again later.")
+
+    # Convert annotated image to base64 (or the detections to JSON and the transparent overlay to a base64 PNG)
+    try:
+        annotated_image_base64 = detections_info = overlay_base64 = None
+        with span("encode"):
+            if response_mode == "image":
+                buffered = io.BytesIO()
+                annotated_image.save(buffered, format="JPEG")
+                annotated_image_base64 = base64.b64encode(buffered.getvalue()).decode()
+            else:
+                detections_info = model.describe_detections(detections, image.shape)
+                if response_mode == "overlay":
+                    overlay = await asyncio.to_thread(model.render_overlay, image.shape, detections, settings.OVERLAY_MAX_SIDE)
+                    buffered = io.BytesIO()
+                    overlay.save(buffered, format="PNG", optimize=True)
+                    overlay_base64 = base64.b64encode(buffered.getvalue()).decode()
+    except Exception as e:
+        raise ValueError(f"Error in encoding the image - {str(e)}")
+    return PredictResponse(currencies= currencies, image= annotated_image_base64, image_id= None, detections= detections_info, overlay= overlay_base64), currencies
+
+# Live camera counting: the client streams frames (binary JPEG messages, or JSON text messages with a base64 'image'), the server
+# processes the latest one whenever it's free and sends its boxes, and the counts whenever they change
+# Keyframes run the full pipeline, the boxes are tracked in between (see LiveSession)
+@router.websocket("/live")
+async def live(websocket: WebSocket, user: websocket_user_dependency, return_currency: str = "USD"):
+    return_currency = "ILS" if return_currency == "NIS" else return_currency
+    if return_currency not in exchange_service.CURRENCIES:
+        await websocket.close(code=1008, reason="Invalid return currency")
+        return
+
+    await websocket.accept()
+    session = LiveSession(return_currency, priority_class(user))
+    processing_task = asyncio.create_task(session.run(websocket.send_json))
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                session.submit(message["bytes"])
+            elif message.get("text"):
+                try:
+                    session.submit(base64.b64decode(json.loads(message["text"])["image"]))
+                except Exception as e:
+                    await websocket.send_json({"type": "error", "detail": "Invalid message - expected a JSON object with a base64 'image'"})
+            if processing_task.done(): # The processing failed (e.g. the connection closed while sending)
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        processing_task.cancel()
+        await asyncio.gather(processing_task, return_exceptions=True)
+        session.close()
+
 @router.post("/encode_image" ,response_model= EncodedImageString)
 async def upload_image(file: UploadFile = File(...)):
     if settings.DEBUG:
@@ -116,6 +297,64 @@ async def show_image(request: EncodedImageString):
     else:
         raise HTTPException(status_code=404, detail="Not found")
 
+# ----------------------------------------------------------- Prediction job routes ----------------------------------------------------------- #
+
+# Submit an image to predict asynchronously, returns the job's id right away
+# The job runs /predict on the prediction job pool, its progress is polled with /jobs/{job_id} or streamed by /jobs/{job_id}/events
+# and its PredictResponse is fetched from /jobs/{job_id}/result until PREDICTION_JOB_TTL_SECONDS after it finished
+@router.post("/jobs", status_code=202)
+async def submit_job(request: PredictRequest, user: user_dependency):
+    async def run(job):
+        db = SessionLocal()
+        try:
+            return await predict(request, user, db)
+        finally:
+            db.close()
+    try:
+        job = prediction_jobs.submit(run, user.id if user else None)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(settings.ADMISSION_RETRY_AFTER_SECONDS)})
+    return {"job_id": job.id, "status": job.status}
+
+def get_job(job_id: str, user):
+    job = prediction_jobs.get(job_id, user.id if user else None)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+# Get a job's status and the stages it went through
+@router.get("/jobs/{job_id}")
+def get_job_status(job_id: str, user: user_dependency):
+    return get_job(job_id, user).info()
+
+# Stream a job's stages as Server-Sent Events (the past ones first), until the job is done or failed
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, user: user_dependency):
+    job = get_job(job_id, user)
+
+    async def events():
+        seen = 0
+        while True:
+            for event in job.events[seen:]:
+                yield f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+            seen = len(job.events)
+            if job.finished:
+                return
+            await job.wait_for_events(seen, timeout=15)
+            if len(job.events) == seen:
+                yield ": keepalive\n\n" # Keeps proxies from closing an idle stream
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+# Get the PredictResponse of a done job, a failed job returns its error
+@router.get("/jobs/{job_id}/result", response_model=PredictResponse)
+def get_job_result(job_id: str, user: user_dependency):
+    job = get_job(job_id, user)
+    if job.status == "failed":
+        raise HTTPException(status_code=job.error["status_code"], detail=job.error["detail"])
+    if not job.finished:
+        raise HTTPException(status_code=409, detail=f"Job not finished - {job.status}")
+    return job.result
+
 # ----------------------------------------------------------- Exchange rates API routes ----------------------------------------------------------- #
 from app.services.currency_exchange import exchange_service
 
@@ -134,7 +373,69 @@ def get_rates(user: user_dependency, db: db_dependency):
     except Exception as e:
         log(f"General error - {str(e)}", logging.ERROR)
         raise HTTPException(status_code=500, detail=str(e))
+
+# ----------------------------------------------------------- Inference stats routes ----------------------------------------------------------- #
+
+@router.get("/inference_stats")
+def get_inference_stats(user: user_dependency):
+    # Only allow admin users to access the inference scheduler's and prediction cache's stats and the inference topology
+    if user and user.role == "admin":
+        return {"inference_scheduler": inference_scheduler.stats(), "prediction_cache": prediction_cache.stats(), "topology": topology(),
+                "pruning": inference_executor.pruning_stats(), "admission": admission_controller.stats(), "prediction_jobs": prediction_jobs.stats()}
+
+    raise HTTPException(status_code=401, detail="Unauthorized")
+
+# The stages allocating the most memory across the recent /predict requests sampled for memory accounting
+@router.get("/memory_stats")
+def get_memory_stats(user: user_dependency):
+    if user and user.role == "admin":
+        return memory_stats.stats()
+
+    raise HTTPException(status_code=401, detail="Unauthorized")
+
+# ----------------------------------------------------------- Model registry routes ----------------------------------------------------------- #
+
+# Get the served models' version, the swaps since startup and the batches running on each version
+@router.get("/models")
+def get_models(user: user_dependency):
+    if user and user.role == "admin":
+        return model_registry.stats()
+
+    raise HTTPException(status_code=401, detail="Unauthorized")
+
+# Hot swap the models: the new version is loaded and warmed up next to the served one, then serves every new request
+@router.post("/models/swap")
+async def swap_models(request: ModelSwapRequest, user: user_dependency):
+    if not user or user.role != "admin":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    try:
+        return await model_registry.swap(request.detection_model, request.classification_model, request.version)
+    except (FileNotFoundError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        log(f"General error - {str(e)}", logging.ERROR)
+        raise HTTPException(status_code=500, detail=f"Could not swap the models - {str(e)}")
     
+# ----------------------------------------------------------- Profiling routes ----------------------------------------------------------- #
+
+# List the recent request profiles, the most recent first
+@router.get("/profiles")
+def get_profiles(user: user_dependency):
+    if user and user.role == "admin":
+        return {"profiles": list_profiles()}
+
+    raise HTTPException(status_code=401, detail="Unauthorized")
+
+# Download a request profile, to open in https://www.speedscope.app
+@router.get("/profiles/{name}")
+def download_profile(name: str, user: user_dependency):
+    if not user or user.role != "admin":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    path = profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=name)
+
 # ----------------------------------------------------------- User routes ----------------------------------------------------------- #
 
 @router.post("/flag_image/{image_id}")
@@ -1,9 +1,11 @@
 import base64
+import os
 import uuid
-from pydantic_settings import BaseSettings
+from pydantic_settings import BaseSettings, JsonConfigSettingsSource
 from datetime import datetime, timedelta, timezone
 
 utc3_time = timezone(timedelta(hours=3))
+INFERENCE_TOPOLOGY_FILE = os.getenv("INFERENCE_TOPOLOGY_FILE", "inference_topology.json") # Written by 'python -m tools.autotune', loaded when it exists
 
 class Settings(BaseSettings):
     # Global settings
@@ -18,6 +20,63 @@ class Settings(BaseSettings):
     PORT: int = 80
     DEBUG: bool = True
     
+    # Model inference
+    IMAGE_DECODE_TARGET_SIDE: int = 1600 # Large photos are decoded downscaled while their long side stays >= this, JPEGs by 1/2, 1/4 or 1/8 and other formats by an integer factor (0 = full resolution)
+    DETECTION_INPUT_SIZE: int = 640 # Long side images are downscaled to before detection, the detection model's input size
+    TILED_INFERENCE_MIN_PIXELS: int = 20_000_000 # Uploads with more pixels (e.g. a 48 MP photo of a table of cash, not a 12 MP phone photo) are decoded at full resolution and detected in overlapping DETECTION_INPUT_SIZE tiles (0 = never tile)
+    TILED_INFERENCE_OVERLAP: float = 0.2 # Fraction of a tile overlapping its neighbours, objects cut by a tile's edge are whole in a neighbour
+    TILED_INFERENCE_MERGE_THRESHOLD: float = 0.6 # Boxes cut by a tile's edge covered more than this by a larger box of another tile or pass are duplicates of it, other boxes by IoU over this
+    TILED_INFERENCE_BATCH_SIZE: int = 16 # Max number of tiles detected in a single forward pass
+    ANNOTATION_MAX_SIDE: int = 0 # Long side the annotated image returned by /predict is downscaled to (0 = the decoded image's size)
+    OVERLAY_MAX_SIDE: int = 1024 # Long side of the transparent overlay returned in the overlay response mode (0 = the decoded image's size)
+    MODEL_BACKEND: str = "pytorch" # Backend both models run on: pytorch, onnx, openvino or torchscript (exported next to the .pt weights)
+    MODEL_BACKEND_AUTO_EXPORT: bool = False # Export the .pt weights to MODEL_BACKEND on startup when the exported model is missing
+    MODEL_PRECISION: str = "fp32" # fp32 or int8 (the quantized models made by tools.quantize, needs MODEL_BACKEND=onnx)
+    MODEL_VERSION: str = "" # Version recorded with each saved image ('' = a hash of the model files' names, sizes and modification times)
+    MODEL_WATCH_INTERVAL_SECONDS: int = 0 # Check the served model files every N seconds and hot swap to them once they're replaced (0 = swap only through /models/swap)
+    MODEL_SWAP_DRAIN_TIMEOUT_SECONDS: int = 120 # Max time a hot swap waits for the batches running on the previous version before releasing it
+    MODEL_WARMUP_RUNS: int = 1 # Dummy inferences run on startup before /ready reports ready (0 = only load the models)
+    MODEL_WARMUP_IMAGE_SIZE: int = 640 # Width and height of the dummy warmup image
+    CROP_MIN_SIDE: int = 8 # Detected boxes narrower or shorter than this (in decoded image pixels) are dropped before classification, boxes with no area always are
+    CROP_DUPLICATE_IOU: float = 0.85 # Boxes overlapping a more confident box by more than this IoU are duplicates of the same object and dropped (1 = keep duplicates)
+    CLASSIFICATION_EARLY_EXIT_CONFIDENCE: float = 0 # Objects the detector already names as a denomination the classifier knows, with at least this confidence, aren't classified (0 = classify every object)
+    CLASSIFICATION_BATCH_SIZE: int = 8 # Max number of cropped objects classified in a single forward pass (1 = one pass per object)
+    INFERENCE_MAX_BATCH_SIZE: int = 8 # Max number of /predict images the inference scheduler runs as one batch
+    INFERENCE_MAX_WAIT_MS: int = 10 # Max time the inference scheduler waits for more images before running a batch
+    INFERENCE_WORKERS: int = 0 # Number of inference worker processes, each loads the models once (0 = run inference in a thread of the server process)
+    INFERENCE_THREADS: int = 0 # Torch intra-op threads of each process running inference (0 = the cores split between the SERVER_WORKERS x INFERENCE_WORKERS processes)
+    SERVER_WORKERS: int = 1 # Number of uvicorn server processes when running app/main.py (more than 1 disables the reload)
+    PREDICTION_CACHE_ENABLED: bool = True # Reuse the detections of an identical image (same decoded pixels and confidence threshold)
+    PREDICTION_CACHE_MAX_ENTRIES: int = 1024 # Max number of cached predictions, the least recently used are evicted first
+    PREDICTION_CACHE_MAX_MB: float = 64 # Max memory held by the cached predictions
+    PREDICTION_CACHE_TTL_SECONDS: int = 600 # Time a cached prediction is reused for
+    ADMISSION_MAX_CONCURRENT: int = 16 # Max number of /predict images decoded and inferred at the same time, a /predict/batch request takes one per image (0 = no limit)
+    ADMISSION_MAX_PIXELS: int = 64_000_000 # Max total decoded pixels of the /predict images in flight, an image larger than that runs alone (0 = no limit)
+    ADMISSION_MAX_QUEUE: int = 64 # Max number of /predict requests waiting for admission, the next ones get a 503
+    ADMISSION_QUEUE_TIMEOUT_MS: int = 5000 # Max time a /predict request waits for admission before getting a 503
+    ADMISSION_RETRY_AFTER_SECONDS: int = 2 # Retry-After header of the 503 responses of rejected requests
+    ADMISSION_PRIORITY_WEIGHTS: dict[str, float] = {"admin": 4, "business": 4, "user": 2, "anonymous": 1} # Share of the admissions of each priority class when /predict requests queue (the user's role, 'user' for other roles, 'anonymous' without a user)
+    PREDICT_BATCH_MAX_IMAGES: int = 32 # Max number of images of a /predict/batch request
+    PREDICTION_JOB_WORKERS: int = 4 # Number of asynchronous prediction jobs (/jobs) run at the same time
+    PREDICTION_JOB_MAX_QUEUED: int = 256 # Max number of prediction jobs waiting for a worker, the next submissions get a 503
+    PREDICTION_JOB_TTL_SECONDS: int = 600 # Time a finished prediction job and its result can be fetched for
+    LIVE_KEYFRAME_INTERVAL: int = 10 # In the /live camera mode, every Nth processed frame runs the full detect + classify pipeline, the boxes are tracked in between
+    LIVE_KEYFRAME_MAX_SECONDS: float = 2.0 # Max time between two keyframes of a live session
+    LIVE_KEYFRAME_LOST_FRACTION: float = 0.3 # A keyframe is run early once the tracker lost more than this fraction of the keyframe's objects
+    LIVE_TRACKING_MAX_SIDE: int = 480 # Long side of the grayscale frames the live mode tracks the boxes on
+    
+    # Tracing
+    TRACING_ENABLED: bool = False # Time the stages of each request and return them in a Server-Timing header
+    TRACING_EXPORT_FILE: str = "" # Also append each traced request to this file as OTLP JSON spans, one request per line ('' = don't export)
+
+    # Profiling
+    PROFILING_SECRET: str = "" # Requests with this value in an X-Profile header are profiled ('' = no header triggered profiling)
+    PROFILING_SAMPLE_RATE: float = 0 # Fraction of the /predict requests profiled (0 = none)
+    PROFILING_INTERVAL_MS: float = 5 # Time between two stack samples of a profiled request
+    PROFILING_MAX_FILES: int = 50 # Number of recent profiles kept in the logs directory, the oldest are deleted first
+    MEMORY_PROFILING_SAMPLE_RATE: float = 0 # Fraction of the /predict requests whose stages' allocations and peak memory are traced with tracemalloc (0 = none)
+    MEMORY_PROFILING_HISTORY: int = 100 # Number of recent sampled requests summarized by /memory_stats
+    
     # JWT
     JWT_ACCESS_SECRET_KEY: str
     JWT_REFRESH_SECRET_KEY: str
@@ -48,5 +107,11 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
         extra = "allow"
+        json_file = INFERENCE_TOPOLOGY_FILE
+
+    # Settings are read from the init arguments, the environment, the .env file and then the autotuned topology file
+    @classmethod
+    def settings_customise_sources(cls, settings_cls, init_settings, env_settings, dotenv_settings, file_secret_settings):
+        return init_settings, env_settings, dotenv_settings, JsonConfigSettingsSource(settings_cls), file_secret_settings
 
 settings = Settings()
@@ -0,0 +1,108 @@
+import random
+import sys
+import threading
+import tracemalloc
+from collections import deque
+from contextvars import ContextVar
+from app.core.config import settings
+from app.logs import log
+
+try:
+    import resource
+except ImportError: # Windows, the peak RSS isn't reported
+    resource = None
+
+# Per-stage memory accounting of sampled /predict requests: a MEMORY_PROFILING_SAMPLE_RATE fraction of the requests is run with
+# tracemalloc tracing, and every tracing span of the request (image_decode, inference, annotate, encode...) records the bytes it
+# allocated and kept, its peak of traced memory over the memory at its start, and how much it raised the process' peak RSS.
+# tracemalloc only traces while a sampled request runs, so the other requests don't pay for it. The counters are process wide:
+# the allocations of the requests running next to a sampled one (e.g. batched with it) are counted in its stages too
+current_memory_trace: ContextVar["MemoryTrace | None"] = ContextVar("current_memory_trace", default=None)
+memory_lock = threading.Lock() # One request is sampled at a time, tracemalloc is process wide
+
+# Peak RSS of the process in bytes (ru_maxrss is in KB on Linux and in bytes on macOS)
+def peak_rss() -> int:
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+class MemoryTrace:
+    def __init__(self, name: str):
+        self.name = name
+        self.stages = [] # (stage, allocated bytes, peak bytes, peak RSS delta bytes), in the order the stages ended
+        self.open_stages = [] # [stage, traced memory at start, peak traced memory so far, peak RSS at start]
+
+    def enter(self, stage: str):
+        current, peak = tracemalloc.get_traced_memory()
+        if self.open_stages: # The peak is reset for the new stage, keep the enclosing stage's peak so far
+            self.open_stages[-1][2] = max(self.open_stages[-1][2], peak)
+        tracemalloc.reset_peak()
+        self.open_stages.append([stage, current, current, peak_rss()])
+
+    def exit(self):
+        current, peak = tracemalloc.get_traced_memory()
+        stage, start, stage_peak, start_rss = self.open_stages.pop()
+        stage_peak = max(stage_peak, peak)
+        if self.open_stages:
+            self.open_stages[-1][2] = max(self.open_stages[-1][2], stage_peak)
+        self.stages.append((stage, current - start, stage_peak - start, peak_rss() - start_rss))
+
+    def summary(self) -> str:
+        return ", ".join(f"{stage}: +{allocated / 2**20:.1f}MB peak {peak / 2**20:.1f}MB rss +{rss / 2**20:.1f}MB"
+                         for stage, allocated, peak, rss in self.stages)
+
+# Aggregates the stages of the MEMORY_PROFILING_HISTORY most recent sampled requests
+class MemoryStats:
+    def __init__(self):
+        self.recent = deque(maxlen=settings.MEMORY_PROFILING_HISTORY)
+        self.sampled_requests = 0
+
+    def record(self, memory_trace: MemoryTrace):
+        self.recent.append(memory_trace.stages)
+        self.sampled_requests += 1
+
+    # The stages of the recent sampled requests, the stage with the highest peak first
+    def stats(self) -> dict:
+        stages = {}
+        for request_stages in self.recent:
+            for stage, allocated, peak, rss in request_stages:
+                stages.setdefault(stage, []).append((allocated, peak, rss))
+        top_stages = []
+        for stage, measures in stages.items():
+            allocated, peaks, rss = zip(*measures)
+            top_stages.append({"stage": stage, "count": len(measures),
+                               "mean_allocated_bytes": round(sum(allocated) / len(measures)), "max_allocated_bytes": max(allocated),
+                               "mean_peak_bytes": round(sum(peaks) / len(measures)), "max_peak_bytes": max(peaks), "max_rss_delta_bytes": max(rss)})
+        top_stages.sort(key=lambda stage_stats: -stage_stats["max_peak_bytes"])
+        return {"sample_rate": settings.MEMORY_PROFILING_SAMPLE_RATE, "sampled_requests": self.sampled_requests,
+                "recent_requests": len(self.recent), "peak_rss_bytes": peak_rss(), "stages": top_stages}
+
+memory_stats = MemoryStats()
+
+# ASGI middleware sampling the /predict requests for memory accounting
+class MemoryProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not settings.MEMORY_PROFILING_SAMPLE_RATE or not scope["path"].endswith("/predict")
+                or random.random() >= settings.MEMORY_PROFILING_SAMPLE_RATE or not memory_lock.acquire(blocking=False)):
+            return await self.app(scope, receive, send)
+
+        started_tracing = not tracemalloc.is_tracing() # Leave tracemalloc on when it was started elsewhere (e.g. PYTHONTRACEMALLOC)
+        if started_tracing:
+            tracemalloc.start()
+        memory_trace = MemoryTrace(f"{scope['method']} {scope['path']}")
+        token = current_memory_trace.set(memory_trace)
+        memory_trace.enter("total")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            while memory_trace.open_stages:
+                memory_trace.exit()
+            current_memory_trace.reset(token)
+            if started_tracing:
+                tracemalloc.stop()
+            memory_lock.release()
+            memory_stats.record(memory_trace)
+            log(f"Memory of {memory_trace.name} - {memory_trace.summary()}")
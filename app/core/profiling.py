@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from app.core.config import settings
+from app.logs import log
+
+# Opt-in request profiling: requests carrying the PROFILING_HEADER with PROFILING_SECRET, and a PROFILING_SAMPLE_RATE fraction of the
+# /predict requests, are profiled by sampling the stacks of every thread of the process while they run (the event loop and the threads
+# running the decoding, the models and the annotation), so the time spent inside ultralytics, torch and PIL shows up too.
+# The profiles are written under the logs directory as speedscope files (https://www.speedscope.app), one profile per thread
+PROFILING_HEADER = "x-profile"
+PROFILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "logs", "profiles")
+PROFILE_SUFFIX = ".speedscope.json"
+
+# Leaf frames of a thread waiting for work (an idle event loop or executor thread), their samples are dropped
+IDLE_FRAMES = {("selectors.py", "select"), ("threading.py", "wait"), ("thread.py", "_worker"), ("queue.py", "get"), ("connection.py", "wait")}
+profile_lock = threading.Lock() # One request is profiled at a time, so a profile isn't skewed by the sampling of another one
+
+class SamplingProfiler:
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.frames = [] # speedscope shared frames: {"name", "file", "line"}
+        self.frame_indexes = {} # code object -> index in frames
+        self.samples = {} # thread id -> ([stack of frame indexes, root first], [weight in seconds])
+        self.thread_names = {} # thread id -> name, recorded while the thread runs
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="sampling-profiler", daemon=True)
+        self.start_time = self.end_time = None
+
+    def start(self):
+        self.start_time = self.last_sample_time = time.perf_counter()
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stop_event.wait(self.interval_seconds):
+            self.sample()
+
+    # Record the stack of every thread but the profiler's, weighted by the time since the previous sample
+    def sample(self):
+        now = time.perf_counter()
+        weight, self.last_sample_time = now - self.last_sample_time, now
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == self.thread.ident:
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.frame_index(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            if thread_id not in self.samples:
+                self.samples[thread_id] = ([], [])
+                self.thread_names.update((thread.ident, thread.name) for thread in threading.enumerate())
+            thread_stacks, thread_weights = self.samples[thread_id]
+            thread_stacks.append(stack)
+            thread_weights.append(weight)
+
+    def frame_index(self, code):
+        index = self.frame_indexes.get(code)
+        if index is None:
+            index = self.frame_indexes[code] = len(self.frames)
+            self.frames.append({"name": code.co_qualname, "file": code.co_filename, "line": code.co_firstlineno})
+        return index
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.end_time = time.perf_counter()
+        return self
+
+    # The profile as a speedscope file, one sampled profile per thread with samples, the busiest thread first
+    def to_speedscope(self, name: str) -> dict:
+        profiles = []
+        for thread_id, (stacks, weights) in sorted(self.samples.items(), key=lambda item: -sum(item[1][1])):
+            profiles.append({"type": "sampled", "name": f"{self.thread_names.get(thread_id, 'thread')} ({thread_id})", "unit": "seconds",
+                             "startValue": 0, "endValue": sum(weights), "samples": stacks, "weights": weights})
+        return {"$schema": "https://www.speedscope.app/file-format-schema.json", "name": name, "exporter": f"{settings.PROJECT_NAME} profiler",
+                "activeProfileIndex": 0, "shared": {"frames": self.frames}, "profiles": profiles}
+
+# Whether to profile a request: a valid profiling header, or a sampled /predict request
+def should_profile(path: str, headers: dict) -> bool:
+    secret = headers.get(PROFILING_HEADER)
+    if secret is not None and settings.PROFILING_SECRET and secrets.compare_digest(secret, settings.PROFILING_SECRET):
+        return True
+    return path.endswith("/predict") and random.random() < settings.PROFILING_SAMPLE_RATE
+
+def write_profile(profile: dict, name: str, directory: str | None = None) -> str:
+    directory = directory or PROFILES_DIR
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name + PROFILE_SUFFIX), "w") as f:
+        json.dump(profile, f, separators=(",", ":"))
+    # Keep the PROFILING_MAX_FILES most recent profiles
+    for old_profile in list_profiles(directory)[settings.PROFILING_MAX_FILES:]:
+        os.remove(os.path.join(directory, old_profile["name"]))
+    return name + PROFILE_SUFFIX
+
+# The profiles in the directory, the most recent first
+def list_profiles(directory: str | None = None) -> list:
+    directory = directory or PROFILES_DIR
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in os.listdir(directory):
+        if name.endswith(PROFILE_SUFFIX):
+            stat = os.stat(os.path.join(directory, name))
+            profiles.append({"name": name, "size_bytes": stat.st_size, "created": stat.st_mtime})
+    return sorted(profiles, key=lambda profile: -profile["created"])
+
+# The path of a listed profile, None for any other name (so a name can't point outside the profiles directory)
+def profile_path(name: str, directory: str | None = None) -> str | None:
+    directory = directory or PROFILES_DIR
+    if name not in {profile["name"] for profile in list_profiles(directory)}:
+        return None
+    return os.path.join(directory, name)
+
+# ASGI middleware profiling the requests should_profile picks, the profile's file name is returned in an x-profile-id header
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (settings.PROFILING_SECRET or settings.PROFILING_SAMPLE_RATE):
+            return await self.app(scope, receive, send)
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        if not should_profile(scope["path"], headers) or not profile_lock.acquire(blocking=False):
+            return await self.app(scope, receive, send)
+
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}_{re.sub(r'[^A-Za-z0-9]+', '-', scope['path']).strip('-')}_{secrets.token_hex(4)}"
+        profiler = SamplingProfiler(settings.PROFILING_INTERVAL_MS / 1000).start()
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", (name + PROFILE_SUFFIX).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.stop()
+            profile_lock.release()
+            try:
+                await asyncio.to_thread(write_profile, profiler.to_speedscope(f"{scope['method']} {scope['path']}"), name)
+                log(f"Profiled {scope['method']} {scope['path']} in {profiler.end_time - profiler.start_time:.3f}s - {name + PROFILE_SUFFIX}")
+            except Exception as e:
+                log(f"Error in writing the profile {name} - {str(e)}", logging.ERROR)
@@ -0,0 +1,146 @@
+import json
+import os
+import secrets
+import threading
+import time
+from contextvars import ContextVar
+from app.core.config import settings
+from app.core.memory import current_memory_trace
+
+# Per-request latency tracing: the stages of a request are recorded as spans of the request's Trace, returned in a Server-Timing
+# header and optionally appended to TRACING_EXPORT_FILE as OTLP-style JSON. When tracing is off no Trace is started, so a span
+# costs a context variable lookup
+current_trace: ContextVar["Trace | None"] = ContextVar("current_trace", default=None)
+current_span_id: ContextVar[str | None] = ContextVar("current_span_id", default=None)
+export_lock = threading.Lock()
+
+class Trace:
+    def __init__(self, name: str, attributes: dict | None = None):
+        self.trace_id = secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8) # The root span, the whole request
+        self.name = name
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.spans = [] # (span id, parent span id, name, start ns, end ns, attributes), appended from the request's threads too
+
+    def add_span(self, name: str, start_ns: int, end_ns: int, parent_id: str | None = None, **attributes):
+        span_id = secrets.token_hex(8)
+        self.spans.append((span_id, parent_id or self.span_id, name, start_ns, end_ns, attributes))
+        return span_id
+
+    def finish(self):
+        self.end_ns = time.time_ns()
+
+    # Server-Timing header value: the duration of each stage in ms (summed when a stage ran several times) and the total
+    def server_timing(self) -> str:
+        durations = {}
+        for _, _, name, start_ns, end_ns, _ in self.spans:
+            durations[name] = durations.get(name, 0) + end_ns - start_ns
+        end_ns = self.end_ns or time.time_ns()
+        durations["total"] = end_ns - self.start_ns
+        return ", ".join(f"{name};dur={duration / 1e6:.2f}" for name, duration in durations.items())
+
+    # The trace as an OTLP JSON ExportTraceServiceRequest
+    def to_otlp(self) -> dict:
+        def otlp_span(span_id, parent_id, name, start_ns, end_ns, attributes):
+            span = {"traceId": self.trace_id, "spanId": span_id, "name": name, "kind": 1,
+                    "startTimeUnixNano": str(start_ns), "endTimeUnixNano": str(end_ns),
+                    "attributes": [{"key": key, "value": otlp_value(value)} for key, value in attributes.items()]}
+            if parent_id:
+                span["parentSpanId"] = parent_id
+            return span
+
+        spans = [otlp_span(self.span_id, None, self.name, self.start_ns, self.end_ns or time.time_ns(), self.attributes)]
+        spans.extend(otlp_span(*span) for span in self.spans)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": settings.PROJECT_NAME}},
+                                        {"key": "service.version", "value": {"stringValue": settings.PROJECT_VERSION}}]},
+            "scopeSpans": [{"scope": {"name": "cashcam.tracing"}, "spans": spans}],
+        }]}
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+# Time a stage of the current request: `with span("detect"):`, spans opened inside it are its children
+# The stage's memory is accounted too when the request is sampled for memory accounting (app.core.memory)
+class span:
+    __slots__ = ("name", "attributes", "trace", "start_ns", "token", "span_id", "memory_trace")
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.trace = None
+        self.memory_trace = None
+
+    def __enter__(self):
+        self.memory_trace = current_memory_trace.get()
+        if self.memory_trace is not None:
+            self.memory_trace.enter(self.name)
+        self.trace = current_trace.get()
+        if self.trace is not None:
+            self.span_id = secrets.token_hex(8)
+            self.token = current_span_id.set(self.span_id)
+            self.start_ns = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.trace is not None:
+            end_ns = time.time_ns()
+            current_span_id.reset(self.token)
+            self.trace.spans.append((self.span_id, current_span_id.get() or self.trace.span_id, self.name, self.start_ns, end_ns, self.attributes))
+        if self.memory_trace is not None:
+            self.memory_trace.exit()
+        return False
+
+# Record a stage that was timed elsewhere (e.g. in an inference worker process) as a span of the current request ending at end_ns
+def record_span(name: str, seconds: float, end_ns: int | None = None, **attributes):
+    trace = current_trace.get()
+    if trace is None:
+        return
+    end_ns = end_ns or time.time_ns()
+    trace.add_span(name, end_ns - int(seconds * 1e9), end_ns, current_span_id.get(), **attributes)
+
+# Append a finished trace to the export file, one OTLP JSON object per line
+def export_trace(trace: Trace, path: str | None = None):
+    path = path or settings.TRACING_EXPORT_FILE
+    if not path:
+        return
+    line = json.dumps(trace.to_otlp(), separators=(",", ":"))
+    with export_lock:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "a") as f:
+            f.write(line + "\n")
+
+# ASGI middleware tracing the HTTP requests when TRACING_ENABLED is set, requests pass straight through otherwise
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.TRACING_ENABLED:
+            return await self.app(scope, receive, send)
+
+        trace = Trace(f"{scope['method']} {scope['path']}", {"http.method": scope["method"], "http.target": scope["path"]})
+        token = current_trace.set(trace)
+
+        async def send_with_server_timing(message):
+            if message["type"] == "http.response.start":
+                trace.finish()
+                trace.attributes["http.status_code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", trace.server_timing().encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_server_timing)
+        finally:
+            current_trace.reset(token)
+            if trace.end_ns is None:
+                trace.finish()
+            export_trace(trace)
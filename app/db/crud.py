@@ -138,15 +138,32 @@ def get_image(db: Session, image_id: str) -> db_models.Image | None:
         return image
 
 # Add an image to the database and link it to a user by user id
-def save_image(db: Session, image: str, user_id: str, currencies: dict[str: int]) -> str:
+def save_image(db: Session, image: str, user_id: str, currencies: dict[str: int], model_version: str | None = None) -> str:
     log(f"Adding image to the database for user id:{user_id}", debug=True)
-    db_image = db_models.Image(base64_string= image, user_id=user_id, flagged=False, currencies=currencies)
+    db_image = db_models.Image(base64_string= image, user_id=user_id, flagged=False, currencies=currencies, model_version=model_version)
     db.add(db_image)
     db.commit()
     db.refresh(db_image)
     log(f"Image added successfully! id:{db_image.id}")
     return db_image.id
 
+# Add many images of a user to the database in a single transaction, either all of them are saved or none
+# images: (base64 image, currencies, model version) of each image, returns the images' ids in the same order
+def save_images(db: Session, images: list[tuple[str, dict[str: int], str | None]], user_id: str) -> list[str]:
+    log(f"Adding {len(images)} images to the database for user id:{user_id}", debug=True)
+    db_images = [db_models.Image(base64_string= image, user_id=user_id, flagged=False, currencies=currencies, model_version=model_version)
+                 for image, currencies, model_version in images]
+    try:
+        db.add_all(db_images)
+        db.flush() # Generates the ids, read before the commit expires the rows
+        image_ids = [db_image.id for db_image in db_images]
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    log(f"{len(image_ids)} images added successfully! ids:{image_ids}")
+    return image_ids
+
 # Get all images from a user by user id
 def get_images_by_user_id(db: Session, user_id: str, skip: int = 0, limit: int = 100) -> list[db_models.Image] | None:
     images = db.query(db_models.Image).filter(db_models.Image.user_id == user_id).offset(skip).limit(limit).all()
@@ -1,5 +1,5 @@
 import logging
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.logs.logger_config import log
@@ -21,4 +21,17 @@ def get_db():
         log(f"Database notification - {str(e)}", logging.INFO)
         raise e
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# Add the columns added to the db models since their tables were created (create_all only creates the missing tables)
+def add_missing_columns(engine, base):
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"))
+                    log(f"Added column {column.name} to table {table.name}")
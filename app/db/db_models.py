@@ -44,5 +44,6 @@ class Image(Base):
     user_id = Column(String, ForeignKey("users.id"), nullable=True) # An image belongs to a user unless it was sent by an unregistered user (null)
     currencies= Column(JSONEncodeDict) # The detected currencies and their respective amount in the image
     flagged = Column(Boolean, default=False) # When true, the image is flagged for review due to a possible error with prediction results
+    model_version = Column(String, nullable=True) # Version of the models that predicted the image (null for images saved before versions were recorded)
 
     user = relationship("User", back_populates="images")
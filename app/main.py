@@ -17,9 +17,16 @@ from app.schemas import user_schemas
 from app.api.endpoints.auth import auth_router
 from app.logs.logger_config import log
 import asyncio
-from app.db.database import engine
+from app.db.database import engine, add_missing_columns
 from app.db import db_models
 from app.services.currency_exchange import exchange_service
+from app.services.inference_scheduler import inference_scheduler
+from app.services.prediction_jobs import prediction_jobs
+from app.ml.inference_executor import inference_executor
+from app.core.tracing import TracingMiddleware
+from app.core.profiling import ProfilingMiddleware
+from app.core.memory import MemoryProfilingMiddleware
+from app.services.model_registry import model_registry
 from contextlib import asynccontextmanager
 from typing import Annotated, List
 
@@ -31,9 +38,21 @@ async def lifespan(app: FastAPI):
         log("Server started.")
         # Create the database tables
         db_models.Base.metadata.create_all(bind=engine)
+        add_missing_columns(engine, db_models.Base)
         # Create exchange rate task
         fetch_exchange_rate_task = asyncio.create_task(exchange_service.update_rates_daily())
         server_tasks.append(fetch_exchange_rate_task)
+        # Start the inference worker processes and the scheduler batching concurrent /predict requests into them
+        inference_executor.start()
+        server_tasks.append(inference_scheduler.start())
+        # Start the worker pool of the asynchronous prediction jobs
+        server_tasks.append(prediction_jobs.start())
+        # Load and warm up the models in the background, /ready reports when it's done
+        warmup_task = asyncio.create_task(inference_executor.warmup())
+        server_tasks.append(warmup_task)
+        # Hot swap to the model files once they're replaced
+        if settings.MODEL_WATCH_INTERVAL_SECONDS > 0:
+            server_tasks.append(model_registry.start_watching())
         
         #TODO: protect routes with authentication
 
@@ -43,6 +62,8 @@ async def lifespan(app: FastAPI):
         for task in server_tasks:
             task.cancel()
         await asyncio.gather(*server_tasks, return_exceptions=True)
+        # Stop the inference worker processes
+        inference_executor.shutdown()
         # Close the database engine
         engine.dispose()
         
@@ -53,6 +74,9 @@ async def lifespan(app: FastAPI):
 app = FastAPI(lifespan=lifespan, title=settings.PROJECT_NAME, version=settings.PROJECT_VERSION)
 app.include_router(api_router, prefix=settings.API_PREFIX)
 app.include_router(auth_router, prefix="/auth")
+app.add_middleware(TracingMiddleware) # Server-Timing headers, when TRACING_ENABLED is set
+app.add_middleware(ProfilingMiddleware) # Sampled stack profiles of the requests picked by PROFILING_SECRET / PROFILING_SAMPLE_RATE
+app.add_middleware(MemoryProfilingMiddleware) # Per-stage memory of a MEMORY_PROFILING_SAMPLE_RATE fraction of the /predict requests
 
 # Global exception handler
 @app.exception_handler(RequestValidationError)
@@ -85,7 +109,16 @@ async def root(request: Request, user: user_dependency):
         return {"message": f"Welcome back, {user.name}!"}
     return {"message": "Welcome to CashCam!"}
 
+# Readiness route, only returns 200 once the models are loaded and warmed up
+@app.get("/ready")
+async def ready():
+    if inference_executor.ready:
+        return {"status": "ready", "startup_timings": inference_executor.startup_timings}
+    if inference_executor.warmup_error:
+        return JSONResponse(status_code=503, content={"status": "error", "detail": inference_executor.warmup_error})
+    return JSONResponse(status_code=503, content={"status": "warming up"})
+
 #Allows to skip this function: 'uvicorn app.main:app --reload' and just run the main.py file
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("app.main:app", host=settings.LOCAL_IP, port=settings.PORT, reload=True)
+    uvicorn.run("app.main:app", host=settings.LOCAL_IP, port=settings.PORT, workers=settings.SERVER_WORKERS, reload=settings.SERVER_WORKERS == 1)
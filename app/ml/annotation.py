@@ -0,0 +1,80 @@
+import functools
+import math
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+BOX_WIDTH = 2
+TEXT_COLOR = (255, 255, 255)
+UNKNOWN_COLOR = (255, 0, 0) # Red
+CURRENCY_COLORS = {"NIS": (0, 0, 255), "EUR": (255, 165, 0), "USD": (0, 128, 0)} # Blue, orange and green, by the currency prefix of the app's labels (NIS_C_10, EUR_B_5...)
+
+FONT = ImageFont.load_default()
+LINE_HEIGHT = FONT.getbbox("Ag(0.99)|")[3] + 1
+
+# Color of every denomination, by the classifier's class name ('5 NIS') and by the app's label ('NIS_C_500'), built once from
+# MyModel.currencies_dict: the color of the label's currency
+@functools.lru_cache(maxsize=None)
+def denomination_colors() -> dict:
+    from app.ml.model import MyModel # Imported here, app.ml.model imports this module
+    colors = {}
+    for class_name, label in MyModel.currencies_dict.items():
+        colors[class_name] = colors[label] = CURRENCY_COLORS.get(label.split("_")[0], UNKNOWN_COLOR)
+    return colors
+
+# Color of a classified class, 'Unknown' and classes missing from the table are drawn in UNKNOWN_COLOR
+def class_color(classified_class: str):
+    return denomination_colors().get(classified_class, UNKNOWN_COLOR)
+
+# Pre-rendered label part: white text on the box color, rendered once per (text, color)
+# Labels are built from a few parts ('5 NIS ', '(0.93)'...) so the sprites are shared between denominations and confidences
+@functools.lru_cache(maxsize=4096)
+def label_sprite(text: str, color) -> Image.Image:
+    sprite = Image.new("RGB", (max(1, math.ceil(FONT.getlength(text))), LINE_HEIGHT), color)
+    ImageDraw.Draw(sprite).text((0, 0), text, fill=TEXT_COLOR, font=FONT)
+    return sprite
+
+def label_parts(original_class, confidence, classified_class, class_confidence):
+    if classified_class != "Unknown":
+        return (f"{classified_class} ", f"({class_confidence:.2f})")
+    return (f"{original_class} ", f"({confidence:.2f})", " - Unknown")
+
+# Draw the detections on the image in place: a box per object in its denomination's color, and its label sprites pasted at the box's corner
+# scale maps the detections' coordinates to the image's (e.g. when rendering to a downscaled output)
+def draw_detections(image: Image.Image, detections, scale=1.0):
+    if not len(detections):
+        return image
+
+    draw = ImageDraw.Draw(image)
+    xyxy = detections.xyxy if scale == 1.0 else (detections.xyxy * scale).astype(int)
+    rows = zip(xyxy.tolist(), detections.det_class_names.tolist(), detections.det_conf.tolist(), detections.cls_class_names.tolist(), detections.cls_conf.tolist())
+    for (x1, y1, x2, y2), original_class, confidence, classified_class, class_confidence in rows:
+        color = class_color(classified_class)
+        draw.rectangle([x1, y1, x2, y2], outline=color, width=BOX_WIDTH)
+
+        x = x1
+        for part in label_parts(original_class, confidence, classified_class, class_confidence):
+            sprite = label_sprite(part, color)
+            image.paste(sprite, (x, y1))
+            x += sprite.width
+    return image
+
+# Make the image annotations are drawn on: the image itself for PIL images, a copy for arrays (they are shared with the other stages)
+# Images with a long side over max_side are downscaled, returns the image and the scale of the detections to it
+def annotation_canvas(image, max_side: int = 0):
+    height, width = (image.height, image.width) if isinstance(image, Image.Image) else image.shape[:2]
+    scale = max_side / max(height, width) if max_side and max(height, width) > max_side else 1.0
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if isinstance(image, np.ndarray):
+        return Image.fromarray(image if scale == 1.0 else cv2.resize(image, size, interpolation=cv2.INTER_AREA)), scale
+
+    canvas = image if image.mode == "RGB" else image.convert("RGB")
+    if scale != 1.0:
+        canvas = canvas.resize(size, Image.BILINEAR, reducing_gap=2.0)
+    return canvas, scale
+
+# Make a transparent image of the image's size (downscaled to max_side) to draw the annotations on, for clients that composite them
+def overlay_canvas(image_shape, max_side: int = 0):
+    height, width = image_shape[:2]
+    scale = max_side / max(height, width) if max_side and max(height, width) > max_side else 1.0
+    return Image.new("RGBA", (max(1, round(width * scale)), max(1, round(height * scale))), (0, 0, 0, 0)), scale
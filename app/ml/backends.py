@@ -0,0 +1,87 @@
+import hashlib
+import logging
+import os
+from app.core.config import settings
+from app.logs.logger_config import log
+
+# Inference backends the models can run on. Every backend is an ultralytics export of the PyTorch .pt weights,
+# loaded back through YOLO() so MyModel gets the same results API whatever the backend is
+BACKENDS = {
+    "pytorch": {"format": None, "suffix": ".pt"},
+    "onnx": {"format": "onnx", "suffix": ".onnx"}, # Runs on ONNX Runtime
+    "openvino": {"format": "openvino", "suffix": "_openvino_model"}, # A directory with the OpenVINO IR files
+    "torchscript": {"format": "torchscript", "suffix": ".torchscript"},
+}
+
+# Numeric precisions the models can be served at, INT8 models are made by tools.quantize and run on ONNX Runtime
+PRECISIONS = ("fp32", "int8")
+INT8_SUFFIX = "_int8.onnx"
+
+YOLO = None # ultralytics.YOLO, imported on first use since importing ultralytics takes seconds
+
+def import_yolo():
+    global YOLO
+    if YOLO is None:
+        from ultralytics import YOLO as ultralytics_yolo
+        YOLO = ultralytics_yolo
+    return YOLO
+
+# Get the backend an artifact runs on from its path (a .pt file runs on the backend set in MODEL_BACKEND)
+def backend_of(model_path: str) -> str:
+    for backend, info in BACKENDS.items():
+        if backend != "pytorch" and model_path.rstrip("/\\").endswith(info["suffix"]):
+            return backend
+    return "pytorch"
+
+# Get the path of a model's exported artifact for a backend and precision ('models/detection_model.pt' -> 'models/detection_model.onnx')
+# Paths that already point to an exported artifact are returned as they are
+def resolve_model_path(model_path: str, backend: str | None = None, precision: str | None = None) -> str:
+    backend = backend or settings.MODEL_BACKEND
+    precision = precision or settings.MODEL_PRECISION
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown model backend '{backend}', expected one of {list(BACKENDS)}")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown model precision '{precision}', expected one of {list(PRECISIONS)}")
+    if precision == "int8" and backend != "onnx":
+        raise ValueError(f"INT8 models run on the onnx backend, not on {backend}")
+    if backend_of(model_path) != "pytorch" or backend == "pytorch":
+        return model_path
+    return os.path.splitext(model_path)[0] + (INT8_SUFFIX if precision == "int8" else BACKENDS[backend]["suffix"])
+
+# Export the PyTorch weights to a backend, returns the exported artifact's path
+# Exports use dynamic shapes so batched inference works on every backend
+def export_model(model_path: str, backend: str, **export_args) -> str:
+    if backend == "pytorch":
+        return model_path
+    log(f"Exporting {model_path} to {backend}")
+    exported_path = import_yolo()(model_path, task="detect").export(format=BACKENDS[backend]["format"], dynamic=True, **export_args)
+    log(f"Exported {model_path} to {exported_path}")
+    return str(exported_path)
+
+# Load a model on a backend and precision (MODEL_BACKEND and MODEL_PRECISION by default), exporting it first if MODEL_BACKEND_AUTO_EXPORT is set
+# INT8 models are never made on the fly since quantizing them needs calibration images
+def load_model(model_path: str, backend: str | None = None, precision: str | None = None):
+    backend = backend or settings.MODEL_BACKEND
+    resolved_path = resolve_model_path(model_path, backend, precision)
+    if not os.path.exists(resolved_path) and resolved_path != model_path:
+        if resolved_path.endswith(INT8_SUFFIX):
+            log(f"Model {resolved_path} not found for the int8 precision", logging.CRITICAL)
+            raise FileNotFoundError(f"Model {resolved_path} not found, quantize it with 'python -m tools.quantize --calibration-images <dir>'")
+        if not settings.MODEL_BACKEND_AUTO_EXPORT:
+            log(f"Model {resolved_path} not found for the {backend} backend", logging.CRITICAL)
+            raise FileNotFoundError(f"Model {resolved_path} not found, export it with 'python -m tools.compare_backends --export --backends {backend}'")
+        resolved_path = export_model(model_path, backend)
+
+    log(f"Loading {resolved_path} on the {backend_of(resolved_path)} backend", debug=True)
+    return import_yolo()(resolved_path, task="detect")
+
+# Version id of a set of model files: a short hash of their names, sizes and modification times, it changes whenever a file is replaced
+def version_of(*model_paths: str) -> str:
+    digest = hashlib.blake2b(digest_size=6)
+    for model_path in model_paths:
+        try:
+            stat = os.stat(model_path)
+            digest.update(f"{model_path}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        except OSError:
+            digest.update(f"{model_path};".encode())
+    return digest.hexdigest()
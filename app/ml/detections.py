@@ -0,0 +1,157 @@
+import numpy as np
+
+UNKNOWN = "Unknown"
+
+# Map class ids to class names with a lookup array, ids missing from names (and -1, not classified) map to 'Unknown'
+def map_names(ids, names):
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) == 0:
+        return np.array([], dtype=object)
+    lookup = np.array([names.get(i, UNKNOWN) for i in range(max(int(ids.max()), 0) + 1)] + [UNKNOWN], dtype=object)
+    return lookup[np.where(ids >= 0, ids, len(lookup) - 1)]
+
+# Pairwise overlap of the (N, 4) xyxy boxes_a with the (M, 4) boxes_b (boxes_a with themselves by default), returns an (N, M) matrix
+# mode 'iou': intersection over union, 'smaller': intersection over the smaller box's area (1 when a box is inside the other)
+def box_overlaps(boxes_a, boxes_b=None, mode: str = "iou") -> np.ndarray:
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = boxes_a if boxes_b is None else np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area_a = (boxes_a[:, 2:] - boxes_a[:, :2]).prod(axis=1)
+    area_b = (boxes_b[:, 2:] - boxes_b[:, :2]).prod(axis=1)
+    if mode == "smaller":
+        return intersection / np.maximum(np.minimum(area_a[:, None], area_b[None, :]), 1e-6)
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-6)
+
+# Greedy suppression of boxes sorted by priority: each kept box suppresses the later boxes it's marked against in the (N, N)
+# suppress matrix. Returns the mask of the kept boxes
+def greedy_suppress(suppress: np.ndarray) -> np.ndarray:
+    keep = np.ones(len(suppress), dtype=bool)
+    for i in range(len(suppress)):
+        if keep[i]:
+            keep[i + 1:] &= ~suppress[i, i + 1:]
+    return keep
+
+# Columnar detection results of one image: one row per detected object, stored as NumPy columns
+#   xyxy: (N, 4) int32 boxes in the image's pixel coordinates
+#   det_cls, det_conf: the detection model's class id and confidence
+#   cls_id, cls_conf: the classification model's class id (-1 = not classified / 'Unknown') and confidence
+# det_names and cls_names are the two models' {class id: class name} dictionaries, model_version the version of the models that made them
+class Detections:
+    def __init__(self, xyxy=None, det_cls=None, det_conf=None, cls_id=None, cls_conf=None, det_names=None, cls_names=None, model_version=None):
+        self.xyxy = np.asarray(xyxy if xyxy is not None else [], dtype=np.int32).reshape(-1, 4)
+        count = len(self.xyxy)
+        self.det_cls = np.asarray(det_cls if det_cls is not None else np.zeros(count), dtype=np.int32).reshape(count)
+        self.det_conf = np.asarray(det_conf if det_conf is not None else np.zeros(count), dtype=np.float32).reshape(count)
+        self.cls_id = np.asarray(cls_id if cls_id is not None else np.full(count, -1), dtype=np.int32).reshape(count)
+        self.cls_conf = np.asarray(cls_conf if cls_conf is not None else np.zeros(count), dtype=np.float32).reshape(count)
+        self.det_names = dict(det_names or {})
+        self.cls_names = dict(cls_names or {})
+        self.model_version = model_version
+        self.pruned = {} # Objects dropped or not classified by MyModel.prune_detections, by reason
+        self.timings = {} # Seconds the batch that made them spent on each stage (detect, classify)
+
+    # ----------------- Build the detections of a YOLO result: threshold, scale to the image and clip with masks ----------------- #
+    # scale maps the boxes from the model input's coordinates to the image's (x, y), image_shape is the image's (height, width)
+    # offset is the (x, y) position of the model input in the image (a tile's corner)
+    @classmethod
+    def from_result(cls, result, names, confidence_threshold, scale=(1.0, 1.0), image_shape=None, offset=(0, 0)):
+        xyxy = np.asarray(result.boxes.xyxy.cpu().numpy(), dtype=np.float32).reshape(-1, 4)
+        det_cls = np.asarray(result.boxes.cls.cpu().numpy()).reshape(-1)
+        det_conf = np.asarray(result.boxes.conf.cpu().numpy()).reshape(-1)
+
+        keep = det_conf >= confidence_threshold
+        xyxy = xyxy[keep] * np.array([scale[0], scale[1], scale[0], scale[1]], dtype=np.float32)
+        if offset != (0, 0):
+            xyxy += np.array([offset[0], offset[1], offset[0], offset[1]], dtype=np.float32)
+        if image_shape is not None:
+            height, width = image_shape[:2]
+            xyxy = np.clip(xyxy, 0, np.array([width, height, width, height], dtype=np.float32))
+        return cls(xyxy, det_cls[keep], det_conf[keep], det_names=names)
+
+    # ----------------- Build detections from the (boxes_and_classes, classified_objects) tuple lists ----------------- #
+    @classmethod
+    def from_tuples(cls, boxes_and_classes, classified_objects=None):
+        if classified_objects is not None and len(boxes_and_classes) != len(classified_objects):
+            raise ValueError("The number of bounding boxes and classified objects must match.")
+        det_names = {name: i for i, name in enumerate(dict.fromkeys(box[4] for box in boxes_and_classes))}
+        cls_names = {name: i for i, name in enumerate(dict.fromkeys(name for name, _ in classified_objects or [] if name != UNKNOWN))}
+        return cls(
+            [box[:4] for box in boxes_and_classes],
+            [det_names[box[4]] for box in boxes_and_classes],
+            [box[5] for box in boxes_and_classes],
+            [cls_names.get(name, -1) for name, _ in classified_objects] if classified_objects is not None else None,
+            [conf for _, conf in classified_objects] if classified_objects is not None else None,
+            det_names={i: name for name, i in det_names.items()},
+            cls_names={i: name for name, i in cls_names.items()})
+
+    def __len__(self):
+        return len(self.xyxy)
+
+    # Select rows with a slice, an index array or a boolean mask
+    def __getitem__(self, index):
+        return Detections(self.xyxy[index], self.det_cls[index], self.det_conf[index], self.cls_id[index], self.cls_conf[index], self.det_names, self.cls_names, self.model_version)
+
+    # Concatenate the detections of the same models (e.g. to classify the crops of several images together)
+    @classmethod
+    def concatenate(cls, detections_list):
+        if not detections_list:
+            return cls()
+        return cls(
+            np.concatenate([d.xyxy for d in detections_list]),
+            np.concatenate([d.det_cls for d in detections_list]),
+            np.concatenate([d.det_conf for d in detections_list]),
+            np.concatenate([d.cls_id for d in detections_list]),
+            np.concatenate([d.cls_conf for d in detections_list]),
+            detections_list[0].det_names,
+            detections_list[0].cls_names,
+            detections_list[0].model_version)
+
+    # Set the classification model's results (class ids with -1 for unclassified objects, confidences and the model's names)
+    def set_classifications(self, cls_id, cls_conf, cls_names):
+        self.cls_id = np.asarray(cls_id, dtype=np.int32).reshape(len(self))
+        self.cls_conf = np.asarray(cls_conf, dtype=np.float32).reshape(len(self))
+        self.cls_names = dict(cls_names)
+        return self
+
+    @property
+    def nbytes(self):
+        return self.xyxy.nbytes + self.det_cls.nbytes + self.det_conf.nbytes + self.cls_id.nbytes + self.cls_conf.nbytes
+
+    @property
+    def det_class_names(self):
+        return map_names(self.det_cls, self.det_names)
+
+    @property
+    def cls_class_names(self):
+        return map_names(self.cls_id, self.cls_names)
+
+    # Crop every box out of the image, the crops are views of the image array
+    def crops(self, image):
+        return [image[y1:y2, x1:x2] for x1, y1, x2, y2 in self.xyxy.tolist()]
+
+    # Number of objects per classified class name, unclassified objects are counted as 'Unknown'
+    def class_counts(self):
+        ids, counts = np.unique(self.cls_id, return_counts=True)
+        names = map_names(ids, self.cls_names)
+        class_counts = {}
+        for name, count in zip(names.tolist(), counts.tolist()):
+            class_counts[name] = class_counts.get(name, 0) + count
+        return class_counts
+
+    # The detections as the (x1, y1, x2, y2, detected class name, confidence) tuples of boxes_and_classes
+    def boxes_and_classes(self):
+        return [(x1, y1, x2, y2, name, conf) for (x1, y1, x2, y2), name, conf in zip(self.xyxy.tolist(), self.det_class_names.tolist(), self.det_conf.tolist())]
+
+    # The classifications as the (class name, confidence) tuples of classified_objects
+    def classified_objects(self):
+        return list(zip(self.cls_class_names.tolist(), self.cls_conf.tolist()))
+
+    def __eq__(self, other):
+        return (isinstance(other, Detections)
+                and self.boxes_and_classes() == other.boxes_and_classes()
+                and self.classified_objects() == other.classified_objects())
+
+    def __repr__(self):
+        return f"Detections({len(self)} objects: {self.classified_objects()})"
@@ -0,0 +1,68 @@
+import io
+import cv2
+import numpy as np
+from PIL import ExifTags, Image, ImageOps
+from app.core.config import settings
+from app.ml.tiling import should_tile
+
+# Decode an encoded image (JPEG, PNG...) into the single RGB uint8 array every stage of /predict reuses
+# Large photos are decoded downscaled while their long side stays >= IMAGE_DECODE_TARGET_SIDE, so the crops keep enough resolution
+# for the classifier: JPEGs by DCT scaling in draft mode (only by 1/2, 1/4 or 1/8, the largest of them not going under the target),
+# other formats by an integer factor with reduce().
+# Uploads over TILED_INFERENCE_MIN_PIXELS are decoded at full resolution, their objects are detected in tiles (see should_tile)
+# The EXIF orientation is applied once, here, and the PIL image is released as soon as its pixels are in the array
+def decode_image(image_data: bytes, target_side: int | None = None) -> np.ndarray:
+    with Image.open(io.BytesIO(image_data)) as image:
+        factor = downscale_factor(image, target_side)
+        if factor >= 2:
+            if image.format == "JPEG":
+                image.draft("RGB", (image.width // factor, image.height // factor))
+            else:
+                image = image.reduce(factor)
+        image = ImageOps.exif_transpose(image) if has_exif_orientation(image) else image
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return np.asarray(image)
+
+# Number of pixels decode_image will decode an encoded image to, from its header only (no pixel is decoded)
+# A JPEG's size is the one draft() picks (it only configures the decoder), other formats are reduced by the integer factor
+def decoded_pixels(image_data: bytes, target_side: int | None = None) -> int:
+    with Image.open(io.BytesIO(image_data)) as image:
+        factor = downscale_factor(image, target_side)
+        if factor >= 2:
+            if image.format == "JPEG":
+                image.draft("RGB", (image.width // factor, image.height // factor))
+                return image.width * image.height
+            return -(-image.width // factor) * -(-image.height // factor) # reduce() keeps the partial last block
+        return image.width * image.height
+
+# The integer factor an opened image is decoded downscaled by, 1 for the uploads tiled at full resolution
+def downscale_factor(image: Image.Image, target_side: int | None = None) -> int:
+    target_side = settings.IMAGE_DECODE_TARGET_SIDE if target_side is None else target_side
+    if target_side <= 0 or should_tile((image.height, image.width)):
+        return 1
+    return max(image.size) // target_side
+
+def has_exif_orientation(image: Image.Image) -> bool:
+    return image.getexif().get(ExifTags.Base.Orientation, 1) != 1
+
+# Get an image's pixels as an RGB uint8 array, RGB arrays are returned as they are (no copy)
+def as_rgb_array(image) -> np.ndarray:
+    if isinstance(image, Image.Image):
+        return np.asarray(image if image.mode == "RGB" else image.convert("RGB"))
+    if isinstance(image, np.ndarray) and image.ndim == 3 and image.shape[2] == 3:
+        return image
+    raise TypeError(f"Expected a PIL image or an RGB array, got {type(image).__name__}")
+
+# Make the detection model's input from the shared RGB array: downscaled so its long side is DETECTION_INPUT_SIZE
+# (the model letterboxes to that size anyway) and in the BGR order YOLO expects from numpy arrays
+# Returns the input and the (x, y) scale mapping its coordinates back to the full-resolution array
+def detection_input(image: np.ndarray, input_size: int | None = None):
+    input_size = input_size or settings.DETECTION_INPUT_SIZE
+    height, width = image.shape[:2]
+    scale = input_size / max(height, width)
+    if scale < 1:
+        resized_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        image = cv2.resize(image, resized_size, interpolation=cv2.INTER_AREA)
+    model_input = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    return model_input, (width / model_input.shape[1], height / model_input.shape[0])
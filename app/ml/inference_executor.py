@@ -0,0 +1,224 @@
+import logging
+import asyncio
+import os
+import time
+import numpy as np
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from PIL import Image
+from app.core.config import settings
+from app.logs.logger_config import log
+from app.ml import backends
+from app.ml.model import MyModel
+from app.ml.topology import apply_topology
+
+# ----------------------------------------------------------- Worker process side ----------------------------------------------------------- #
+
+WARMUP_TIMEOUT_SECONDS = 300 # Max time a warmed up worker waits for the other workers to finish their warmup
+warmup_barrier = None # Set in every worker process, makes each worker answer exactly one warmup call
+
+# Runs once in every worker process, loads both YOLO models of the pool's version and warms them up
+def init_worker(barrier, detection_model_path, classification_model_path, model_version):
+    global warmup_barrier
+    warmup_barrier = barrier
+    settings.OBJECT_DETECTION_MODEL, settings.CLASSIFICATION_MODEL, settings.MODEL_VERSION = detection_model_path, classification_model_path, model_version
+    log(f"Inference worker {os.getpid()} started - detection model: {settings.OBJECT_DETECTION_MODEL}, classification model: {settings.CLASSIFICATION_MODEL}", debug=True)
+    try:
+        apply_topology()
+        MyModel.warmup()
+    except Exception as e: # Don't break the pool, the error is raised again by warmup_worker
+        log(f"Error in warming up inference worker {os.getpid()} - {str(e)}", logging.CRITICAL)
+
+# Report a worker's cold start timings once every worker is warmed up
+def warmup_worker():
+    timings = MyModel.warmup()
+    warmup_barrier.wait(timeout=WARMUP_TIMEOUT_SECONDS)
+    return os.getpid(), dict(timings)
+
+# Attach to the shared memory images sent by the server process and run them through the models
+# shared_images is a list of (shared memory name, image shape), the images are RGB uint8 arrays
+def infer_shared_images(shared_images, confidence_thresholds):
+    handles = [shared_memory.SharedMemory(name=name) for name, _ in shared_images]
+    try:
+        images = [np.ndarray(shape, dtype=np.uint8, buffer=shm.buf) for shm, (_, shape) in zip(handles, shared_images)]
+        inferred = MyModel.infer_images(images, confidence_thresholds)
+        del images # Release the views on the shared memory before closing it
+        return inferred
+    finally:
+        for shm in handles:
+            try:
+                shm.close()
+            except BufferError: # A view is still referenced (e.g. by a traceback), it's released with it
+                pass
+
+# ----------------------------------------------------------- Server process side ----------------------------------------------------------- #
+
+# Copy a decoded image into a new shared memory block, returns the block and its (name, shape) descriptor
+def share_image(image):
+    if isinstance(image, Image.Image):
+        image = np.asarray(image.convert("RGB") if image.mode != "RGB" else image)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+    np.ndarray(image.shape, dtype=np.uint8, buffer=shm.buf)[...] = image
+    return shm, (shm.name, image.shape)
+
+class InferenceExecutor:
+    def __init__(self):
+        self.pool: ProcessPoolExecutor | None = None
+        self.ready = False # True once the models are loaded and warmed up in every worker
+        self.startup_timings = {}
+        self.warmup_error = None
+        self.model_paths = None # (detection, classification) model paths served, the settings' until a hot swap
+        self.model_version = None
+        self.running_batches = {} # Model version -> number of batches running on it
+        self.drain_waiters = {} # Model version -> future a hot swap waits on until the version's batches are done
+        self.pruned = {"undersized": 0, "duplicates": 0, "early_exits": 0} # Objects not sent to the classifier since startup, by reason
+        self.inferred_objects = 0
+
+    # ----------------- Start the worker processes, every worker loads the two YOLO models once ----------------- #
+    def start(self):
+        self.served_models()
+        if settings.INFERENCE_WORKERS > 0 and self.pool is None:
+            self.pool = self.create_pool(*self.model_paths, self.model_version)
+            log(f"Inference executor started with {settings.INFERENCE_WORKERS} worker processes")
+
+    # The (detection, classification) model paths and the version served, the settings' until a hot swap
+    def served_models(self):
+        if self.model_paths is None:
+            self.model_paths = (settings.OBJECT_DETECTION_MODEL, settings.CLASSIFICATION_MODEL)
+            self.model_version = settings.MODEL_VERSION or backends.version_of(*self.model_paths)
+        return self.model_paths, self.model_version
+
+    def create_pool(self, detection_model_path, classification_model_path, model_version):
+        mp_context = multiprocessing.get_context("spawn") # Don't fork the server's torch/uvicorn state
+        return ProcessPoolExecutor(
+            max_workers=settings.INFERENCE_WORKERS,
+            mp_context=mp_context,
+            initializer=init_worker,
+            initargs=(mp_context.Barrier(settings.INFERENCE_WORKERS), detection_model_path, classification_model_path, model_version))
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+            self.ready = False
+            log("Inference executor shut down")
+
+    # ----------------- Load and warm up the models (in every worker process) and record the cold start timings ----------------- #
+    async def warmup(self):
+        loop = asyncio.get_running_loop()
+        self.start()
+        start_time = time.perf_counter()
+        try:
+            if self.pool is None:
+                apply_topology()
+                models_timings = {"server": dict(await loop.run_in_executor(None, MyModel.warmup))}
+            else:
+                models_timings = await self.warmup_pool(self.pool)
+        except Exception as e:
+            self.warmup_error = str(e)
+            log(f"Error in warming up the models - {str(e)}", logging.CRITICAL)
+            return
+
+        self.startup_timings = {"ready_seconds": round(time.perf_counter() - start_time, 4), "models": models_timings}
+        self.ready = True
+        log(f"Inference executor ready - startup timings: {self.startup_timings}")
+
+    # Warm up every worker of a pool once, returns their cold start timings
+    async def warmup_pool(self, pool):
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[loop.run_in_executor(pool, warmup_worker) for _ in range(settings.INFERENCE_WORKERS)])
+        return {f"worker_{pid}": timings for pid, timings in results}
+
+    # ----------------- Run MyModel.infer_images off the event loop, in a worker process or in a thread when INFERENCE_WORKERS is 0 ----------------- #
+    async def infer_images(self, images, confidence_thresholds):
+        loop = asyncio.get_running_loop()
+        self.start()
+        model_version = self.model_version
+        self.running_batches[model_version] = self.running_batches.get(model_version, 0) + 1
+        try:
+            if self.pool is None:
+                inferred = await loop.run_in_executor(None, MyModel.infer_images, images, confidence_thresholds)
+            else:
+                inferred = await self.infer_shared_images(self.pool, images, confidence_thresholds)
+            self.record_pruning(inferred)
+            return inferred
+        finally:
+            self.running_batches[model_version] -= 1
+            if not self.running_batches[model_version]:
+                del self.running_batches[model_version]
+                waiter = self.drain_waiters.pop(model_version, None)
+                if waiter is not None and not waiter.done():
+                    waiter.set_result(None)
+
+    # Send the images to a worker process through shared memory instead of pickling them
+    async def infer_shared_images(self, pool, images, confidence_thresholds):
+        shared = []
+        try:
+            for image in images:
+                shared.append(share_image(image))
+            return await asyncio.get_running_loop().run_in_executor(pool, infer_shared_images, [descriptor for _, descriptor in shared], confidence_thresholds)
+        except Exception as e:
+            log(f"Error in running inference in a worker process - {str(e)}", logging.ERROR)
+            raise
+        finally:
+            for shm, _ in shared:
+                shm.close()
+                shm.unlink()
+
+    # Add up the objects each batch didn't send to the classifier (counted where the models ran, in a worker process or here)
+    def record_pruning(self, inferred):
+        for detections in inferred:
+            for reason, count in getattr(detections, "pruned", {}).items():
+                self.pruned[reason] = self.pruned.get(reason, 0) + count
+            self.inferred_objects += len(detections)
+
+    def pruning_stats(self):
+        saved = sum(self.pruned.values())
+        detected = self.inferred_objects + self.pruned.get("undersized", 0) + self.pruned.get("duplicates", 0) # Classifier calls without pruning
+        return {
+            **self.pruned,
+            "classifier_calls_saved": saved,
+            "saved_fraction": round(saved / detected, 4) if detected else 0.0,
+            "early_exit_confidence_setting": settings.CLASSIFICATION_EARLY_EXIT_CONFIDENCE,
+        }
+
+    # ----------------- Hot swap: load and warm up a new version of the models next to the served one, then switch to it ----------------- #
+    # New batches run on the new version as soon as it's warmed up (a new pool of worker processes, or new models in this process),
+    # the previous version is released once the batches running on it are done. Returns the swap's timings
+    async def swap_models(self, detection_model_path, classification_model_path, model_version):
+        loop = asyncio.get_running_loop()
+        self.start()
+        previous_version = self.model_version
+        start_time = time.perf_counter()
+
+        previous_pool = None
+        if self.pool is None:
+            models = await loop.run_in_executor(None, MyModel.load_version, detection_model_path, classification_model_path)
+            MyModel.activate(model_version, *models)
+        else:
+            pool = self.create_pool(detection_model_path, classification_model_path, model_version)
+            try:
+                await self.warmup_pool(pool)
+            except Exception:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+            previous_pool, self.pool = self.pool, pool
+        self.model_paths, self.model_version = (detection_model_path, classification_model_path), model_version
+        load_seconds = time.perf_counter() - start_time
+
+        # Wait for the batches still running on the previous version, then release it
+        start_time = time.perf_counter()
+        if previous_version in self.running_batches:
+            waiter = self.drain_waiters[previous_version] = loop.create_future()
+            try:
+                await asyncio.wait_for(waiter, settings.MODEL_SWAP_DRAIN_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                self.drain_waiters.pop(previous_version, None)
+                log(f"Batches on models version {previous_version} still running after {settings.MODEL_SWAP_DRAIN_TIMEOUT_SECONDS}s, releasing it when they're done", logging.WARNING)
+        if previous_pool is not None:
+            await loop.run_in_executor(None, previous_pool.shutdown, True)
+        return {"version": model_version, "previous_version": previous_version,
+                "load_seconds": round(load_seconds, 4), "drain_seconds": round(time.perf_counter() - start_time, 4)}
+
+inference_executor = InferenceExecutor()
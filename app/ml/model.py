@@ -1,16 +1,27 @@
 from app.core.config import settings
-from ultralytics import YOLO
 import numpy as np
-from PIL import Image, ImageDraw
-from app.schemas.predict_schema import CurrencyInfo
+import threading
+import time
+from PIL import Image
+from app.schemas.predict_schema import CurrencyInfo, DetectionInfo
 from app.services.currency_exchange import exchange_service
 import logging
 from app.logs.logger_config import log
+from app.ml import backends
+from app.ml.image_decode import as_rgb_array, detection_input
+from app.ml.detections import Detections, map_names
+from app.ml.tiling import should_tile, tile_grid, merge_tile_boxes, cut_by_tile_edge
+from app.ml.pruning import prune_boxes
+from app.core.tracing import span
+from app.ml.annotation import annotation_canvas, draw_detections, overlay_canvas
 from PIL import UnidentifiedImageError
 
 class MyModel:
-    object_detection_model = YOLO(settings.OBJECT_DETECTION_MODEL)
-    classification_model = YOLO(settings.CLASSIFICATION_MODEL)
+    object_detection_model = None # Loaded on first use or on startup by load_models()
+    classification_model = None
+    model_version = None # Version of the served models (MODEL_VERSION or a hash of their files), recorded with each saved image
+    startup_timings = {} # Cold start breakdown in seconds (import, weight load, first inference, warmup)
+    load_lock = threading.Lock()
     currencies_dict = { # Dictionary mapping the class names to the currency names (keys related to the model and values relate to the app's label)
         '0.1 NIS':'NIS_C_10', '0.5 NIS':'NIS_C_50', '1 NIS':'NIS_C_100', '2 NIS':'NIS_C_200', '5 NIS':'NIS_C_500', '10 NIS':'NIS_C_1000',
         '20 NIS':'NIS_B_20', '50 NIS':'NIS_B_50', '100 NIS':'NIS_B_100', '200 NIS':'NIS_B_200',
@@ -21,119 +32,258 @@ class MyModel:
         'Unknown':'Unknown'
         }
 
+    # Load both YOLO models once on the MODEL_BACKEND backend, importing ultralytics is only paid here and not when importing this module
     @classmethod
-    def detect_and_collect_objects(cls, YOLO_model, image, confidence_threshold=0.5):
-        cropped_images = []
-        boxes_and_classes = []
+    def load_models(cls):
+        if cls.object_detection_model is not None and cls.classification_model is not None:
+            return
+        with cls.load_lock:
+            if cls.object_detection_model is not None and cls.classification_model is not None:
+                return
 
-        # Convert from PIL to numpy array
-        img_np = np.array(image)
+            start_time = time.perf_counter()
+            backends.import_yolo()
+            cls.startup_timings["import_seconds"] = round(time.perf_counter() - start_time, 4)
 
-        # Detect objects in the image
-        results = YOLO_model(image, verbose=False)
+            start_time = time.perf_counter()
+            cls.object_detection_model = backends.load_model(settings.OBJECT_DETECTION_MODEL)
+            cls.classification_model = backends.load_model(settings.CLASSIFICATION_MODEL)
+            cls.model_version = settings.MODEL_VERSION or backends.version_of(settings.OBJECT_DETECTION_MODEL, settings.CLASSIFICATION_MODEL)
+            cls.startup_timings["weight_load_seconds"] = round(time.perf_counter() - start_time, 4)
+            log(f"Models loaded - import: {cls.startup_timings['import_seconds']}s, weight load: {cls.startup_timings['weight_load_seconds']}s")
 
-        detections = results[0].boxes.xyxy.cpu().numpy()
-        classes = results[0].boxes.cls.cpu().numpy()
-        confidences = results[0].boxes.conf.cpu().numpy()
-        names = YOLO_model.names
-        
-        for i, box in enumerate(detections):
-            confidence = confidences[i]
-            if confidence < confidence_threshold:
-                continue  # Skip detections below the confidence threshold
+    # Load the models and run MODEL_WARMUP_RUNS dummy inferences so the first request doesn't pay for the predictor setup
+    @classmethod
+    def warmup(cls):
+        cls.load_models()
+        if "warmup_seconds" in cls.startup_timings:
+            return cls.startup_timings
 
-            x1, y1, x2, y2 = map(int, box)
-            class_name = names[int(classes[i])]
+        start_time = time.perf_counter()
+        first_inference_seconds = cls.run_warmup(cls.object_detection_model, cls.classification_model)
+        if first_inference_seconds is not None:
+            cls.startup_timings["first_inference_seconds"] = round(first_inference_seconds, 4)
+        cls.startup_timings["warmup_seconds"] = round(time.perf_counter() - start_time, 4)
 
-            # Crop the detected region
-            cropped_img = img_np[y1:y2, x1:x2]
+        log(f"Models warmed up - startup timings: {cls.startup_timings}")
+        return cls.startup_timings
+
+    # Run MODEL_WARMUP_RUNS dummy inferences through both models, returns the first one's time (None when no run is set)
+    @classmethod
+    def run_warmup(cls, detection_model, classification_model):
+        size = settings.MODEL_WARMUP_IMAGE_SIZE
+        dummy_image = Image.new("RGB", (size, size), color="white")
+        dummy_crop = np.full((size // 4, size // 4, 3), 255, dtype=np.uint8)
+        first_inference_seconds = None
+        for run in range(settings.MODEL_WARMUP_RUNS):
+            run_start_time = time.perf_counter()
+            cls.detect(detection_model, dummy_image)
+            cls.classify(classification_model, [dummy_crop])
+            if run == 0:
+                first_inference_seconds = time.perf_counter() - run_start_time
+        return first_inference_seconds
 
-            # Add to detected_objects and boxes_and_classes
-            boxes_and_classes.append((x1, y1, x2, y2, class_name, confidence))
+    # Load and warm up a new version of the models next to the served one, returns the (detection model, classification model) to activate
+    @classmethod
+    def load_version(cls, detection_model_path, classification_model_path):
+        backends.import_yolo()
+        detection_model = backends.load_model(detection_model_path)
+        classification_model = backends.load_model(classification_model_path)
+        cls.run_warmup(detection_model, classification_model)
+        return detection_model, classification_model
 
-            # Add to cropped_images
-            cropped_images.append(cropped_img)
+    # Serve a loaded version, both models switch together and the batches already running keep the models they started with
+    @classmethod
+    def activate(cls, version, detection_model, classification_model):
+        with cls.load_lock:
+            cls.object_detection_model, cls.classification_model, cls.model_version = detection_model, classification_model, version
+        log(f"Models version {version} activated")
 
-        log(f"Detected {len(cropped_images)} objects", debug=True)
-        return cropped_images, boxes_and_classes
+    # Detect the objects of an image, returns its Detections (not classified yet)
+    @classmethod
+    def detect(cls, YOLO_model, image, confidence_threshold=0.5):
+        return cls.detect_batch(YOLO_model, [image], [confidence_threshold])[0]
 
+    # Detect the objects of several images in a single forward pass, returns the Detections of each image
+    # Images over TILED_INFERENCE_MIN_PIXELS are detected in overlapping tiles at full resolution (plus a downscaled pass of the whole image
+    # for objects larger than a tile), the tiles of every image are batched together and their boxes merged per image
     @classmethod
-    def classify_objects(cls, YOLO_model, cropped_images):
-        classified_objects = []
+    def detect_batch(cls, YOLO_model, images, confidence_thresholds):
+        if not images:
+            return []
 
-        for img in cropped_images:
-            try:
-                # Convert to RGB (YOLO expects RGB images)
-                #img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                img_rgb = Image.fromarray(img).convert("RGB")
+        # Images can be PIL images or RGB numpy arrays, the model gets them downscaled and in BGR order
+        images = [as_rgb_array(image) for image in images]
+        model_inputs, scales, part_tiles, owners = [], [], [], []
+        for i, image in enumerate(images):
+            tiles = tile_grid(image.shape) if should_tile(image.shape) else np.zeros((0, 4), dtype=np.int32)
+            for x1, y1, x2, y2 in [(0, 0, image.shape[1], image.shape[0])] + tiles.tolist():
+                model_input, scale = detection_input(image[y1:y2, x1:x2])
+                model_inputs.append(model_input)
+                scales.append(scale)
+                part_tiles.append((x1, y1, x2, y2))
+                owners.append(i)
+        results = cls.run_detection(YOLO_model, model_inputs, max(len(images), settings.TILED_INFERENCE_BATCH_SIZE))
+
+        parts = [[] for _ in images]
+        tiles = [[] for _ in images]
+        for i, result, scale, tile in zip(owners, results, scales, part_tiles):
+            parts[i].append(Detections.from_result(result, YOLO_model.names, confidence_thresholds[i], scale, images[i].shape, tile[:2]))
+            tiles[i].append(tile)
+        detections = [image_parts[0] if len(image_parts) == 1 else cls.merge_tiles(image_parts, image_tiles, image.shape)
+                      for image_parts, image_tiles, image in zip(parts, tiles, images)]
 
-                # Perform inference on the original cropped image
-                results = YOLO_model(img_rgb, verbose=False)
+        if len(images) == 1:
+            log(f"Detected {len(detections[0])} objects" + (f" in {len(parts[0]) - 1} tiles" if len(parts[0]) > 1 else ""), debug=True)
+        else:
+            log(f"Detected {sum(len(d) for d in detections)} objects in {len(images)} images", debug=True)
+        return detections
+
+    # Run the detection model on its inputs in chunks of batch_size, a single input is passed as is
+    @classmethod
+    def run_detection(cls, YOLO_model, model_inputs, batch_size):
+        if len(model_inputs) == 1:
+            return YOLO_model(model_inputs[0], verbose=False)
+        results = []
+        for start in range(0, len(model_inputs), batch_size):
+            results.extend(YOLO_model(model_inputs[start:start + batch_size], verbose=False))
+        return results
+
+    # Merge the Detections of an image's full pass and tiles, the same object seen by several tiles is kept once
+    # tiles: the (x1, y1, x2, y2) of each part in the image, the full pass's first
+    @classmethod
+    def merge_tiles(cls, tile_detections, tiles, image_shape):
+        detections = Detections.concatenate(tile_detections)
+        sources = np.repeat(np.arange(len(tile_detections)), [len(part) for part in tile_detections])
+        cut = np.concatenate([cut_by_tile_edge(part.xyxy, tile, image_shape) for part, tile in zip(tile_detections, tiles)])
+        return detections[merge_tile_boxes(detections.xyxy, sources, cut)]
+
+    # Detect the objects of an image, returns the cropped objects and their (x1, y1, x2, y2, class name, confidence) tuples
+    @classmethod
+    def detect_and_collect_objects(cls, YOLO_model, image, confidence_threshold=0.5):
+        detections = cls.detect(YOLO_model, image, confidence_threshold)
+        return detections.crops(as_rgb_array(image)), detections.boxes_and_classes()
+
+    # Classify cropped objects, returns the class ids (-1 for objects that couldn't be classified) and confidences
+    @classmethod
+    def classify(cls, YOLO_model, cropped_images, batch_size=None):
+        if batch_size is None:
+            batch_size = settings.CLASSIFICATION_BATCH_SIZE
+        batch_size = max(1, batch_size)
+        cls_id = np.full(len(cropped_images), -1, dtype=np.int32)
+        cls_conf = np.zeros(len(cropped_images))
+
+        # Convert the crops to RGB (YOLO expects RGB images), crops that can't be converted stay unclassified
+        batch_indexes = []
+        batch_images = []
+        for i, img in enumerate(cropped_images):
+            try:
+                batch_images.append(Image.fromarray(img).convert("RGB"))
+                batch_indexes.append(i)
             except UnidentifiedImageError:
-                classified_objects.append(("Unknown", 0.0))
                 continue
 
-            detections = results[0].boxes.xyxy.cpu().numpy()
-            classes = results[0].boxes.cls.cpu().numpy()
-            confidences = results[0].boxes.conf.cpu().numpy()
-            names = YOLO_model.names
+        # Classify the crops in chunks of batch_size, YOLO letterboxes each chunk into a single tensor and runs one forward pass
+        # The top box of each crop is its classification, classes the model has no name for stay unclassified
+        for start in range(0, len(batch_images), batch_size):
+            chunk_indexes = batch_indexes[start:start + batch_size]
+            results = YOLO_model(batch_images[start:start + batch_size], verbose=False)
+            for i, result in zip(chunk_indexes, results):
+                classes = result.boxes.cls.cpu().numpy()
+                if len(classes) > 0 and int(classes[0]) in YOLO_model.names:
+                    cls_id[i] = int(classes[0])
+                    cls_conf[i] = result.boxes.conf.cpu().numpy()[0]
 
-            if len(detections) > 0 and int(classes[0]) in names:
-                class_name = names[int(classes[0])]
-                confidence = confidences[0]
-                classified_objects.append((class_name, confidence))
-            else:
-                classified_objects.append(("Unknown", 0.0))
+        log(f"Classified {len(cropped_images)} objects", debug=True)
+        return cls_id, cls_conf
 
-        log(f"Classified {len(classified_objects)} objects", debug=True)
-        return classified_objects
+    # Classify cropped objects, returns a (class name, confidence) tuple per object ('Unknown' when it couldn't be classified)
+    @classmethod
+    def classify_objects(cls, YOLO_model, cropped_images, batch_size=None):
+        cls_id, cls_conf = cls.classify(YOLO_model, cropped_images, batch_size)
+        return list(zip(map_names(cls_id, YOLO_model.names).tolist(), cls_conf.tolist()))
 
+    # Crop the detected objects out of the image and classify them, sets the classifications of the detections
     @classmethod
-    def annotate_image(cls, image, boxes_and_classes, classified_objects):
-        if len(boxes_and_classes) != len(classified_objects):
-            raise ValueError("The number of bounding boxes and classified objects must match.")
+    def classify_detections(cls, YOLO_model, image, detections):
+        detections, to_classify = cls.prune_detections(detections, YOLO_model.names)
+        cls_id, cls_conf = cls.classify(YOLO_model, detections[to_classify].crops(as_rgb_array(image)))
+        return cls.set_pruned_classifications(detections, to_classify, cls_id, cls_conf, YOLO_model.names)
 
-        draw = ImageDraw.Draw(image)
-        default_color = "red"
+    # Prune the detections before classification: undersized and degenerate boxes are dropped, duplicates of the same object collapsed,
+    # and objects the detector named as a denomination the classifier knows, with at least CLASSIFICATION_EARLY_EXIT_CONFIDENCE,
+    # keep the detector's class instead of being classified (early exit)
+    # Returns the pruned detections and the mask of the objects still to classify, the counts are recorded in detections.pruned
+    @classmethod
+    def prune_detections(cls, detections: Detections, classification_names):
+        keep, undersized, duplicates = prune_boxes(detections.xyxy, detections.det_conf)
+        pruned_detections = detections[keep]
+        to_classify = np.ones(len(pruned_detections), dtype=bool)
 
-        for (x1, y1, x2, y2, original_class, confidence), (classified_class, class_confidence) in zip(boxes_and_classes, classified_objects):
-            color = default_color  # Initialize color with default value
+        early_exit_confidence = settings.CLASSIFICATION_EARLY_EXIT_CONFIDENCE
+        if early_exit_confidence > 0 and len(pruned_detections):
+            class_ids = {name: i for i, name in classification_names.items() if name in cls.currencies_dict and name != "Unknown"}
+            det_class_ids = np.array([class_ids.get(name, -1) for name in pruned_detections.det_class_names.tolist()], dtype=np.int32)
+            early_exits = (det_class_ids >= 0) & (pruned_detections.det_conf >= early_exit_confidence)
+            pruned_detections.cls_id[early_exits] = det_class_ids[early_exits]
+            pruned_detections.cls_conf[early_exits] = pruned_detections.det_conf[early_exits]
+            to_classify = ~early_exits
 
-            # Draw the bounding box (color based on the classification)
-            if classified_class != "Unknown":
-                if "NIS" in classified_class:
-                    color = "blue"
-                elif "Euro" in classified_class:
-                    color = "orange"
-                elif "USD" in classified_class:
-                    color = "green"
+        pruned_detections.pruned = {"undersized": undersized, "duplicates": duplicates, "early_exits": int((~to_classify).sum())}
+        if len(pruned_detections) < len(detections) or not to_classify.all():
+            log(f"Pruned the objects to classify - {pruned_detections.pruned}", debug=True)
+        return pruned_detections, to_classify
 
-            draw.rectangle([x1, y1, x2, y2], outline=color, width=2)
+    # Set the classifications of the objects that were classified, early exits keep the detector's class
+    @classmethod
+    def set_pruned_classifications(cls, detections, to_classify, cls_id, cls_conf, classification_names):
+        all_cls_id, all_cls_conf = detections.cls_id.copy(), detections.cls_conf.copy()
+        all_cls_id[to_classify] = cls_id
+        all_cls_conf[to_classify] = cls_conf
+        return detections.set_classifications(all_cls_id, all_cls_conf, classification_names)
 
-            # Create the label
-            if classified_class != "Unknown":
-                label = f"{classified_class} ({class_confidence:.2f})"
-            else:
-                label = f"{original_class} ({confidence:.2f}) - Unknown"
+    # Draw the detections on the image, detections is a Detections or the boxes_and_classes tuples (with classified_objects)
+    # PIL images are drawn on in place, arrays are copied first since they are shared with the other stages
+    # max_side renders to a downscaled image when the image's long side is over it (0 = keep the image's size)
+    @classmethod
+    def annotate_image(cls, image, detections, classified_objects=None, max_side=0):
+        if not isinstance(detections, Detections):
+            if classified_objects is None or len(detections) != len(classified_objects):
+                raise ValueError("The number of bounding boxes and classified objects must match.")
+            detections = Detections.from_tuples(detections, classified_objects)
 
-            # Draw the label
-            text_bbox = draw.textbbox((x1, y1), label)
-            draw.rectangle(text_bbox, fill=color)
-            draw.text((x1, y1), label, fill="white")
+        canvas, scale = annotation_canvas(image, max_side)
+        return draw_detections(canvas, detections, scale)
 
-            print(f"Drawing bounding box for {classified_class} from {(x1, y1)} to {(x2, y2)}")
+    # Draw the detections on a transparent image of the image's size (downscaled to max_side), the client composites it on its photo
+    @classmethod
+    def render_overlay(cls, image_shape, detections: Detections, max_side=0):
+        canvas, scale = overlay_canvas(image_shape, max_side)
+        return draw_detections(canvas, detections, scale)
 
-        image = Image.fromarray(np.array(image))
-        return image
+    # Describe the detections for clients that draw them, the boxes are relative to the image's width and height
+    @classmethod
+    def describe_detections(cls, detections: Detections, image_shape) -> list[DetectionInfo]:
+        height, width = image_shape[:2]
+        boxes = np.round(detections.xyxy / np.array([width, height, width, height], dtype=np.float32), 4).tolist()
+        rows = zip(boxes, detections.cls_class_names.tolist(), detections.cls_conf.tolist(), detections.det_class_names.tolist(), detections.det_conf.tolist())
+        return [DetectionInfo(box=box, currency=cls.currencies_dict.get(classified_class, "Unknown"), confidence=round(class_confidence, 4),
+                              detected_class=detected_class, detection_confidence=round(confidence, 4))
+                for box, classified_class, class_confidence, detected_class, confidence in rows]
 
+    # Count the detected currencies and their value in the return currency
+    # classified_objects is a Detections or the (class name, confidence) tuples of the classified objects
     @classmethod
     def get_detected_counts(cls, classified_objects, return_currency):
-        counts = {}
-        for class_name, _ in classified_objects:
-            if class_name in counts:
-                counts[class_name] += 1
-            else:
-                counts[class_name] = 1
+        if isinstance(classified_objects, Detections):
+            counts = classified_objects.class_counts()
+        else:
+            counts = {}
+            for class_name, _ in classified_objects:
+                if class_name in counts:
+                    counts[class_name] += 1
+                else:
+                    counts[class_name] = 1
 
         # Create a dictionary with the detected counts for each currency and remove any currencies with 0 counts
         # Also, split the class name to the currency and the value ('0.1 NIS' -> 'NIS', (0.1, count))
@@ -154,7 +304,8 @@ class MyModel:
     @classmethod
     def calculate_return_currency_value(cls, detected_currencies, return_currency):
         try:
-            exchange_rates = exchange_service.get_exchange_rates()
+            with span("exchange_rates"):
+                exchange_rates = exchange_service.get_exchange_rates()
             
             log(f"Exchange rates: {exchange_rates}", debug=True)
             log(f"Before calculating exchange rate values: {detected_currencies} - {return_currency}", debug=True)
@@ -198,13 +349,50 @@ class MyModel:
             log(f"Error in calculating the return currency value - {str(e)}", logging.CRITICAL)
             raise ValueError("Error in calculating the return currency value")
     
+    # Detect and classify the objects of several images as batches, returns the classified Detections of each image
+    @classmethod
+    def infer_images(cls, images, confidence_thresholds):
+        cls.load_models()
+        with cls.load_lock: # The whole batch runs on one version even if another one is activated meanwhile
+            detection_model, classification_model, model_version = cls.object_detection_model, cls.classification_model, cls.model_version
+        images = [as_rgb_array(image) for image in images]
+        start_time = time.perf_counter()
+        detections, to_classify = zip(*[cls.prune_detections(image_detections, classification_model.names)
+                                        for image_detections in cls.detect_batch(detection_model, images, confidence_thresholds)])
+        detect_seconds = time.perf_counter() - start_time
+
+        # Classify the crops of all the images together, then split the classifications back per image
+        start_time = time.perf_counter()
+        all_cropped_images = [crop for image, image_detections, mask in zip(images, detections, to_classify) for crop in image_detections[mask].crops(image)]
+        cls_id, cls_conf = cls.classify(classification_model, all_cropped_images)
+        classify_seconds = time.perf_counter() - start_time
+        start = 0
+        for image_detections, mask in zip(detections, to_classify):
+            end = start + int(mask.sum())
+            cls.set_pruned_classifications(image_detections, mask, cls_id[start:end], cls_conf[start:end], classification_model.names)
+            image_detections.model_version = model_version
+            image_detections.timings = {"detect": detect_seconds, "classify": classify_seconds, "batch_size": len(images)}
+            start = end
+        return list(detections)
+
+    # Annotate the image and count the detected currencies in the requested currency
+    @classmethod
+    def annotate_and_count(cls, image: Image, detections: Detections, return_currency: str):
+        with span("annotate"):
+            annotated_image = cls.annotate_image(image, detections, max_side=settings.ANNOTATION_MAX_SIDE)
+        with span("count"):
+            currencies = cls.get_detected_counts(detections, return_currency)
+        return annotated_image, currencies
+
     @classmethod
     def predict_image(cls, image: Image, return_currency: str, confidence_threshold=0.5):
         try:
-            cropped_images, boxes_and_classes = cls.detect_and_collect_objects(cls.object_detection_model, image, confidence_threshold= confidence_threshold)
-            classified_objects = cls.classify_objects(cls.classification_model, cropped_images)
-            annotated_image = cls.annotate_image(image, boxes_and_classes, classified_objects)
-            currencies = cls.get_detected_counts(classified_objects, return_currency)
+            cls.load_models()
+            with span("detect"):
+                detections = cls.detect(cls.object_detection_model, image, confidence_threshold= confidence_threshold)
+            with span("classify"):
+                detections = cls.classify_detections(cls.classification_model, image, detections)
+            annotated_image, currencies = cls.annotate_and_count(image, detections, return_currency)
         except Exception as e:
             log(f"Error in predicting the image - {str(e)}", logging.CRITICAL)
             raise ValueError("Error in predicting the image")
@@ -0,0 +1,22 @@
+import numpy as np
+from app.core.config import settings
+from app.ml.detections import box_overlaps, greedy_suppress
+
+# Prune the boxes sent to the classifier: boxes with no area (e.g. clipped to the image's edge) or a side under min_side are dropped,
+# and boxes overlapping a more confident box by more than duplicate_iou are duplicates of the same object
+# Returns the indexes of the kept boxes, the number of undersized boxes and the number of duplicates
+def prune_boxes(xyxy: np.ndarray, confidences: np.ndarray, min_side: int | None = None, duplicate_iou: float | None = None):
+    min_side = settings.CROP_MIN_SIDE if min_side is None else min_side
+    duplicate_iou = settings.CROP_DUPLICATE_IOU if duplicate_iou is None else duplicate_iou
+
+    if len(xyxy) == 0:
+        return np.array([], dtype=np.int64), 0, 0
+
+    sized = np.flatnonzero((xyxy[:, 2:] - xyxy[:, :2]).min(axis=1) >= max(min_side, 1))
+    undersized = len(xyxy) - len(sized)
+    if len(sized) < 2 or duplicate_iou >= 1:
+        return sized, undersized, 0
+
+    order = sized[np.argsort(-confidences[sized], kind="stable")]
+    keep = greedy_suppress(box_overlaps(xyxy[order]) > duplicate_iou)
+    return np.sort(order[keep]), undersized, int((~keep).sum())
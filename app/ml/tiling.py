@@ -0,0 +1,70 @@
+import math
+import numpy as np
+from app.core.config import settings
+from app.ml.detections import box_overlaps, greedy_suppress
+
+# Should an image be detected in tiles: its pixel count is over TILED_INFERENCE_MIN_PIXELS (0 = never)
+# decode_image keeps such uploads at full resolution, and the downscaled decodes of smaller uploads stay under it, so it's the
+# upload's own size (from its header) that turns the tiling on, not the size it's decoded to
+def should_tile(image_shape, min_pixels: int | None = None) -> bool:
+    min_pixels = settings.TILED_INFERENCE_MIN_PIXELS if min_pixels is None else min_pixels
+    height, width = image_shape[:2]
+    return min_pixels > 0 and height * width > min_pixels
+
+# Starts of the tiles covering a side of length `length` with tiles of `tile_size` overlapping by at least `overlap` pixels
+# The tiles are spread evenly, the last one ends at the side's end
+def tile_starts(length: int, tile_size: int, overlap: int):
+    if length <= tile_size:
+        return [0]
+    count = math.ceil((length - overlap) / (tile_size - overlap))
+    return np.linspace(0, length - tile_size, count).round().astype(int).tolist()
+
+# Overlapping tiles of an image as (x1, y1, x2, y2) rows, tile_size is the detection model's input size so the tiles aren't downscaled
+def tile_grid(image_shape, tile_size: int | None = None, overlap: float | None = None) -> np.ndarray:
+    tile_size = tile_size or settings.DETECTION_INPUT_SIZE
+    overlap = settings.TILED_INFERENCE_OVERLAP if overlap is None else overlap
+    overlap_pixels = min(int(tile_size * overlap), tile_size - 1)
+    height, width = image_shape[:2]
+    tiles = [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+             for y in tile_starts(height, tile_size, overlap_pixels) for x in tile_starts(width, tile_size, overlap_pixels)]
+    return np.array(tiles, dtype=np.int32).reshape(-1, 4)
+
+EDGE_MARGIN = 2 # A box within this many pixels of a tile's edge is cut by it
+
+# Which (N, 4) boxes detected in a tile (x1, y1, x2, y2) touch one of its edges inside the image: their object goes on past the tile
+# The full image pass's tile is the whole image, its boxes are never cut
+def cut_by_tile_edge(xyxy: np.ndarray, tile, image_shape, margin: int = EDGE_MARGIN) -> np.ndarray:
+    x1, y1, x2, y2 = tile
+    height, width = image_shape[:2]
+    cut = np.zeros(len(xyxy), dtype=bool)
+    if x1 > 0:
+        cut |= xyxy[:, 0] <= x1 + margin
+    if y1 > 0:
+        cut |= xyxy[:, 1] <= y1 + margin
+    if x2 < width:
+        cut |= xyxy[:, 2] >= x2 - margin
+    if y2 < height:
+        cut |= xyxy[:, 3] >= y2 - margin
+    return cut
+
+# Merge the detections of the tiles (and the full image pass): the same object seen by several tiles is kept once
+# sources: the tile (or pass) each box comes from, only boxes of different sources are duplicates (default: every box its own source)
+# cut: the boxes cut by their tile's edge (default: none). A cut box is only part of its object, whole in a neighbouring tile or the
+# full pass, so it's a duplicate of a larger box mostly containing it (intersection over the cut box > threshold). Other boxes are
+# duplicates by IoU > threshold, so an object lying on a larger one (a coin on a banknote) is kept
+# The boxes are visited from the largest, returns the indexes to keep
+def merge_tile_boxes(xyxy: np.ndarray, sources=None, cut=None, threshold: float | None = None) -> np.ndarray:
+    threshold = settings.TILED_INFERENCE_MERGE_THRESHOLD if threshold is None else threshold
+    xyxy = np.asarray(xyxy).reshape(-1, 4)
+    if len(xyxy) == 0:
+        return np.array([], dtype=np.int64)
+    sources = np.arange(len(xyxy)) if sources is None else np.asarray(sources)
+    cut = np.zeros(len(xyxy), dtype=bool) if cut is None else np.asarray(cut, dtype=bool)
+
+    areas = (xyxy[:, 2:] - xyxy[:, :2]).astype(np.float32).prod(axis=1)
+    order = np.argsort(-areas, kind="stable")
+    xyxy, sources, cut = xyxy[order], sources[order], cut[order]
+    # Column j is the smaller box a larger box i may suppress, its overlap is measured by whether it's cut
+    overlaps = np.where(cut[None, :], box_overlaps(xyxy, mode="smaller"), box_overlaps(xyxy))
+    keep = greedy_suppress((overlaps > threshold) & (sources[:, None] != sources[None, :]))
+    return np.sort(order[keep])
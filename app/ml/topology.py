@@ -0,0 +1,52 @@
+import logging
+import os
+from app.core.config import settings
+from app.logs.logger_config import log
+
+applied_threads = None # Intra-op threads set in this process, None until apply_topology() ran
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError: # Not available on macOS and Windows
+        return os.cpu_count() or 1
+
+# Number of processes running inference on this machine: every server process runs INFERENCE_WORKERS worker processes, or its own thread
+def inference_processes() -> int:
+    return max(1, settings.SERVER_WORKERS) * max(1, settings.INFERENCE_WORKERS)
+
+# Intra-op threads of each inference process, INFERENCE_THREADS or the cores split between the inference processes
+def inference_threads() -> int:
+    if settings.INFERENCE_THREADS > 0:
+        return settings.INFERENCE_THREADS
+    return max(1, available_cores() // inference_processes())
+
+# The processes x threads x batch size the models run with
+def topology() -> dict:
+    return {
+        "server_workers": max(1, settings.SERVER_WORKERS),
+        "inference_workers": settings.INFERENCE_WORKERS,
+        "inference_threads": inference_threads(),
+        "inference_max_batch_size": settings.INFERENCE_MAX_BATCH_SIZE,
+        "classification_batch_size": settings.CLASSIFICATION_BATCH_SIZE,
+        "cores": available_cores(),
+    }
+
+# Apply the topology to the process running inference, before its models are loaded: torch's intra-op threads and the
+# OpenMP threads of the other backends (ONNX Runtime, OpenVINO), so the processes together don't use more threads than cores
+def apply_topology():
+    global applied_threads
+    threads = inference_threads()
+    if applied_threads == threads:
+        return threads
+
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    import torch
+    torch.set_num_threads(threads)
+    applied_threads = threads
+
+    current_topology = topology()
+    if inference_processes() * threads > current_topology["cores"]:
+        log(f"Inference topology oversubscribes the cores - {current_topology}", logging.WARNING)
+    log(f"Inference topology applied in process {os.getpid()} - {current_topology}", debug=True)
+    return threads
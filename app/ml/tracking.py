@@ -0,0 +1,103 @@
+import cv2
+import numpy as np
+from app.core.config import settings
+from app.ml.detections import Detections
+
+# Lightweight box tracking between the keyframes of the live camera mode (median flow): the corners found inside every box and a
+# grid of points over it are followed with pyramidal Lucas-Kanade optical flow on small grayscale frames, each box moves by the
+# median displacement of its tracked points and scales by the median change of their distances to their center. Points in
+# flat regions (e.g. the inside of a plain coin) can't be tracked, a box with less than MIN_TRACKED_POINTS tracked points is lost
+GRID_SIZE = 4 # Grid points per box side
+CORNERS_PER_BOX = 16 # Max corners looked for per box
+MIN_TRACKED_POINTS = 3
+MAX_FLOW_ERROR = 30.0 # Lucas-Kanade error above which a point is considered lost
+
+# Downscaled grayscale frame the points are tracked on, and its scale from the frame's coordinates
+def tracking_frame(image: np.ndarray, max_side: int | None = None):
+    max_side = max_side or settings.LIVE_TRACKING_MAX_SIDE
+    height, width = image.shape[:2]
+    scale = min(1.0, max_side / max(height, width))
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY), scale
+
+# The (N * GRID_SIZE^2, 2) grid points inside (N, 4) xyxy boxes, inset from the edges where the background shows
+def grid_points(xyxy: np.ndarray) -> np.ndarray:
+    steps = (np.arange(GRID_SIZE, dtype=np.float32) + 0.5) / GRID_SIZE * 0.8 + 0.1
+    fx, fy = np.meshgrid(steps, steps)
+    x1, y1, x2, y2 = (xyxy[:, i:i + 1].astype(np.float32) for i in range(4))
+    xs = x1 + (x2 - x1) * fx.reshape(1, -1)
+    ys = y1 + (y2 - y1) * fy.reshape(1, -1)
+    return np.stack([xs, ys], axis=2).reshape(-1, 2)
+
+class BoxTracker:
+    def __init__(self, max_side: int | None = None):
+        self.max_side = max_side
+        self.frame = None # Grayscale tracking frame of the last update
+        self.scale = 1.0
+        self.shape = None # Shape of the last full-resolution frame
+        self.detections = Detections()
+
+    # Start tracking the detections of a keyframe
+    def reset(self, image: np.ndarray, detections: Detections):
+        self.frame, self.scale = tracking_frame(image, self.max_side)
+        self.shape = image.shape
+        self.detections = detections
+
+    # Move the tracked boxes to a new frame, returns the tracked detections and the number of boxes lost
+    def update(self, image: np.ndarray):
+        if self.frame is None or image.shape != self.shape:
+            raise ValueError("The tracker has no keyframe of this frame size")
+        frame, _ = tracking_frame(image, self.max_side)
+        if not len(self.detections):
+            self.frame = frame
+            return self.detections, 0
+
+        boxes = self.detections.xyxy.astype(np.float32) * self.scale
+        points, owners = self.box_points(boxes)
+        moved, status, error = cv2.calcOpticalFlowPyrLK(self.frame, frame, points.reshape(-1, 1, 2), None, winSize=(15, 15), maxLevel=2)
+        moved = moved.reshape(-1, 2)
+        tracked = (status.reshape(-1) == 1) & (error.reshape(-1) < MAX_FLOW_ERROR)
+
+        keep = np.zeros(len(boxes), dtype=bool)
+        new_boxes = boxes.copy()
+        for i in range(len(boxes)):
+            box_points = (owners == i) & tracked
+            if box_points.sum() < MIN_TRACKED_POINTS:
+                continue
+            keep[i] = True
+            old_points, new_points = points[box_points], moved[box_points]
+            shift = np.median(new_points - old_points, axis=0)
+            old_distances = np.linalg.norm(old_points - old_points.mean(axis=0), axis=1)
+            new_distances = np.linalg.norm(new_points - new_points.mean(axis=0), axis=1)
+            valid = old_distances > 1e-3
+            zoom = float(np.median(new_distances[valid] / old_distances[valid])) if valid.any() else 1.0
+            center = (boxes[i, :2] + boxes[i, 2:]) / 2 + shift
+            half_size = (boxes[i, 2:] - boxes[i, :2]) / 2 * zoom
+            new_boxes[i] = np.concatenate([center - half_size, center + half_size])
+
+        height, width = self.shape[:2]
+        xyxy = np.clip(new_boxes / self.scale, 0, np.array([width, height, width, height], dtype=np.float32))
+        keep &= (xyxy[:, 2] - xyxy[:, 0] >= 1) & (xyxy[:, 3] - xyxy[:, 1] >= 1) # Moved out of the frame
+        detections = self.detections[keep]
+        detections.xyxy = np.round(xyxy[keep]).astype(np.int32)
+
+        self.frame = frame
+        self.detections = detections
+        return detections, int((~keep).sum())
+
+    # The points to track in the boxes of the last frame (its corners in each box and a grid over each box), and the box of each point
+    def box_points(self, boxes: np.ndarray):
+        mask = np.zeros(self.frame.shape, dtype=np.uint8)
+        for x1, y1, x2, y2 in np.round(boxes).astype(np.int32).tolist():
+            mask[max(y1, 0):y2, max(x1, 0):x2] = 255
+        corners = cv2.goodFeaturesToTrack(self.frame, maxCorners=CORNERS_PER_BOX * len(boxes), qualityLevel=0.01, minDistance=3, mask=mask)
+        corners = corners.reshape(-1, 2) if corners is not None else np.zeros((0, 2), dtype=np.float32)
+        # A corner belongs to every box it falls in
+        inside = ((corners[:, None, 0] >= boxes[None, :, 0]) & (corners[:, None, 0] <= boxes[None, :, 2])
+                  & (corners[:, None, 1] >= boxes[None, :, 1]) & (corners[:, None, 1] <= boxes[None, :, 3]))
+        corner_indexes, corner_owners = np.nonzero(inside)
+        grid = grid_points(boxes)
+        points = np.concatenate([corners[corner_indexes], grid]).astype(np.float32)
+        owners = np.concatenate([corner_owners, np.repeat(np.arange(len(boxes)), GRID_SIZE * GRID_SIZE)])
+        return points, owners
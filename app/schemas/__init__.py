@@ -1,2 +1,3 @@
 from .image_schemas import *
-from .predict_schema import *
\ No newline at end of file
+from .predict_schema import *
+from .model_schemas import *
\ No newline at end of file
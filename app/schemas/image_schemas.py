@@ -1,8 +1,17 @@
 from pydantic import BaseModel
+from typing import Literal
 
 class PredictRequest(BaseModel):
     image: str  # Base64 encoded image
     return_currency: str # The currency to return the value in, can be USD, EUR, or NIS only
+    # image: the annotated photo (base64 JPEG), detections: only the detections as JSON, overlay: the detections and a transparent PNG of the annotations
+    response_mode: Literal["image", "detections", "overlay"] = "image"
+
+# BatchPredictRequest predicts many images in a single request, e.g. the photos of a business's daily revenue
+class BatchPredictRequest(BaseModel):
+    images: list[str] # Base64 encoded images
+    return_currency: str
+    response_mode: Literal["image", "detections", "overlay"] = "image"
 
 class EncodedImageResponse(BaseModel):
     image: str  # Base64 encoded image
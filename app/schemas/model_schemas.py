@@ -0,0 +1,6 @@
+from pydantic import BaseModel
+
+class ModelSwapRequest(BaseModel):
+    detection_model: str | None = None # Path of the detection model's weights, None to reload the served path
+    classification_model: str | None = None # Path of the classification model's weights, None to reload the served path
+    version: str | None = None # Version recorded with the saved images, None for a hash of the model files
@@ -6,9 +6,26 @@ class CurrencyInfo(BaseModel):
     quantity: int  # How many objects of this currency were detected in the image
     return_currency_value: float # The value of one object of this currency and it's value in the return currency
     
+# DetectionInfo is a detected object, sent instead of the annotated image when the client draws the detections itself
+class DetectionInfo(BaseModel):
+    box: list[float] # x1, y1, x2, y2 relative to the (EXIF oriented) image's width and height, from 0 to 1
+    currency: str # The app's label of the classified currency ('NIS_C_10') or 'Unknown'
+    confidence: float # The classification's confidence
+    detected_class: str # The detection model's class
+    detection_confidence: float
+
 # PredictResponse is the response sent to a predict request containing the detected currencies and their values
 # along with the image url with the YOLO detection boxes
 class PredictResponse(BaseModel):
     currencies: Dict[str, CurrencyInfo]
-    image: str # Base64 encoded image + id
+    image: str | None # Base64 encoded annotated image, None in the detections and overlay response modes
     image_id: str | None # The image's id or None if the image was not saved
+    detections: list[DetectionInfo] | None = None # The detected objects, in the detections and overlay response modes
+    overlay: str | None = None # Base64 encoded transparent PNG of the annotations, in the overlay response mode
+
+# BatchPredictResponse is the response sent to a batch predict request: the response of each image in the request's order,
+# the currencies detected across all the images and their total value in the return currency
+class BatchPredictResponse(BaseModel):
+    results: list[PredictResponse]
+    currencies: Dict[str, CurrencyInfo]
+    total: float
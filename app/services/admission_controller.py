@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import time
+from collections import deque
+import numpy as np
+from app.core.config import settings
+from app.logs.logger_config import log
+
+# Raised when a request can't be admitted: the queue is full, the request waited longer than ADMISSION_QUEUE_TIMEOUT_MS,
+# or a higher priority request took its place in the full queue
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Server busy - {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+# The priority class of a request: its user's role ('admin', 'business'...) when the role has a weight, 'user' for the other
+# logged in users and 'anonymous' without a user
+def priority_class(user) -> str:
+    if user is None:
+        return "anonymous"
+    role = getattr(user, "role", None)
+    return role if role in settings.ADMISSION_PRIORITY_WEIGHTS else "user"
+
+class AdmissionController:
+    def __init__(self):
+        self.waiters = {} # Priority class -> deque of (pixels, slots, future) of its queued requests, first in first out
+        self.passes = {} # Priority class -> its pass in the weighted fair queue, advanced by 1 / weight on each of its admissions
+        self.virtual_time = 0.0 # Pass of the last admitted class, a class starting to queue starts from it (no credit banked while idle)
+        self.in_flight = 0 # Concurrency slots taken, one per image
+        self.pixels_in_flight = 0
+        self.class_stats = {} # Priority class -> counters and recent queue waits
+
+    @staticmethod
+    def weight(priority_class: str) -> float:
+        return max(settings.ADMISSION_PRIORITY_WEIGHTS.get(priority_class, 1), 0.01)
+
+    def stats_of(self, priority_class: str) -> dict:
+        if priority_class not in self.class_stats:
+            self.class_stats[priority_class] = {"admitted": 0, "queued": 0, "rejected": {"queue_full": 0, "timeout": 0, "displaced": 0},
+                                                "queue_waits": deque(maxlen=1000)} # Queue wait in seconds of the recent queued requests
+        return self.class_stats[priority_class]
+
+    def queue_depth(self) -> int:
+        return sum(len(waiters) for waiters in self.waiters.values())
+
+    # The pixels a request is accounted for, an image larger than the whole budget takes all of it (it runs alone)
+    @staticmethod
+    def cost(pixels: int) -> int:
+        return min(pixels, settings.ADMISSION_MAX_PIXELS) if settings.ADMISSION_MAX_PIXELS > 0 else pixels
+
+    # The concurrency slots a request of `images` images takes, a request with more images than ADMISSION_MAX_CONCURRENT takes all of them
+    @staticmethod
+    def slots(images: int) -> int:
+        return min(images, settings.ADMISSION_MAX_CONCURRENT) if settings.ADMISSION_MAX_CONCURRENT > 0 else images
+
+    def fits(self, pixels: int, slots: int = 1) -> bool:
+        if settings.ADMISSION_MAX_CONCURRENT > 0 and self.in_flight + slots > settings.ADMISSION_MAX_CONCURRENT:
+            return False
+        return settings.ADMISSION_MAX_PIXELS <= 0 or self.pixels_in_flight + pixels <= settings.ADMISSION_MAX_PIXELS
+
+    def grant(self, pixels: int, slots: int, priority_class: str):
+        self.in_flight += slots
+        self.pixels_in_flight += pixels
+        self.stats_of(priority_class)["admitted"] += 1
+
+    # ----------------- Wait for the concurrency and pixel budget of decoded images, returns the pixels to release ----------------- #
+    # A request of several images (/predict/batch) takes a concurrency slot per image (see slots()) and their total pixels
+    # The queued requests are admitted by weighted fair queuing between the priority classes (each class gets a share of the
+    # admissions proportional to its ADMISSION_PRIORITY_WEIGHTS weight, so no class starves) and in arrival order within a class
+    async def acquire(self, pixels: int, priority_class: str = "anonymous", images: int = 1) -> int:
+        pixels = self.cost(pixels)
+        slots = self.slots(images)
+        if not self.queue_depth() and self.fits(pixels, slots):
+            self.grant(pixels, slots, priority_class)
+            return pixels
+        if self.queue_depth() >= settings.ADMISSION_MAX_QUEUE and not self.displace(priority_class):
+            self.reject("queue_full", priority_class)
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (pixels, slots, future)
+        if not self.waiters.get(priority_class):
+            self.passes[priority_class] = max(self.passes.get(priority_class, 0.0), self.virtual_time)
+        self.waiters.setdefault(priority_class, deque()).append(waiter)
+        start_time = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), settings.ADMISSION_QUEUE_TIMEOUT_MS / 1000)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if not future.done():
+                future.cancel()
+                self.waiters[priority_class].remove(waiter)
+                self.admit_waiters() # The removed request may have been holding back requests that fit
+            elif future.exception() is None: # Admitted as it timed out or was cancelled, give the budget back
+                self.release(pixels, images)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            if not future.cancelled() and future.exception() is not None: # Displaced as it timed out
+                raise future.exception()
+            self.reject("timeout", priority_class)
+        class_stats = self.stats_of(priority_class)
+        class_stats["queued"] += 1
+        class_stats["queue_waits"].append(time.perf_counter() - start_time)
+        return pixels
+
+    def release(self, pixels: int, images: int = 1):
+        self.in_flight -= self.slots(images)
+        self.pixels_in_flight -= pixels
+        self.admit_waiters()
+
+    # The pass a class reaches once its next request is admitted, the next request admitted is the one of the class finishing first
+    # (ties go to the higher weighted class)
+    def finish_pass(self, priority_class: str):
+        return self.passes[priority_class] + 1 / self.weight(priority_class), -self.weight(priority_class)
+
+    # Admit the queued requests while the next one fits, the next one is the oldest of the class with the lowest finish pass
+    def admit_waiters(self):
+        while self.queue_depth():
+            priority_class = min((queued_class for queued_class, waiters in self.waiters.items() if waiters), key=self.finish_pass)
+            pixels, slots, future = self.waiters[priority_class][0]
+            if not self.fits(pixels, slots):
+                return
+            self.waiters[priority_class].popleft()
+            self.virtual_time = self.passes[priority_class]
+            self.passes[priority_class] += 1 / self.weight(priority_class)
+            self.grant(pixels, slots, priority_class)
+            future.set_result(None)
+
+    # A full queue makes room for a request by rejecting the newest queued request of the class holding the most queue slots for
+    # its weight, when that's more than the request's class would hold with the request. The queue slots end up shared in proportion
+    # to the weights, so a low priority class keeps some queued requests (and its share of the admissions) under any load
+    def displace(self, priority_class: str) -> bool:
+        def load(queued_class, extra=0):
+            return (len(self.waiters.get(queued_class, ())) + extra) / self.weight(queued_class)
+        queued_classes = [queued_class for queued_class, waiters in self.waiters.items() if waiters and queued_class != priority_class]
+        fullest_class = max(queued_classes, key=load, default=None)
+        if fullest_class is None or load(fullest_class) <= load(priority_class, extra=1):
+            return False
+        _, _, future = self.waiters[fullest_class].pop()
+        self.stats_of(fullest_class)["rejected"]["displaced"] += 1
+        future.set_exception(AdmissionRejected("displaced by a higher priority request", settings.ADMISSION_RETRY_AFTER_SECONDS))
+        return True
+
+    def reject(self, reason: str, priority_class: str):
+        self.stats_of(priority_class)["rejected"][reason] += 1
+        log(f"{priority_class} request rejected by the admission controller - {reason} ({self.in_flight} in flight, {self.queue_depth()} queued)", logging.WARNING, debug=True)
+        raise AdmissionRejected(reason, settings.ADMISSION_RETRY_AFTER_SECONDS)
+
+    # ----------------- Stats ----------------- #
+    def stats(self):
+        classes = {}
+        for priority_class, class_stats in sorted(self.class_stats.items()):
+            waits_ms = np.array(class_stats["queue_waits"]) * 1000
+            classes[priority_class] = {
+                "weight": self.weight(priority_class),
+                "queue_depth": len(self.waiters.get(priority_class, ())),
+                "admitted": class_stats["admitted"],
+                "queued": class_stats["queued"],
+                "rejected": dict(class_stats["rejected"]),
+                "queue_wait_p50_ms": round(float(np.percentile(waits_ms, 50)), 2) if len(waits_ms) else 0.0,
+                "queue_wait_p95_ms": round(float(np.percentile(waits_ms, 95)), 2) if len(waits_ms) else 0.0,
+                "queue_wait_max_ms": round(float(waits_ms.max()), 2) if len(waits_ms) else 0.0,
+            }
+        return {
+            "in_flight": self.in_flight,
+            "pixels_in_flight": self.pixels_in_flight,
+            "queue_depth": self.queue_depth(),
+            "admitted": sum(class_stats["admitted"] for class_stats in classes.values()),
+            "queued": sum(class_stats["queued"] for class_stats in classes.values()),
+            "rejected": {reason: sum(class_stats["rejected"][reason] for class_stats in classes.values()) for reason in ["queue_full", "timeout", "displaced"]},
+            "classes": classes,
+            "max_concurrent_setting": settings.ADMISSION_MAX_CONCURRENT,
+            "max_pixels_setting": settings.ADMISSION_MAX_PIXELS,
+            "max_queue_setting": settings.ADMISSION_MAX_QUEUE,
+        }
+
+admission_controller = AdmissionController()
@@ -0,0 +1,123 @@
+import logging
+import asyncio
+import time
+from app.core.config import settings
+from app.logs.logger_config import log
+from app.ml.inference_executor import inference_executor
+from app.core.tracing import record_span
+
+class InferenceScheduler:
+    def __init__(self):
+        self.queue: asyncio.Queue | None = None
+        self.worker_task: asyncio.Task | None = None
+        self.batch_tasks = set()
+        self.total_requests = 0
+        self.total_batches = 0
+        self.max_batch_size_seen = 0
+        self.batch_sizes = {} # Batch size -> number of batches run with that size
+        self.last_batch_seconds = 0.0
+
+    # ----------------- Start the batching worker on the running event loop (restart it if the loop changed) ----------------- #
+    def start(self) -> asyncio.Task:
+        loop = asyncio.get_running_loop()
+        if self.worker_task is None or self.worker_task.done() or self.worker_task.get_loop() is not loop:
+            self.queue = asyncio.Queue()
+            self.worker_task = loop.create_task(self.run())
+            log("Inference scheduler started", debug=True)
+        return self.worker_task
+
+    # ----------------- Queue an image for inference and wait for its classified Detections ----------------- #
+    # The endpoint function to use instead of calling the model directly
+    async def predict(self, image, confidence_threshold=0.5):
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.total_requests += 1
+        start_time = time.perf_counter()
+        await self.queue.put((image, confidence_threshold, future))
+        detections = await future
+
+        # Trace the batch's stages, the rest of the wait is the queue (and the transfer to a worker process)
+        timings = getattr(detections, "timings", None)
+        if timings:
+            end_ns = time.time_ns()
+            record_span("classify", timings["classify"], end_ns, batch_size=timings["batch_size"])
+            record_span("detect", timings["detect"], end_ns - int(timings["classify"] * 1e9), batch_size=timings["batch_size"])
+            record_span("queue", max(0.0, time.perf_counter() - start_time - timings["detect"] - timings["classify"]), end_ns - int((timings["classify"] + timings["detect"]) * 1e9))
+        return detections
+
+    # ----------------- Collect requests for up to INFERENCE_MAX_WAIT_MS or INFERENCE_MAX_BATCH_SIZE images and run them as one batch ----------------- #
+    # One batch runs per inference worker process at a time, requests keep queuing up for the next batch meanwhile
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        free_workers = asyncio.Semaphore(max(1, settings.INFERENCE_WORKERS))
+        try:
+            while True:
+                await free_workers.acquire()
+                batch = [await self.queue.get()]
+                deadline = loop.time() + settings.INFERENCE_MAX_WAIT_MS / 1000
+                while len(batch) < settings.INFERENCE_MAX_BATCH_SIZE:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+
+                batch_task = loop.create_task(self.run_batch(batch))
+                self.batch_tasks.add(batch_task)
+                batch_task.add_done_callback(self.batch_tasks.discard)
+                batch_task.add_done_callback(lambda _: free_workers.release())
+        finally:
+            # Don't leave requests waiting forever when the scheduler is stopped
+            while self.queue is not None and not self.queue.empty():
+                _, _, future = self.queue.get_nowait()
+                future.cancel()
+
+    # ----------------- Run a batch in the inference executor and fan the results back out to the waiting requests ----------------- #
+    async def run_batch(self, batch):
+        batch = [item for item in batch if not item[2].done()] # Skip requests that were cancelled while queued
+        if not batch:
+            return
+
+        images = [image for image, _, _ in batch]
+        confidence_thresholds = [confidence_threshold for _, confidence_threshold, _ in batch]
+        start_time = time.perf_counter()
+        try:
+            results = await inference_executor.infer_images(images, confidence_thresholds)
+        except Exception as e:
+            log(f"Error in running an inference batch of {len(batch)} images - {str(e)}", logging.ERROR)
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.record_batch(len(batch), time.perf_counter() - start_time)
+
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    # ----------------- Stats ----------------- #
+    def record_batch(self, batch_size, seconds):
+        self.total_batches += 1
+        self.max_batch_size_seen = max(self.max_batch_size_seen, batch_size)
+        self.batch_sizes[batch_size] = self.batch_sizes.get(batch_size, 0) + 1
+        self.last_batch_seconds = seconds
+        log(f"Ran an inference batch of {batch_size} images in {seconds:.3f}s", debug=True)
+
+    def stats(self):
+        batched_images = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "total_requests": self.total_requests,
+            "total_batches": self.total_batches,
+            "average_batch_size": round(batched_images / self.total_batches, 2) if self.total_batches else 0.0,
+            "max_batch_size": self.max_batch_size_seen,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "last_batch_seconds": round(self.last_batch_seconds, 4),
+            "max_batch_size_setting": settings.INFERENCE_MAX_BATCH_SIZE,
+            "max_wait_ms_setting": settings.INFERENCE_MAX_WAIT_MS,
+        }
+
+inference_scheduler = InferenceScheduler()
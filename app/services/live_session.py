@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+from app.core.config import settings
+from app.logs.logger_config import log
+from app.ml.image_decode import decode_image, decoded_pixels
+from app.ml.model import MyModel
+from app.ml.tracking import BoxTracker
+from app.services.admission_controller import admission_controller, AdmissionRejected
+from app.services.inference_scheduler import inference_scheduler
+from app.services.prediction_cache import prediction_cache
+
+# A live camera session of the /live WebSocket: the client streams encoded frames, only the latest one is processed when the
+# processing falls behind (the older ones are dropped), keyframes run through the full detect + classify pipeline and the frames
+# in between move the keyframe's boxes with the BoxTracker, keeping their classifications. Every processed frame sends its boxes,
+# and the counts are sent again only when they change
+class LiveSession:
+    def __init__(self, return_currency: str, priority_class: str = "anonymous", confidence_threshold: float = 0.5):
+        self.return_currency = return_currency
+        self.priority_class = priority_class
+        self.confidence_threshold = confidence_threshold
+        self.tracker = BoxTracker()
+        self.latest_frame = None # (frame number, encoded frame) waiting to be processed
+        self.frame_ready = asyncio.Event()
+        self.received = 0
+        self.dropped = 0
+        self.keyframes = 0
+        self.last_keyframe_time = None
+        self.frames_since_keyframe = 0
+        self.lost_since_keyframe = 0
+        self.last_counts = None
+
+    # ----------------- Keep only the latest received frame, a frame that wasn't processed yet is dropped ----------------- #
+    def submit(self, frame_data: bytes):
+        self.received += 1
+        if self.latest_frame is not None:
+            self.dropped += 1
+        self.latest_frame = (self.received, frame_data)
+        self.frame_ready.set()
+
+    # ----------------- Process the latest frame whenever the previous one is done, until the session is cancelled ----------------- #
+    async def run(self, send):
+        while True:
+            await self.frame_ready.wait()
+            self.frame_ready.clear()
+            frame_number, frame_data = self.latest_frame
+            self.latest_frame = None
+            try:
+                messages = await self.process(frame_number, frame_data)
+            except ValueError as e:
+                messages = [{"type": "error", "frame": frame_number, "detail": str(e)}]
+            except Exception as e:
+                # An inference, executor or exchange rate failure only loses this frame, the session goes on with the next one
+                log(f"Error in processing live frame {frame_number} - {str(e)}", logging.ERROR)
+                messages = [{"type": "error", "frame": frame_number, "detail": "Could not process the frame. Please try again later."}]
+            for message in messages:
+                await send(message)
+
+    # A keyframe is due on the first frame, after LIVE_KEYFRAME_INTERVAL frames or LIVE_KEYFRAME_MAX_SECONDS, when the tracker lost
+    # more than LIVE_KEYFRAME_LOST_FRACTION of the keyframe's objects, or when the frame size changed
+    def keyframe_due(self, image) -> bool:
+        if self.last_keyframe_time is None or image.shape != self.tracker.shape:
+            return True
+        if self.frames_since_keyframe + 1 >= settings.LIVE_KEYFRAME_INTERVAL or time.monotonic() - self.last_keyframe_time >= settings.LIVE_KEYFRAME_MAX_SECONDS:
+            return True
+        keyframe_objects = len(self.tracker.detections) + self.lost_since_keyframe
+        return keyframe_objects > 0 and self.lost_since_keyframe / keyframe_objects > settings.LIVE_KEYFRAME_LOST_FRACTION
+
+    # Returns the messages of a processed frame
+    async def process(self, frame_number: int, frame_data: bytes) -> list[dict]:
+        start_time = time.perf_counter()
+        try:
+            pixels = decoded_pixels(frame_data)
+            image = await asyncio.to_thread(decode_image, frame_data)
+        except Exception as e:
+            raise ValueError("Invalid frame - Unable to decode the image")
+
+        keyframe = self.keyframe_due(image)
+        if keyframe:
+            try:
+                detections = await self.infer(image, pixels)
+                self.tracker.reset(image, detections)
+                self.keyframes += 1
+                self.last_keyframe_time = time.monotonic()
+                self.frames_since_keyframe = self.lost_since_keyframe = 0
+            except AdmissionRejected as e:
+                if self.last_keyframe_time is None or image.shape != self.tracker.shape:
+                    raise ValueError(str(e))
+                keyframe = False # Overloaded, keep tracking until a keyframe is admitted
+        if not keyframe:
+            detections, lost = await asyncio.to_thread(self.tracker.update, image)
+            self.frames_since_keyframe += 1
+            self.lost_since_keyframe += lost
+
+        messages = [{"type": "frame", "frame": frame_number, "keyframe": keyframe, "dropped": self.dropped,
+                     "detections": [detection.model_dump() for detection in MyModel.describe_detections(detections, image.shape)],
+                     "latency_ms": round((time.perf_counter() - start_time) * 1000, 2)}]
+        counts = detections.class_counts()
+        if counts != self.last_counts:
+            self.last_counts = counts
+            currencies = await asyncio.to_thread(MyModel.get_detected_counts, detections, self.return_currency)
+            messages.append({"type": "counts", "frame": frame_number, "currencies": {currency: info.model_dump() for currency, info in currencies.items()},
+                             "total": round(sum(info.quantity * info.return_currency_value for info in currencies.values()), 2)})
+        return messages
+
+    # Run a keyframe through the admission controller and the batched inference, like /predict
+    async def infer(self, image, pixels):
+        admitted_pixels = await admission_controller.acquire(pixels, self.priority_class)
+        try:
+            return await prediction_cache.get_or_compute(image, self.confidence_threshold, lambda: inference_scheduler.predict(image, self.confidence_threshold))
+        finally:
+            admission_controller.release(admitted_pixels)
+
+    def stats(self):
+        return {"received": self.received, "dropped": self.dropped, "keyframes": self.keyframes}
+
+    def close(self):
+        log(f"Live session closed - {self.stats()}", logging.INFO, debug=True)
@@ -0,0 +1,89 @@
+import logging
+import asyncio
+from app.core.config import settings
+from app.logs.logger_config import log
+from app.ml import backends
+from app.ml.inference_executor import inference_executor
+from app.services.prediction_cache import prediction_cache
+
+class ModelRegistry:
+    def __init__(self):
+        self.swap_lock: asyncio.Lock | None = None
+        self.swap_lock_loop = None
+        self.watch_task: asyncio.Task | None = None
+        self.watched_version = None # Version of the watched model files at the last check
+        self.history = [] # Versions swapped to since startup, oldest first
+        self.swapping = None # Version being loaded, None when no swap is running
+
+    @property
+    def active_version(self):
+        return inference_executor.served_models()[1]
+
+    # ----------------- Hot swap to a new version of the models, without downtime ----------------- #
+    # The models default to the served paths (to reload retrained weights written over them), the version to a hash of their files
+    # One swap runs at a time, the cached predictions of the previous version are dropped once the new one serves
+    async def swap(self, detection_model: str | None = None, classification_model: str | None = None, version: str | None = None):
+        loop = asyncio.get_running_loop()
+        if self.swap_lock is None or self.swap_lock_loop is not loop:
+            self.swap_lock, self.swap_lock_loop = asyncio.Lock(), loop
+        async with self.swap_lock:
+            (served_detection_model, served_classification_model), _ = inference_executor.served_models()
+            detection_model = detection_model or served_detection_model
+            classification_model = classification_model or served_classification_model
+            version = version or backends.version_of(detection_model, classification_model)
+            if version == self.active_version:
+                return {"version": version, "swapped": False}
+
+            log(f"Swapping the models to version {version} - detection model: {detection_model}, classification model: {classification_model}")
+            self.swapping = version
+            try:
+                result = await inference_executor.swap_models(detection_model, classification_model, version)
+            except Exception as e:
+                log(f"Error in swapping the models to version {version} - {str(e)}", logging.ERROR)
+                raise
+            finally:
+                self.swapping = None
+            prediction_cache.clear(model_version=version)
+
+            self.history.append({"version": version, "detection_model": detection_model, "classification_model": classification_model,
+                                 "swapped_at": settings.TIME_NOW.isoformat(), **result})
+            log(f"Models swapped to version {version} - {result}")
+            return {**result, "swapped": True}
+
+    # ----------------- Watch the served model files and swap to them once they're replaced ----------------- #
+    def start_watching(self) -> asyncio.Task:
+        if self.watch_task is None or self.watch_task.done():
+            self.watch_task = asyncio.get_running_loop().create_task(self.watch())
+        return self.watch_task
+
+    # A change is only swapped to once the files stayed the same for a whole interval, so half-copied weights aren't loaded
+    async def watch(self):
+        pending_version = None
+        while True:
+            await asyncio.sleep(settings.MODEL_WATCH_INTERVAL_SECONDS)
+            (detection_model, classification_model), _ = inference_executor.served_models()
+            files_version = await asyncio.to_thread(backends.version_of, detection_model, classification_model)
+            if self.watched_version is None:
+                self.watched_version = files_version
+            elif files_version != self.watched_version and files_version == pending_version:
+                try:
+                    await self.swap(detection_model, classification_model, files_version)
+                    self.watched_version = files_version
+                except Exception as e:
+                    log(f"Error in swapping to the replaced model files - {str(e)}", logging.ERROR)
+            pending_version = files_version
+
+    # ----------------- Stats ----------------- #
+    def stats(self):
+        (detection_model, classification_model), active_version = inference_executor.served_models()
+        return {
+            "active_version": active_version,
+            "detection_model": detection_model,
+            "classification_model": classification_model,
+            "swapping": self.swapping,
+            "running_batches": dict(inference_executor.running_batches),
+            "history": list(self.history),
+            "watch_interval_seconds": settings.MODEL_WATCH_INTERVAL_SECONDS,
+        }
+
+model_registry = ModelRegistry()
@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import sys
+import time
+import numpy as np
+from collections import OrderedDict
+from app.core.config import settings
+from app.ml.image_decode import as_rgb_array
+from app.logs.logger_config import log
+
+# Approximate memory held by a cached value (Detections arrays, or nested tuples and lists)
+def estimate_size(value) -> int:
+    size = sys.getsizeof(value) + getattr(value, "nbytes", 0)
+    if isinstance(value, (tuple, list)):
+        size += sum(estimate_size(item) for item in value)
+    return size
+
+class PredictionCache:
+    def __init__(self):
+        self.entries = OrderedDict() # Key -> (expires at, size in bytes, Detections), least recently used first
+        self.in_flight = {} # Key -> future of the inference currently computing it
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0 # Requests that waited for an identical request's inference instead of running their own
+        self.evictions = 0
+        self.expirations = 0
+        self.model_version = None # Version of the served models once a hot swap happened, detections of other versions aren't cached
+
+    # ----------------- Content address of a prediction: hash of the decoded image's pixels plus the confidence threshold ----------------- #
+    @staticmethod
+    def make_key(image, confidence_threshold) -> str:
+        pixels = np.ascontiguousarray(as_rgb_array(image))
+        digest = hashlib.blake2b(pixels, digest_size=16) # Hashes the array's buffer, no copy of the pixels
+        digest.update(f"{pixels.shape}:{confidence_threshold}".encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if time.monotonic() >= expires_at:
+            self.remove(key)
+            self.expirations += 1
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if self.model_version is not None and getattr(value, "model_version", self.model_version) != self.model_version:
+            return
+        size = estimate_size(value)
+        max_bytes = settings.PREDICTION_CACHE_MAX_MB * 2 ** 20
+        if size > max_bytes:
+            return
+        self.remove(key)
+        self.entries[key] = (time.monotonic() + settings.PREDICTION_CACHE_TTL_SECONDS, size, value)
+        self.current_bytes += size
+
+        # Evict the least recently used entries until the cache fits its entry and memory bounds
+        while len(self.entries) > settings.PREDICTION_CACHE_MAX_ENTRIES or self.current_bytes > max_bytes:
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+            self.evictions += 1
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+    # Drop every entry, model_version is set when the served models changed (the batches still running on the previous ones aren't cached)
+    def clear(self, model_version=None):
+        self.entries.clear()
+        self.current_bytes = 0
+        if model_version is not None:
+            self.model_version = model_version
+
+    # ----------------- Get an image's classified Detections from the cache or compute them once ----------------- #
+    # compute is an async function running the inference, concurrent identical requests share a single call of it (singleflight)
+    # The return currency isn't part of the key, the counts and exchange rates are applied to the cached detections afterwards
+    async def get_or_compute(self, image, confidence_threshold, compute):
+        if not settings.PREDICTION_CACHE_ENABLED:
+            return await compute()
+
+        key = await asyncio.to_thread(self.make_key, image, confidence_threshold)
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            log(f"Prediction cache hit {key}", debug=True)
+            return value
+
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled(): # This request was cancelled
+                    raise
+                return await self.get_or_compute(image, confidence_threshold, compute) # The request running the inference was cancelled, run it again
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            value = await compute()
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # Mark it retrieved, no "exception was never retrieved" warning when no request waited for it
+            raise
+        finally:
+            self.in_flight.pop(key, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "enabled": settings.PREDICTION_CACHE_ENABLED,
+            "entries": len(self.entries),
+            "size_mb": round(self.current_bytes / 2 ** 20, 4),
+            "in_flight": len(self.in_flight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "max_entries": settings.PREDICTION_CACHE_MAX_ENTRIES,
+            "max_mb": settings.PREDICTION_CACHE_MAX_MB,
+            "ttl_seconds": settings.PREDICTION_CACHE_TTL_SECONDS,
+        }
+
+prediction_cache = PredictionCache()
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import secrets
+import time
+from contextvars import ContextVar
+from app.core.config import settings
+from app.logs.logger_config import log
+
+# The job the current coroutine runs for, the prediction reports its stages to it (None outside a job)
+current_job: ContextVar["PredictionJob | None"] = ContextVar("current_job", default=None)
+
+# Report a stage of the prediction to the job it runs for, no-op outside a job: `report_stage("detected", objects=3)`
+def report_stage(stage: str, **details):
+    job = current_job.get()
+    if job is not None:
+        job.add_event(stage, **details)
+
+# Raised when PREDICTION_JOB_MAX_QUEUED jobs are already waiting for a worker
+class JobQueueFull(Exception):
+    pass
+
+# An asynchronous prediction: its events (queued, running, detected, classified, saved, then done or failed) and once done its result
+class PredictionJob:
+    def __init__(self, user_id: str | None):
+        self.id = secrets.token_urlsafe(16) # Unguessable, an anonymous job is only reachable with its id
+        self.user_id = user_id
+        self.status = "queued"
+        self.events = [] # {"stage", "elapsed_ms", ...details} in order
+        self.result = None
+        self.error = None # {"status_code", "detail"} of a failed job
+        self.created_at = time.monotonic()
+        self.finished_at = None
+        self.updated = asyncio.Event() # Set (and replaced) on each new event, wakes the event streams
+        self.add_event("queued")
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def add_event(self, stage: str, **details):
+        self.events.append({"stage": stage, "elapsed_ms": round((time.monotonic() - self.created_at) * 1000, 2), **details})
+        updated, self.updated = self.updated, asyncio.Event()
+        updated.set()
+
+    def finish(self, result=None, error: dict | None = None):
+        self.result = result
+        self.error = error
+        self.status = "done" if error is None else "failed"
+        self.finished_at = time.monotonic()
+        self.add_event(self.status, **(error or {}))
+
+    # Wait until the job has more than `seen` events, or up to `timeout` seconds
+    async def wait_for_events(self, seen: int, timeout: float):
+        if len(self.events) > seen or self.finished:
+            return
+        try:
+            await asyncio.wait_for(self.updated.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def info(self) -> dict:
+        return {"job_id": self.id, "status": self.status, "events": self.events, "error": self.error}
+
+# Runs the submitted prediction jobs on PREDICTION_JOB_WORKERS workers of the event loop, so a client on a bad network doesn't hold
+# a connection open for the whole inference (nor retries it). Finished jobs are kept for PREDICTION_JOB_TTL_SECONDS
+class PredictionJobs:
+    def __init__(self):
+        self.queue: asyncio.Queue | None = None
+        self.pool_task: asyncio.Task | None = None
+        self.jobs = {} # Job id -> PredictionJob
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self.rejected = 0
+
+    # ----------------- Start the worker pool on the running event loop (restart it if the loop changed) ----------------- #
+    def start(self) -> asyncio.Task:
+        loop = asyncio.get_running_loop()
+        if self.pool_task is None or self.pool_task.done() or self.pool_task.get_loop() is not loop:
+            self.queue = asyncio.Queue(maxsize=max(1, settings.PREDICTION_JOB_MAX_QUEUED))
+            self.pool_task = loop.create_task(self.run_pool())
+            log(f"Prediction job pool started with {settings.PREDICTION_JOB_WORKERS} workers", debug=True)
+        return self.pool_task
+
+    async def run_pool(self):
+        workers = [asyncio.create_task(self.work()) for _ in range(max(1, settings.PREDICTION_JOB_WORKERS))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            # Don't leave jobs queued forever when the pool is stopped
+            while self.queue is not None and not self.queue.empty():
+                job, _ = self.queue.get_nowait()
+                job.finish(error={"status_code": 503, "detail": "Server shutting down"})
+
+    # ----------------- Queue a job running `run(job)`, returns the job right away ----------------- #
+    # run: the prediction coroutine function, it reports its stages with report_stage and returns the job's result
+    def submit(self, run, user_id: str | None = None) -> PredictionJob:
+        self.start()
+        self.expire()
+        job = PredictionJob(user_id)
+        try:
+            self.queue.put_nowait((job, run))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise JobQueueFull(f"Server busy - {self.queue.qsize()} prediction jobs queued")
+        self.jobs[job.id] = job
+        self.submitted += 1
+        return job
+
+    async def work(self):
+        while True:
+            job, run = await self.queue.get()
+            job.status = "running"
+            job.add_event("running")
+            token = current_job.set(job)
+            try:
+                job.finish(result=await run(job))
+                self.completed += 1
+            except asyncio.CancelledError:
+                job.finish(error={"status_code": 503, "detail": "Server shutting down"})
+                raise
+            except Exception as e:
+                self.failed += 1
+                job.finish(error={"status_code": getattr(e, "status_code", 500), "detail": getattr(e, "detail", str(e))})
+                log(f"Prediction job {job.id} failed - {job.error['detail']}", logging.ERROR)
+            finally:
+                current_job.reset(token)
+
+    # A job of a user is only visible to that user, expired jobs are gone
+    def get(self, job_id: str, user_id: str | None = None) -> PredictionJob | None:
+        self.expire()
+        job = self.jobs.get(job_id)
+        if job is None or (job.user_id is not None and job.user_id != user_id):
+            return None
+        return job
+
+    # Drop the finished jobs older than PREDICTION_JOB_TTL_SECONDS, and their results
+    def expire(self):
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self.jobs.items() if job.finished and now - job.finished_at > settings.PREDICTION_JOB_TTL_SECONDS]
+        for job_id in expired:
+            del self.jobs[job_id]
+        self.expired += len(expired)
+
+    # ----------------- Stats ----------------- #
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "running": sum(job.status == "running" for job in self.jobs.values()),
+            "stored_jobs": len(self.jobs),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "expired": self.expired,
+            "rejected": self.rejected,
+            "workers_setting": settings.PREDICTION_JOB_WORKERS,
+            "ttl_seconds_setting": settings.PREDICTION_JOB_TTL_SECONDS,
+        }
+
+prediction_jobs = PredictionJobs()
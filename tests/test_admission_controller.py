@@ -0,0 +1,167 @@
+import asyncio
+import base64
+import io
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+from app.core.config import settings
+from app.services.admission_controller import AdmissionController, AdmissionRejected, priority_class
+
+
+@pytest.fixture
+def limits(mocker):
+    mocker.patch.object(settings, 'ADMISSION_MAX_CONCURRENT', 2)
+    mocker.patch.object(settings, 'ADMISSION_MAX_PIXELS', 1000)
+    mocker.patch.object(settings, 'ADMISSION_MAX_QUEUE', 2)
+    mocker.patch.object(settings, 'ADMISSION_QUEUE_TIMEOUT_MS', 1000)
+    mocker.patch('app.services.admission_controller.log')
+
+
+class TestAdmissionController:
+
+    # Requests within the limits are admitted at once, the next ones wait in arrival order until budget is released
+    @pytest.mark.asyncio
+    async def test_queue_in_arrival_order(self, limits):
+        controller = AdmissionController()
+        assert await controller.acquire(600) == 600
+        assert await controller.acquire(300) == 300
+
+        admitted = []
+        async def request(pixels):
+            await controller.acquire(pixels)
+            admitted.append(pixels)
+        waiting = [asyncio.create_task(request(500)), asyncio.create_task(request(100))]
+        await asyncio.sleep(0)
+        assert admitted == [] and controller.stats()["queue_depth"] == 2
+
+        controller.release(600) # 500 fits in the pixel budget, and 100 waits for a concurrency slot
+        await waiting[0]
+        await asyncio.sleep(0)
+        assert admitted == [500] and not waiting[1].done()
+
+        controller.release(300)
+        await waiting[1]
+        assert admitted == [500, 100]
+        assert controller.in_flight == 2 and controller.pixels_in_flight == 600
+        assert controller.stats()["queued"] == 2
+
+    # A batch of images takes a concurrency slot per image (at most all of them) and waits until they're free
+    @pytest.mark.asyncio
+    async def test_batch_takes_a_slot_per_image(self, limits):
+        controller = AdmissionController()
+        await controller.acquire(100)
+        batch = asyncio.create_task(controller.acquire(200, images=2))
+        await asyncio.sleep(0)
+        assert not batch.done() and controller.in_flight == 1
+
+        controller.release(100)
+        await batch
+        assert controller.in_flight == 2 and controller.pixels_in_flight == 200
+
+        controller.release(200, images=2)
+        assert await controller.acquire(300, images=5) == 300 and controller.in_flight == 2 # More images than slots take all of them
+        controller.release(300, images=5)
+        assert controller.in_flight == 0 and controller.pixels_in_flight == 0
+
+    # A full queue and a request waiting past the timeout are rejected with a Retry-After
+    @pytest.mark.asyncio
+    async def test_rejections(self, limits, mocker):
+        mocker.patch.object(settings, 'ADMISSION_QUEUE_TIMEOUT_MS', 20)
+        controller = AdmissionController()
+        await controller.acquire(900)
+        await controller.acquire(100)
+        waiting = [asyncio.create_task(controller.acquire(100)) for _ in range(2)]
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected) as exc_info:
+            await controller.acquire(100)
+        assert exc_info.value.reason == "queue_full" and exc_info.value.retry_after == settings.ADMISSION_RETRY_AFTER_SECONDS
+
+        for result in await asyncio.gather(*waiting, return_exceptions=True):
+            assert isinstance(result, AdmissionRejected) and result.reason == "timeout"
+        assert controller.stats()["rejected"] == {"queue_full": 1, "timeout": 2, "displaced": 0}
+        assert controller.stats()["queue_depth"] == 0 and controller.in_flight == 2
+
+    # An image larger than the whole pixel budget is admitted alone
+    @pytest.mark.asyncio
+    async def test_oversized_image_runs_alone(self, limits):
+        controller = AdmissionController()
+        await controller.acquire(10)
+        oversized = asyncio.create_task(controller.acquire(50_000))
+        await asyncio.sleep(0)
+        assert not oversized.done()
+
+        controller.release(10)
+        assert await oversized == 1000 and controller.pixels_in_flight == 1000
+
+    # The priority class is the user's role when it has a weight, logged in users default to 'user'
+    def test_priority_class(self, mocker):
+        mocker.patch.object(settings, 'ADMISSION_PRIORITY_WEIGHTS', {"business": 4, "user": 2, "anonymous": 1})
+        assert priority_class(None) == "anonymous"
+        assert priority_class(mocker.Mock(role="business")) == "business"
+        assert priority_class(mocker.Mock(role="admin")) == "user"
+
+    # Queued classes are admitted in proportion to their weights, the lowest weighted class still gets its share
+    @pytest.mark.asyncio
+    async def test_weighted_fair_queuing(self, limits, mocker):
+        mocker.patch.object(settings, 'ADMISSION_MAX_CONCURRENT', 1)
+        mocker.patch.object(settings, 'ADMISSION_MAX_QUEUE', 100)
+        mocker.patch.object(settings, 'ADMISSION_PRIORITY_WEIGHTS', {"business": 3, "anonymous": 1})
+        controller = AdmissionController()
+        await controller.acquire(1, "business")
+
+        waiting = [asyncio.create_task(controller.acquire(1, priority)) for priority in ["anonymous"] * 20 + ["business"] * 20]
+        await asyncio.sleep(0)
+        for _ in range(16):
+            controller.release(1)
+
+        stats = controller.stats()["classes"]
+        assert stats["business"]["admitted"] == 1 + 12 and stats["anonymous"]["admitted"] == 4
+        assert stats["business"]["queue_depth"] == 8 and stats["anonymous"]["queue_depth"] == 16
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+
+    # A full queue rejects the newest request of a lower class to queue a higher class request, not the other way around
+    @pytest.mark.asyncio
+    async def test_displacement(self, limits, mocker):
+        mocker.patch.object(settings, 'ADMISSION_MAX_CONCURRENT', 1)
+        mocker.patch.object(settings, 'ADMISSION_PRIORITY_WEIGHTS', {"business": 4, "anonymous": 1})
+        controller = AdmissionController()
+        await controller.acquire(1, "anonymous")
+        anonymous = [asyncio.create_task(controller.acquire(1, "anonymous")) for _ in range(2)]
+        await asyncio.sleep(0)
+
+        business = asyncio.create_task(controller.acquire(1, "business"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as exc_info:
+            await anonymous[1]
+        assert exc_info.value.reason.startswith("displaced")
+        with pytest.raises(AdmissionRejected):
+            await controller.acquire(1, "anonymous")
+
+        controller.release(1)
+        assert await business == 1 and not anonymous[0].done()
+        assert controller.stats()["classes"]["anonymous"]["rejected"] == {"queue_full": 1, "timeout": 0, "displaced": 1}
+        anonymous[0].cancel()
+        await asyncio.gather(anonymous[0], return_exceptions=True)
+
+    # /predict answers a rejected request with a 503 and a Retry-After header, before decoding the image
+    @pytest.mark.asyncio
+    async def test_predict_rejected(self, mocker):
+        from app.api.endpoints.routes import predict
+        from app.schemas import PredictRequest
+        from app.services.admission_controller import admission_controller
+
+        mocker.patch.object(admission_controller, 'acquire', mocker.AsyncMock(side_effect=AdmissionRejected("queue_full", 3)))
+        decode = mocker.patch('app.api.endpoints.routes.decode_image')
+        buffered = io.BytesIO()
+        Image.new('RGB', (200, 100)).save(buffered, format="JPEG")
+        request = PredictRequest(image=base64.b64encode(buffered.getvalue()).decode(), return_currency="USD")
+
+        with pytest.raises(HTTPException) as exc_info:
+            await predict(request, None, None)
+
+        assert exc_info.value.status_code == 503 and exc_info.value.headers == {"Retry-After": "3"}
+        admission_controller.acquire.assert_awaited_once_with(200 * 100, "anonymous")
+        decode.assert_not_called()
@@ -0,0 +1,61 @@
+import numpy as np
+from PIL import Image
+from app.ml.model import MyModel
+from app.ml.detections import Detections
+from app.ml.annotation import class_color, label_sprite, annotation_canvas
+
+
+class TestAnnotation:
+
+    def test_class_color(self):
+        assert class_color('5 NIS') == (0, 0, 255)
+        assert class_color('2 Euro') == (255, 165, 0)
+        assert class_color('1 USD BILL') == (0, 128, 0)
+        assert class_color('EUR_B_5') == (255, 165, 0)
+        assert class_color('Unknown') == (255, 0, 0)
+        assert class_color('Fake 5 NIS') == (255, 0, 0) # Not a denomination of the table, whatever it contains
+
+    # Label sprites are rendered once and reused
+    def test_label_sprite_is_cached(self):
+        sprite = label_sprite('(0.93)', (0, 0, 255))
+
+        assert label_sprite('(0.93)', (0, 0, 255)) is sprite
+        assert sprite.getpixel((0, 0)) == (0, 0, 255)
+
+    # Arrays are shared with the other stages, annotating draws on a copy
+    def test_annotate_array_keeps_the_array(self):
+        image = np.full((100, 100, 3), 255, dtype=np.uint8)
+        detections = Detections.from_tuples([(10, 10, 50, 50, 'Currency', 0.9)], [('1 Euro', 0.95)])
+
+        annotated_image = MyModel.annotate_image(image, detections)
+
+        assert np.all(image == 255)
+        assert np.array(annotated_image)[10, 10].tolist() == [255, 165, 0]
+
+    # Large images can be rendered downscaled, the boxes are scaled with them
+    def test_annotate_downscaled(self):
+        image = np.full((200, 400, 3), 255, dtype=np.uint8)
+        detections = Detections.from_tuples([(100, 100, 300, 180, 'Currency', 0.9)], [('Unknown', 0.0)])
+
+        annotated_image = MyModel.annotate_image(image, detections, max_side=200)
+
+        assert annotated_image.size == (200, 100)
+        assert np.array(annotated_image)[89, 100].tolist() == [255, 0, 0] # Bottom edge of the box, at half scale
+
+    def test_canvas_keeps_small_images(self):
+        image = Image.new('RGB', (50, 40))
+
+        canvas, scale = annotation_canvas(image, max_side=100)
+
+        assert canvas is image
+        assert scale == 1.0
+
+    # The overlay is transparent outside the annotations, at the image's size downscaled to max_side
+    def test_render_overlay(self):
+        detections = Detections.from_tuples([(100, 100, 300, 180, 'Currency', 0.9)], [('5 NIS', 0.9)])
+
+        overlay = MyModel.render_overlay((200, 400, 3), detections, max_side=200)
+
+        assert overlay.mode == 'RGBA' and overlay.size == (200, 100)
+        assert overlay.getpixel((0, 0))[3] == 0
+        assert overlay.getpixel((50, 70)) == (0, 0, 255, 255)
@@ -0,0 +1,81 @@
+import pytest
+from app.ml import backends
+from app.core.config import settings
+from app.ml.detections import Detections
+from tools.compare_backends import match_detections, agreement
+
+
+class TestBackends:
+
+    @pytest.mark.parametrize("backend, expected", [
+        ("pytorch", "models/detection_model.pt"),
+        ("onnx", "models/detection_model.onnx"),
+        ("openvino", "models/detection_model_openvino_model"),
+        ("torchscript", "models/detection_model.torchscript"),
+    ])
+    def test_resolve_model_path(self, backend, expected):
+        assert backends.resolve_model_path("models/detection_model.pt", backend) == expected
+
+    # A path that already points to an exported model is kept as it is
+    def test_resolve_model_path_keeps_exported_path(self):
+        assert backends.resolve_model_path("models/detection_model.onnx", "openvino") == "models/detection_model.onnx"
+
+    def test_resolve_model_path_int8(self):
+        assert backends.resolve_model_path("models/detection_model.pt", "onnx", "int8") == "models/detection_model_int8.onnx"
+
+    # Quantized models only exist as ONNX models
+    def test_resolve_model_path_int8_needs_onnx(self):
+        with pytest.raises(ValueError):
+            backends.resolve_model_path("models/detection_model.pt", "openvino", "int8")
+
+    def test_resolve_model_path_unknown_backend(self):
+        with pytest.raises(ValueError):
+            backends.resolve_model_path("models/detection_model.pt", "tensorrt")
+
+    # A missing exported model isn't exported on the fly unless MODEL_BACKEND_AUTO_EXPORT is set
+    def test_load_model_missing_export(self, mocker, tmp_path):
+        mocker.patch.object(settings, 'MODEL_BACKEND_AUTO_EXPORT', False)
+        mock_yolo = mocker.patch('app.ml.backends.import_yolo')
+
+        with pytest.raises(FileNotFoundError):
+            backends.load_model(str(tmp_path / "detection_model.pt"), "onnx")
+        mock_yolo.assert_not_called()
+
+    # INT8 models need calibration images, so they're never made on the fly
+    def test_load_model_missing_int8(self, mocker, tmp_path):
+        mocker.patch.object(settings, 'MODEL_BACKEND_AUTO_EXPORT', True)
+        mock_yolo = mocker.patch('app.ml.backends.import_yolo')
+
+        with pytest.raises(FileNotFoundError):
+            backends.load_model(str(tmp_path / "detection_model.pt"), "onnx", "int8")
+        mock_yolo.assert_not_called()
+
+    def test_load_model_auto_export(self, mocker, tmp_path):
+        mocker.patch.object(settings, 'MODEL_BACKEND_AUTO_EXPORT', True)
+        mock_yolo = mocker.patch('app.ml.backends.import_yolo')
+        mock_yolo.return_value.return_value.export.return_value = str(tmp_path / "detection_model.onnx")
+
+        backends.load_model(str(tmp_path / "detection_model.pt"), "onnx")
+
+        mock_yolo.return_value.return_value.export.assert_called_once_with(format="onnx", dynamic=True)
+        mock_yolo.return_value.assert_called_with(str(tmp_path / "detection_model.onnx"), task="detect")
+
+
+class TestCompareBackends:
+
+    # Detections only match with the same detected class and enough overlap
+    def test_match_detections(self):
+        reference = Detections.from_tuples([(0, 0, 10, 10, "note", 0.9), (20, 20, 30, 30, "coin", 0.9)])
+        candidate = Detections.from_tuples([(21, 21, 30, 30, "coin", 0.9), (0, 0, 10, 10, "coin", 0.9), (50, 50, 60, 60, "note", 0.9)])
+
+        assert match_detections(reference, candidate) == [(1, 0)]
+
+    def test_agreement(self):
+        reference = {"a.jpg": Detections.from_tuples([(0, 0, 10, 10, "note", 0.9), (20, 20, 30, 30, "coin", 0.9)], [("10 Euro", 0.9), ("1 Euro", 0.8)])}
+        candidate = {"a.jpg": Detections.from_tuples([(0, 0, 10, 10, "note", 0.9)], [("20 Euro", 0.7)])}
+
+        result = agreement(reference, candidate, 0.5)
+
+        assert result["detection_recall"] == 0.5
+        assert result["detection_precision"] == 1.0
+        assert result["classification_agreement"] == 0.0
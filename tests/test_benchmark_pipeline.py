@@ -0,0 +1,45 @@
+import numpy as np
+from app.ml.model import MyModel
+from app.services.currency_exchange import exchange_service
+from tools.stub_models import StubDetectionModel, StubClassificationModel, synthetic_image
+from tools.benchmark_pipeline import STAGES, run_benchmarks, compare
+
+
+class TestBenchmarkPipeline:
+
+    # The stub detector finds the objects drawn on the synthetic image, the stub classifier names crops deterministically
+    def test_stub_models(self, mocker):
+        mocker.patch('app.ml.model.log')
+        image = synthetic_image(400, 300, 12)
+
+        detections = MyModel.detect(StubDetectionModel(12), image)
+        classified = MyModel.classify_objects(StubClassificationModel(), detections.crops(image))
+
+        assert len(detections) == 12
+        assert np.all(detections.xyxy[:, 2] <= 400) and np.all(detections.xyxy[:, 3] <= 300)
+        assert classified == MyModel.classify_objects(StubClassificationModel(), detections.crops(image))
+
+    # Every stage is timed for every case with the stub models
+    def test_run_benchmarks(self, mocker):
+        mocker.patch('app.ml.model.log')
+        mocker.patch.object(MyModel, 'object_detection_model', None)
+        mocker.patch.object(MyModel, 'classification_model', None)
+        mocker.patch.object(exchange_service, 'rates', {})
+        mocker.patch.object(exchange_service, 'last_update', None)
+
+        report = run_benchmarks("stub", [1, 10], [(320, 240)], runs=2)
+
+        assert set(report["results"]) == {"320x240/1", "320x240/10"}
+        assert report["results"]["320x240/10"]["detected_objects"] == 10
+        assert all(report["results"]["320x240/10"][stage]["median_ms"] > 0 for stage in STAGES)
+
+    # A stage slower than the baseline by more than the threshold is a regression
+    def test_compare(self):
+        stages = {stage: {"median_ms": 10.0, "p95_ms": 12.0} for stage in STAGES}
+        baseline = {"results": {"320x240/10": stages}}
+        candidate = {"results": {"320x240/10": {**stages, "annotate_image": {"median_ms": 12.0, "p95_ms": 14.0}}}}
+
+        rows = compare(baseline, candidate, threshold=0.1)
+
+        assert [row["stage"] for row in rows if row["regression"]] == ["annotate_image"]
+        assert not any(row["regression"] for row in compare(baseline, candidate, threshold=0.25))
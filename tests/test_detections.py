@@ -0,0 +1,78 @@
+import numpy as np
+from app.ml.detections import Detections, map_names, box_overlaps, greedy_suppress
+
+
+# Mock a YOLO result with the given boxes, class ids and confidences
+def yolo_result(mocker, xyxy, classes, confidences):
+    result = mocker.Mock()
+    result.boxes.xyxy.cpu().numpy.return_value = np.array(xyxy)
+    result.boxes.cls.cpu().numpy.return_value = np.array(classes)
+    result.boxes.conf.cpu().numpy.return_value = np.array(confidences)
+    return result
+
+
+class TestDetections:
+
+    # Detections under the threshold are dropped, boxes are scaled to the image and clipped to its bounds
+    def test_from_result_thresholds_scales_and_clips(self, mocker):
+        result = yolo_result(mocker, [[10, 10, 20, 20], [-5, 5, 60, 40], [0, 0, 5, 5]], [0, 1, 0], [0.9, 0.8, 0.3])
+
+        detections = Detections.from_result(result, {0: 'coin', 1: 'note'}, 0.5, scale=(2.0, 2.0), image_shape=(70, 100, 3))
+
+        assert len(detections) == 2
+        assert detections.xyxy.tolist() == [[20, 20, 40, 40], [0, 10, 100, 70]]
+        assert detections.det_class_names.tolist() == ['coin', 'note']
+        assert detections.cls_id.tolist() == [-1, -1]
+
+    def test_from_result_without_detections(self, mocker):
+        detections = Detections.from_result(yolo_result(mocker, [], [], []), {}, 0.5)
+
+        assert len(detections) == 0
+        assert detections.boxes_and_classes() == []
+
+    # Class ids the model has no name for and unclassified objects (-1) map to 'Unknown'
+    def test_map_names(self):
+        assert map_names([1, -1, 7, 0], {0: '1 NIS', 1: '2 NIS'}).tolist() == ['2 NIS', 'Unknown', 'Unknown', '1 NIS']
+
+    def test_class_counts(self):
+        detections = Detections(np.zeros((4, 4)), det_cls=[0, 0, 0, 0])
+        detections.set_classifications([1, 1, -1, 0], [0.9, 0.8, 0.0, 0.7], {0: '1 Euro', 1: '2 Euro'})
+
+        assert detections.class_counts() == {'Unknown': 1, '1 Euro': 1, '2 Euro': 2}
+
+    def test_crops_are_views_of_the_image(self):
+        image = np.arange(10 * 10 * 3, dtype=np.uint8).reshape(10, 10, 3)
+        detections = Detections([[2, 1, 6, 4]])
+
+        crop = detections.crops(image)[0]
+
+        assert np.array_equal(crop, image[1:4, 2:6])
+        assert np.shares_memory(crop, image)
+
+    # The tuple lists convert to detections and back
+    def test_tuples_round_trip(self):
+        boxes_and_classes = [(10, 10, 50, 50, 'Currency', 0.5), (0, 0, 20, 20, 'Currency', 0.75)]
+        classified_objects = [('1 NIS', 0.25), ('Unknown', 0.0)]
+
+        detections = Detections.from_tuples(boxes_and_classes, classified_objects)
+
+        assert detections.boxes_and_classes() == boxes_and_classes
+        assert detections.classified_objects() == classified_objects
+
+    def test_concatenate_and_select(self):
+        first = Detections([[0, 0, 1, 1]], det_conf=[0.5])
+        second = Detections([[1, 1, 2, 2], [2, 2, 3, 3]], det_conf=[0.75, 0.25])
+
+        detections = Detections.concatenate([first, second])
+
+        assert len(detections) == 3
+        assert detections[detections.det_conf >= 0.5].xyxy.tolist() == [[0, 0, 1, 1], [1, 1, 2, 2]]
+
+    # The shared overlap helpers: IoU and intersection over the smaller box, and greedy suppression in priority order
+    def test_box_overlaps_and_greedy_suppress(self):
+        xyxy = np.array([[0, 0, 10, 10], [0, 0, 10, 5], [20, 20, 30, 30]])
+
+        assert np.allclose(box_overlaps(xyxy)[0], [1.0, 0.5, 0.0])
+        assert np.allclose(box_overlaps(xyxy, mode="smaller")[0], [1.0, 1.0, 0.0])
+        assert box_overlaps(xyxy[:1], xyxy[1:]).shape == (1, 2)
+        assert greedy_suppress(box_overlaps(xyxy) > 0.4).tolist() == [True, False, True]
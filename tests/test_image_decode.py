@@ -0,0 +1,67 @@
+import io
+import pytest
+import numpy as np
+from PIL import Image
+from app.ml.image_decode import decode_image, decoded_pixels, as_rgb_array, detection_input
+
+
+def encode(image, format, **save_args):
+    buffered = io.BytesIO()
+    image.save(buffered, format=format, **save_args)
+    return buffered.getvalue()
+
+
+class TestImageDecode:
+
+    # Large JPEGs are decoded downscaled by a DCT scale (1/2, 1/4 or 1/8), keeping the long side >= the target side
+    def test_large_jpeg_is_decoded_downscaled(self):
+        image = decode_image(encode(Image.new("RGB", (4000, 3000), "white"), "JPEG"), target_side=1600)
+
+        assert image.shape == (1500, 2000, 3)
+        assert image.dtype == np.uint8
+
+    def test_large_png_is_decoded_downscaled(self):
+        image = decode_image(encode(Image.new("RGB", (4000, 3000), "white"), "PNG"), target_side=1600)
+
+        assert image.shape == (1500, 2000, 3)
+
+    # The admission cost of an image is the size it's really decoded to: a JPEG's DCT scale isn't its integer factor (6000 // 1600 = 3)
+    def test_decoded_pixels_matches_the_decoded_size(self):
+        for image_data in [encode(Image.new("RGB", (6000, 4000)), "JPEG"), encode(Image.new("RGB", (5000, 3750)), "JPEG"),
+                           encode(Image.new("RGB", (5000, 3750)), "PNG")]:
+            image = decode_image(image_data, target_side=1600)
+
+            assert decoded_pixels(image_data, target_side=1600) == image.shape[0] * image.shape[1]
+
+    def test_small_image_is_decoded_at_full_resolution(self):
+        image = decode_image(encode(Image.new("L", (300, 200)), "PNG"), target_side=1600)
+
+        assert image.shape == (200, 300, 3)
+
+    # The EXIF orientation is applied while decoding (6 = rotated 90 degrees clockwise)
+    def test_exif_orientation_is_applied(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+
+        image = decode_image(encode(Image.new("RGB", (300, 200), "white"), "JPEG", exif=exif), target_side=1600)
+
+        assert image.shape == (300, 200, 3)
+
+    def test_as_rgb_array_keeps_arrays(self):
+        array = np.zeros((4, 5, 3), dtype=np.uint8)
+
+        assert as_rgb_array(array) is array
+        assert as_rgb_array(Image.new("L", (5, 4))).shape == (4, 5, 3)
+        with pytest.raises(TypeError):
+            as_rgb_array("not_an_image")
+
+    # The detection input is downscaled to the model input size in BGR order, with the scale back to the full image
+    def test_detection_input(self):
+        image = np.zeros((1500, 2000, 3), dtype=np.uint8)
+        image[..., 0] = 255 # Red
+
+        model_input, scale = detection_input(image, input_size=640)
+
+        assert model_input.shape == (480, 640, 3)
+        assert model_input[0, 0].tolist() == [0, 0, 255]
+        assert scale == (2000 / 640, 1500 / 480)
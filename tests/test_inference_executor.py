@@ -0,0 +1,74 @@
+import pytest
+import asyncio
+import numpy as np
+from PIL import Image
+from multiprocessing import shared_memory
+from app.ml.model import MyModel
+from app.core.config import settings
+from app.ml.inference_executor import InferenceExecutor, share_image, infer_shared_images
+
+
+class TestInferenceExecutor:
+
+    # A PIL image is copied into shared memory as an RGB array
+    def test_share_image_copies_pixels_to_shared_memory(self):
+        image = Image.fromarray(np.arange(4 * 5 * 3, dtype=np.uint8).reshape(4, 5, 3))
+
+        shm, (name, shape) = share_image(image)
+        try:
+            assert shape == (4, 5, 3)
+            assert np.array_equal(np.ndarray(shape, dtype=np.uint8, buffer=shm.buf), np.asarray(image))
+        finally:
+            shm.close()
+            shm.unlink()
+
+    # The worker function reads the images from shared memory and runs them through the models
+    def test_infer_shared_images_reads_images_from_shared_memory(self, mocker):
+        received = []
+        def infer_images(images, confidence_thresholds):
+            received.extend(image.copy() for image in images)
+            return [([], []) for _ in images]
+        mocker.patch.object(MyModel, 'infer_images', side_effect=infer_images)
+        image = np.full((6, 7, 3), 42, dtype=np.uint8)
+        shm, descriptor = share_image(image)
+
+        try:
+            result = infer_shared_images([descriptor], [0.5])
+        finally:
+            shm.close()
+            shm.unlink()
+
+        assert result == [([], [])]
+        assert np.array_equal(received[0], image)
+
+    # With no worker processes configured, inference runs in a thread of the server process
+    @pytest.mark.asyncio
+    async def test_infer_images_without_workers_runs_in_process(self, mocker):
+        mocker.patch.object(settings, 'INFERENCE_WORKERS', 0)
+        mock_infer_images = mocker.patch.object(MyModel, 'infer_images', return_value=[([], [])])
+        executor = InferenceExecutor()
+
+        result = await executor.infer_images(["image"], [0.5])
+
+        assert result == [([], [])]
+        assert executor.pool is None
+        mock_infer_images.assert_called_once_with(["image"], [0.5])
+
+    # Shared memory blocks are released after a worker process ran the batch
+    @pytest.mark.asyncio
+    async def test_infer_images_with_workers_releases_shared_memory(self, mocker):
+        executor = InferenceExecutor()
+        executor.pool = mocker.Mock()
+        shared_names = []
+        def run_in_executor(pool, function, shared_images, confidence_thresholds):
+            shared_names.extend(name for name, _ in shared_images)
+            future = asyncio.get_running_loop().create_future()
+            future.set_result([([], [])])
+            return future
+        mocker.patch.object(asyncio.get_running_loop(), 'run_in_executor', side_effect=run_in_executor)
+
+        result = await executor.infer_images([np.zeros((2, 2, 3), dtype=np.uint8)], [0.5])
+
+        assert result == [([], [])]
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=shared_names[0])
@@ -0,0 +1,73 @@
+import pytest
+import asyncio
+from app.ml.model import MyModel
+from app.core.config import settings
+from app.services.inference_scheduler import InferenceScheduler
+
+
+# Mock infer_images to return the image itself as the boxes so the fan out order can be checked
+@pytest.fixture
+def mock_infer_images(mocker):
+    return mocker.patch.object(MyModel, 'infer_images', side_effect=lambda images, thresholds: [([image], [("Unknown", 0.0)]) for image in images])
+
+class TestInferenceScheduler:
+
+    # Concurrent requests are collected into a single batch and each request gets its own result back
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_are_batched(self, mocker, mock_infer_images):
+        mocker.patch.object(settings, 'INFERENCE_MAX_BATCH_SIZE', 8)
+        mocker.patch.object(settings, 'INFERENCE_MAX_WAIT_MS', 50)
+        scheduler = InferenceScheduler()
+
+        results = await asyncio.gather(*[scheduler.predict(f"image_{i}") for i in range(5)])
+
+        assert mock_infer_images.call_count == 1
+        assert [boxes for boxes, _ in results] == [[f"image_{i}"] for i in range(5)]
+        assert scheduler.stats()["batch_sizes"] == {5: 1}
+        scheduler.worker_task.cancel()
+
+    # A batch never grows beyond INFERENCE_MAX_BATCH_SIZE
+    @pytest.mark.asyncio
+    async def test_batches_are_capped_by_max_batch_size(self, mocker, mock_infer_images):
+        mocker.patch.object(settings, 'INFERENCE_MAX_BATCH_SIZE', 2)
+        mocker.patch.object(settings, 'INFERENCE_MAX_WAIT_MS', 50)
+        scheduler = InferenceScheduler()
+
+        results = await asyncio.gather(*[scheduler.predict(f"image_{i}") for i in range(5)])
+
+        assert [boxes for boxes, _ in results] == [[f"image_{i}"] for i in range(5)]
+        assert scheduler.stats()["batch_sizes"] == {1: 1, 2: 2}
+        assert scheduler.stats()["max_batch_size"] == 2
+        scheduler.worker_task.cancel()
+
+    # A model error is raised in every request of the failed batch
+    @pytest.mark.asyncio
+    async def test_batch_error_is_sent_to_all_requests(self, mocker):
+        mocker.patch.object(MyModel, 'infer_images', side_effect=RuntimeError("Model error"))
+        mocker.patch.object(settings, 'INFERENCE_MAX_WAIT_MS', 50)
+        scheduler = InferenceScheduler()
+
+        results = await asyncio.gather(scheduler.predict("image_0"), scheduler.predict("image_1"), return_exceptions=True)
+
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert scheduler.stats()["total_batches"] == 1
+        scheduler.worker_task.cancel()
+
+    # The confidence threshold of each request is passed to the model
+    @pytest.mark.asyncio
+    async def test_confidence_thresholds_are_passed_per_request(self, mocker, mock_infer_images):
+        mocker.patch.object(settings, 'INFERENCE_MAX_WAIT_MS', 50)
+        scheduler = InferenceScheduler()
+
+        await asyncio.gather(scheduler.predict("image_0", 0.3), scheduler.predict("image_1", 0.7))
+
+        mock_infer_images.assert_called_once_with(["image_0", "image_1"], [0.3, 0.7])
+        scheduler.worker_task.cancel()
+
+    # Stats are available before any request was made
+    def test_stats_without_requests(self):
+        stats = InferenceScheduler().stats()
+
+        assert stats["queue_depth"] == 0
+        assert stats["total_batches"] == 0
+        assert stats["average_batch_size"] == 0.0
@@ -0,0 +1,121 @@
+import asyncio
+import io
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+from app.core.config import settings
+from app.ml.detections import Detections
+from app.ml.tracking import BoxTracker
+from app.services.live_session import LiveSession
+from tools.stub_models import layout_boxes, synthetic_image
+
+
+def encode(image):
+    buffered = io.BytesIO()
+    Image.fromarray(image).save(buffered, format="PNG")
+    return buffered.getvalue()
+
+def keyframe_detections(width, height, count):
+    xyxy = layout_boxes(width, height, count)
+    return Detections(xyxy, np.zeros(count), np.full(count, 0.9), np.arange(count) % 2, np.full(count, 0.8),
+                      {0: "Currency"}, {0: "1 NIS", 1: "5 NIS"})
+
+
+class TestLiveSession:
+
+    # The tracked boxes follow the objects of a shifted frame and keep their classifications
+    def test_box_tracker(self):
+        image = synthetic_image(320, 240, 4, seed=1)
+        detections = keyframe_detections(320, 240, 4)
+        tracker = BoxTracker(max_side=320)
+        tracker.reset(image, detections)
+
+        tracked, lost = tracker.update(np.roll(image, (6, 9), axis=(0, 1)))
+
+        assert lost == 0
+        assert np.abs(tracked.xyxy - (detections.xyxy + np.array([9, 6, 9, 6]))).max() <= 2
+        assert tracked.classified_objects() == detections.classified_objects()
+
+    # Keyframes run the inference every LIVE_KEYFRAME_INTERVAL frames, the frames in between are tracked and the counts are only sent when they change
+    @pytest.mark.asyncio
+    async def test_keyframes_and_counts(self, mocker):
+        mocker.patch.object(settings, 'LIVE_KEYFRAME_INTERVAL', 3)
+        mocker.patch.object(settings, 'LIVE_KEYFRAME_MAX_SECONDS', 60)
+        mocker.patch('app.ml.model.log')
+        image = synthetic_image(320, 240, 4, seed=1)
+        session = LiveSession("ILS")
+        infer = mocker.patch.object(session, 'infer', mocker.AsyncMock(return_value=keyframe_detections(320, 240, 4)))
+
+        frames = [await session.process(i, encode(np.roll(image, i, axis=1))) for i in range(4)]
+
+        assert [messages[0]["keyframe"] for messages in frames] == [True, False, False, True]
+        assert infer.await_count == 2
+        assert all(len(messages[0]["detections"]) == 4 for messages in frames)
+        assert [len(messages) for messages in frames] == [2, 1, 1, 1]
+        assert frames[0][1]["type"] == "counts" and frames[0][1]["total"] == 12.0
+
+    # Frames received while one is processed are replaced by the newest one
+    @pytest.mark.asyncio
+    async def test_stale_frames_are_dropped(self, mocker):
+        session = LiveSession("USD")
+        processed = []
+        async def process(frame_number, frame_data):
+            processed.append(frame_number)
+            await asyncio.sleep(0.05)
+            return [{"type": "frame", "frame": frame_number}]
+        mocker.patch.object(session, 'process', process)
+        sent = []
+        async def send(message):
+            sent.append(message)
+        task = asyncio.create_task(session.run(send))
+
+        session.submit(b"1")
+        await asyncio.sleep(0.01)
+        for frame in [b"2", b"3", b"4"]:
+            session.submit(frame)
+        await asyncio.sleep(0.15)
+        task.cancel()
+
+        assert processed == [1, 4] and session.dropped == 2
+        assert [message["frame"] for message in sent] == [1, 4]
+
+    # A frame whose inference fails gets an error message and the session keeps processing the next frames
+    @pytest.mark.asyncio
+    async def test_inference_failure_is_reported(self, mocker):
+        mocker.patch('app.services.live_session.log')
+        mocker.patch('app.ml.model.log')
+        session = LiveSession("USD")
+        mocker.patch.object(session, 'infer', mocker.AsyncMock(side_effect=[RuntimeError("executor died"), keyframe_detections(320, 240, 2)]))
+        sent = []
+        async def send(message):
+            sent.append(message)
+        task = asyncio.create_task(session.run(send))
+
+        frame = encode(synthetic_image(320, 240, 2))
+        session.submit(frame)
+        while not sent:
+            await asyncio.sleep(0.01)
+        session.submit(frame)
+        while len(sent) < 2:
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+        assert sent[0]["type"] == "error" and sent[0]["frame"] == 1
+        assert sent[1]["type"] == "frame" and sent[1]["keyframe"] and len(sent[1]["detections"]) == 2
+
+    # The WebSocket streams the frames' boxes and counts back
+    def test_websocket(self, mocker):
+        from app.api.endpoints.routes import router
+        mocker.patch('app.ml.model.log')
+        mocker.patch.object(LiveSession, 'infer', mocker.AsyncMock(return_value=keyframe_detections(320, 240, 2)))
+        app = FastAPI()
+        app.include_router(router, prefix="/api")
+
+        with TestClient(app).websocket_connect("/api/live?return_currency=NIS") as websocket:
+            websocket.send_bytes(encode(synthetic_image(320, 240, 2)))
+            frame, counts = websocket.receive_json(), websocket.receive_json()
+
+        assert frame["type"] == "frame" and frame["keyframe"] and len(frame["detections"]) == 2
+        assert counts["type"] == "counts" and counts["total"] == 6.0
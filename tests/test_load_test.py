@@ -0,0 +1,53 @@
+import asyncio
+from collections import Counter
+import httpx
+import pytest
+from tools.load_test import parse_mix, histogram, build_report, run_load
+
+
+class TestLoadTest:
+
+    # The mix is parsed into weights, unknown scenarios and mixes without a positive weight are rejected
+    def test_parse_mix(self):
+        assert parse_mix(["predict_auth=3", "login"]) == {"predict_auth": 3.0, "login": 1.0}
+        with pytest.raises(ValueError):
+            parse_mix(["upload=1"])
+        with pytest.raises(ValueError):
+            parse_mix(["login=0"])
+
+    # The report has the overall and per scenario counts, errors, percentiles and histogram
+    def test_build_report(self):
+        samples = [("predict_auth", 200, 0.004)] * 90 + [("predict_auth", 200, 0.3)] * 9 + [("login", 401, 12.0)]
+
+        report = build_report(samples, elapsed=10.0)
+
+        assert report["overall"]["requests"] == 100 and report["overall"]["rps"] == 10.0
+        assert report["overall"]["errors"] == 1 and report["overall"]["statuses"] == {"200": 99, "401": 1}
+        assert report["scenarios"]["predict_auth"]["p50_ms"] == pytest.approx(4.0)
+        assert report["scenarios"]["predict_auth"]["p95_ms"] == pytest.approx(300.0)
+        assert report["overall"]["histogram"]["<=5ms"] == 90 and report["overall"]["histogram"][">10000ms"] == 1
+        assert sum(histogram([1, 1.5, 2000]).values()) == 3
+
+    # Every client sends the mix's requests until max_requests, with the users' tokens on the authenticated requests only
+    def test_run_load(self):
+        requests = []
+
+        def handler(request):
+            requests.append((request.method, request.url.path, request.headers.get("Authorization")))
+            return httpx.Response(200, json={})
+
+        async def run():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://test") as client:
+                return await run_load(client, {"predict_auth": 1, "predict_anon": 1, "get_images": 1}, concurrency=4, duration=10,
+                                      max_requests=40, users=[("user0@loadtest.dev", "token")], images=["aW1hZ2U="])
+
+        samples, elapsed = asyncio.run(run())
+
+        assert len(samples) == len(requests) == 40
+        assert {scenario for scenario, _, _ in samples} == {"predict_auth", "predict_anon", "get_images"}
+        assert all(status_code == 200 for _, status_code, _ in samples)
+        sent = Counter((path, authorization) for _, path, authorization in requests)
+        scenarios = Counter(scenario for scenario, _, _ in samples)
+        assert sent[("/api/predict", "Bearer token")] == scenarios["predict_auth"]
+        assert sent[("/api/predict", None)] == scenarios["predict_anon"]
+        assert sent[("/api/get_images", "Bearer token")] == scenarios["get_images"]
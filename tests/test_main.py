@@ -188,3 +188,51 @@ class TestRoot:
         response = await async_client.get("/")
         assert response.status_code == 200
         assert response.json() == {"message": "Welcome to CashCam!"}
+
+
+#---------------------------------------------------------- ready --------------------------------------------------------#
+
+
+class TestReady:
+    # Test ready endpoint returns 503 while the models are warming up
+    @pytest.mark.asyncio
+    async def test_not_ready_while_warming_up(self, mocker):
+        from app.main import ready, inference_executor
+        mocker.patch.object(inference_executor, 'ready', False)
+        mocker.patch.object(inference_executor, 'warmup_error', None)
+
+        response = await ready()
+        assert response.status_code == 503
+
+    # Test ready endpoint returns the startup timings once the warmup is done
+    @pytest.mark.asyncio
+    async def test_ready_after_warmup(self, mocker):
+        from app.main import ready, inference_executor
+        from app.ml.model import MyModel
+        mocker.patch.object(MyModel, 'warmup', return_value={"first_inference_seconds": 0.1})
+        mocker.patch.object(inference_executor, 'ready', False)
+        mocker.patch.object(inference_executor, 'pool', None)
+        mocker.patch('app.ml.inference_executor.settings.INFERENCE_WORKERS', 0)
+
+        await inference_executor.warmup()
+        response = await ready()
+
+        assert response["status"] == "ready"
+        assert response["startup_timings"]["models"]["server"] == {"first_inference_seconds": 0.1}
+
+    # Test ready endpoint reports a warmup error
+    @pytest.mark.asyncio
+    async def test_warmup_error(self, mocker):
+        from app.main import ready, inference_executor
+        from app.ml.model import MyModel
+        mocker.patch.object(MyModel, 'warmup', side_effect=FileNotFoundError("models/detection_model.pt"))
+        mocker.patch.object(inference_executor, 'ready', False)
+        mocker.patch.object(inference_executor, 'warmup_error', None)
+        mocker.patch.object(inference_executor, 'pool', None)
+        mocker.patch('app.ml.inference_executor.settings.INFERENCE_WORKERS', 0)
+
+        await inference_executor.warmup()
+        response = await ready()
+
+        assert response.status_code == 503
+        assert b"models/detection_model.pt" in response.body
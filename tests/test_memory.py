@@ -0,0 +1,77 @@
+import tracemalloc
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.core import memory
+from app.core.config import settings
+from app.core.memory import MemoryTrace, MemoryStats, MemoryProfilingMiddleware, current_memory_trace
+from app.core.tracing import span
+
+MB = 2**20
+
+
+class TestMemory:
+
+    # A stage's peak counts its temporary allocations, its allocated bytes only what it kept, and an enclosing stage's peak its children's
+    def test_memory_trace(self):
+        tracemalloc.start()
+        memory_trace = MemoryTrace("POST /api/predict")
+        token = current_memory_trace.set(memory_trace)
+        try:
+            with span("encode"):
+                with span("image_decode"):
+                    kept = bytearray(4 * MB)
+                with span("annotate"):
+                    temporary = bytearray(8 * MB)
+                    del temporary
+        finally:
+            current_memory_trace.reset(token)
+            tracemalloc.stop()
+
+        stages = {stage: (allocated, peak) for stage, allocated, peak, _ in memory_trace.stages}
+        assert [stage for stage, *_ in memory_trace.stages] == ["image_decode", "annotate", "encode"]
+        assert stages["image_decode"][0] >= 4 * MB and stages["image_decode"][1] >= 4 * MB
+        assert abs(stages["annotate"][0]) < MB and stages["annotate"][1] >= 8 * MB
+        assert stages["encode"][0] >= 4 * MB and stages["encode"][1] >= 12 * MB
+        del kept
+
+    # The stages are summarized across the recent requests, the highest peak first
+    def test_memory_stats(self, mocker):
+        mocker.patch.object(settings, "MEMORY_PROFILING_HISTORY", 2)
+        memory_stats = MemoryStats()
+        for peak in [10, 30, 20]:
+            memory_trace = MemoryTrace("POST /api/predict")
+            memory_trace.stages = [("image_decode", 5, peak, 0), ("encode", 1, 15, 4)]
+            memory_stats.record(memory_trace)
+
+        stats = memory_stats.stats()
+
+        assert stats["sampled_requests"] == 3 and stats["recent_requests"] == 2
+        assert [stage["stage"] for stage in stats["stages"]] == ["image_decode", "encode"]
+        assert stats["stages"][0]["max_peak_bytes"] == 30 and stats["stages"][0]["mean_peak_bytes"] == 25
+        assert stats["stages"][1]["max_rss_delta_bytes"] == 4
+
+    # Sampled /predict requests are traced with tracemalloc only while they run, the other routes never are
+    def test_middleware(self, mocker):
+        mocker.patch.object(settings, "MEMORY_PROFILING_SAMPLE_RATE", 1)
+        mocker.patch.object(memory, "memory_stats", MemoryStats())
+        mocker.patch.object(memory, "log")
+        app = FastAPI()
+        app.add_middleware(MemoryProfilingMiddleware)
+
+        @app.post("/api/predict")
+        async def predict():
+            with span("image_decode"):
+                image = bytearray(2 * MB)
+            return {"tracing": tracemalloc.is_tracing(), "size": len(image)}
+
+        @app.get("/api/get_images")
+        async def get_images():
+            return {"tracing": tracemalloc.is_tracing()}
+
+        client = TestClient(app)
+        assert client.post("/api/predict").json()["tracing"]
+        assert not client.get("/api/get_images").json()["tracing"]
+        assert not tracemalloc.is_tracing()
+
+        stages = [stage["stage"] for stage in memory.memory_stats.stats()["stages"]]
+        assert memory.memory_stats.sampled_requests == 1 and set(stages) == {"image_decode", "total"}
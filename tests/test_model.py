@@ -3,6 +3,7 @@ import logging
 import numpy as np
 from PIL import Image, ImageDraw
 from app.ml.model import MyModel
+from app.ml.detections import Detections
 from app.core.config import settings
 from PIL import UnidentifiedImageError
 from app.schemas.predict_schema import CurrencyInfo
@@ -135,6 +136,27 @@ def test_currency_detection(mocker):
     assert boxes_and_classes[0][4] == '1 Euro'  # Verify the detected class name
 
 
+# Large images are detected downscaled, the boxes and crops are mapped back to the full-resolution image
+def test_detect_objects_maps_boxes_to_full_resolution(mocker):
+    mocker.patch.object(settings, 'DETECTION_INPUT_SIZE', 100)
+    YOLO_model = mocker.Mock()
+    YOLO_model.names = {0: 'object'}
+    boxes_mock = mocker.Mock()
+    boxes_mock.xyxy.cpu().numpy.return_value = np.array([[10, 10, 50, 25]])
+    boxes_mock.cls.cpu().numpy.return_value = np.array([0])
+    boxes_mock.conf.cpu().numpy.return_value = np.array([0.9])
+    results_mock = mocker.Mock()
+    results_mock.boxes = boxes_mock
+    YOLO_model.return_value = [results_mock]
+    image = np.zeros((200, 400, 3), dtype=np.uint8)
+
+    cropped_images, boxes_and_classes = MyModel.detect_and_collect_objects(YOLO_model, image, confidence_threshold=0.5)
+
+    assert YOLO_model.call_args[0][0].shape == (50, 100, 3)
+    assert boxes_and_classes[0][:4] == (40, 40, 200, 100)
+    assert cropped_images[0].shape == (60, 160, 3)
+
+
 #--------------------------------------------------- classify_objects ---------------------------------------------------#
 
 
@@ -221,6 +243,53 @@ def test_classify_objects_with_various_image_sizes(mock_yolo_model, image_shape,
     result = MyModel.classify_objects(mock_yolo_model, cropped_images)
     assert result == expected_result
 
+# Mock a YOLO model that returns one result per image in the batch, the class id is the image's width
+@pytest.fixture
+def mock_batch_yolo_model(mocker):
+    def predict(images, verbose=False):
+        results = []
+        for img in images:
+            result = mocker.Mock()
+            result.boxes.xyxy.cpu().numpy.return_value = np.array([[0, 0, 10, 10]])
+            result.boxes.cls.cpu().numpy.return_value = np.array([img.width])
+            result.boxes.conf.cpu().numpy.return_value = np.array([0.8])
+            results.append(result)
+        return results
+
+    mock_yolo_model = mocker.Mock(side_effect=predict)
+    mock_yolo_model.names = {width: f'object_{width}' for width in range(1, 30)}
+    return mock_yolo_model
+
+@pytest.mark.parametrize(
+    "batch_size, expected_calls",
+    [
+        (1, 25),  # One forward pass per object
+        (10, 3),  # Chunks of 10, 10 and 5
+        (32, 1),  # All objects in a single forward pass
+    ]
+)
+def test_classify_objects_in_batches(mock_batch_yolo_model, batch_size, expected_calls):
+    cropped_images = [np.zeros((10, width, 3), dtype=np.uint8) for width in range(1, 26)]
+
+    result = MyModel.classify_objects(mock_batch_yolo_model, cropped_images, batch_size=batch_size)
+
+    assert mock_batch_yolo_model.call_count == expected_calls
+    assert result == [(f'object_{width}', 0.8) for width in range(1, 26)]  # Same order as the cropped images
+
+def test_classify_objects_batch_keeps_unconvertible_crops_unknown(mocker, mock_batch_yolo_model):
+    fromarray = Image.fromarray
+    def fromarray_failing_on_width_4(img):
+        if img.shape[1] == 4:
+            raise UnidentifiedImageError
+        return fromarray(img)
+    mocker.patch("PIL.Image.fromarray", side_effect=fromarray_failing_on_width_4)
+    cropped_images = [np.zeros((10, width, 3), dtype=np.uint8) for width in (3, 4, 5)]
+
+    result = MyModel.classify_objects(mock_batch_yolo_model, cropped_images, batch_size=8)
+
+    assert mock_batch_yolo_model.call_count == 1
+    assert result == [('object_3', 0.8), ('Unknown', 0.0), ('object_5', 0.8)]
+
 
 #---------------------------------------------------- annotate_image ----------------------------------------------------#
 
@@ -242,7 +311,7 @@ class TestAnnotateImage:
     # Check for color assignment and correct drawing for known classes
     def test_annotate_image_known_classes(self, blank_image):
         boxes_and_classes = [(10, 10, 50, 50, 'Currency', 0.9)]
-        classified_objects = [('USD Dollar', 0.95)]
+        classified_objects = [('1 USD BILL', 0.95)]
 
         annotated_image = MyModel.annotate_image(blank_image, boxes_and_classes, classified_objects)
         annotated_array = np.array(annotated_image)
@@ -276,7 +345,7 @@ class TestAnnotateImage:
     # Check for currency-specific color assignments
     def test_annotate_image_currency_colors(self, blank_image):
         boxes_and_classes = [(10, 10, 50, 50, 'Currency', 0.9)]
-        classified_objects = [('Euro', 0.95)]
+        classified_objects = [('2 Euro', 0.95)]
 
         annotated_image = MyModel.annotate_image(blank_image, boxes_and_classes, classified_objects)
         annotated_array = np.array(annotated_image)
@@ -295,7 +364,7 @@ class TestAnnotateImage:
             (10, 10, 30, 30, 'Currency', 0.9),  # Smaller USD box
             (40, 40, 60, 60, 'Currency', 0.8)   # Separate Euro box
         ]
-        classified_objects = [('USD Dollar', 0.95), ('Euro', 0.85)]
+        classified_objects = [('1 USD BILL', 0.95), ('2 Euro', 0.85)]
 
         annotated_image = MyModel.annotate_image(blank_image, boxes_and_classes, classified_objects)
         annotated_array = np.array(annotated_image)
@@ -325,7 +394,7 @@ class TestAnnotateImage:
     # Test performance on high-resolution images
     def test_annotate_image_high_resolution(self, high_res_image):
         boxes_and_classes = [(100, 100, 500, 500, 'Currency', 0.9)]
-        classified_objects = [('USD Dollar', 0.95)]
+        classified_objects = [('1 USD BILL', 0.95)]
 
         annotated_image = MyModel.annotate_image(high_res_image, boxes_and_classes, classified_objects)
         annotated_array = np.array(annotated_image)
@@ -345,7 +414,7 @@ class TestAnnotateImage:
     # Verifies that labels are formatted correctly
     def test_annotate_image_label_formatting(self, blank_image):
         boxes_and_classes = [(10, 10, 50, 50, 'Currency', 0.9)]
-        classified_objects = [('USD Dollar', 0.95)]
+        classified_objects = [('1 USD BILL', 0.95)]
 
         annotated_image = MyModel.annotate_image(blank_image, boxes_and_classes, classified_objects)
         annotated_array = np.array(annotated_image)
@@ -752,34 +821,25 @@ class TestMyModel:
 
         # Mock the ImageDraw module
         mock_draw = mocker.Mock()
-        mocker.patch('app.ml.model.ImageDraw.Draw', return_value=mock_draw)
-
-        # Mock the textbbox method
-        expected_text_bbox = [10, 10, 60, 30]  # Example coordinates; adjust as needed
-        mock_draw.textbbox = mocker.Mock(return_value=expected_text_bbox)
+        mocker.patch('app.ml.annotation.ImageDraw.Draw', return_value=mock_draw)
+        mock_sprite = mocker.patch('app.ml.annotation.label_sprite', return_value=Image.new('RGB', (20, 12)))
+        mock_paste = mocker.patch.object(image, 'paste')
 
         # Call the method under test
         annotated_image = MyModel.annotate_image(image, boxes_and_classes, classified_objects)
 
         # Assertions
-        assert annotated_image is not None
-
-        # Ensure two rectangles were drawn: one for the bounding box, one for the label background
-        assert mock_draw.rectangle.call_count == 2
-
-        # Check the bounding box rectangle call
-        bounding_box_call = mock_draw.rectangle.call_args_list[0]
-        assert bounding_box_call == mocker.call([10, 10, 50, 50], outline='blue', width=2)
-
-        # Check the label background rectangle call
-        text_box_call = mock_draw.rectangle.call_args_list[1]
-        assert text_box_call == mocker.call(expected_text_bbox, fill='blue')
+        assert annotated_image is image # Drawn in place
 
-        # Ensure the text was drawn once
-        assert mock_draw.text.call_count == 1
+        # Ensure one rectangle was drawn for the bounding box, the label is made of pre-rendered sprites
+        assert mock_draw.rectangle.call_count == 1
+        assert mock_draw.rectangle.call_args == mocker.call([10, 10, 50, 50], outline=(0, 0, 255), width=2)
+        assert mock_draw.textbbox.call_count == 0
+        assert mock_draw.text.call_count == 0
 
-        # Check the text drawing arguments
-        mock_draw.text.assert_called_with((10, 10), 'NIS_C_10 (0.90)', fill='white')
+        # Check the label sprites and where they were pasted
+        assert mock_sprite.call_args_list == [mocker.call('NIS_C_10 ', (0, 0, 255)), mocker.call('(0.90)', (0, 0, 255))]
+        assert mock_paste.call_args_list == [mocker.call(mock_sprite.return_value, (10, 10)), mocker.call(mock_sprite.return_value, (30, 10))]
 
     def test_log_messages_debug_enabled(self, mocker):
         # Mock settings.DEBUG to True
@@ -851,4 +911,74 @@ class TestMyModel:
         classified_objects = MyModel.classify_objects(mock_yolo_model, cropped_images)
 
         # Assertions
-        assert classified_objects == [("Unknown", 0.0)]
\ No newline at end of file
+        assert classified_objects == [("Unknown", 0.0)]
+
+    def test_infer_images_splits_classifications_per_image(self, mocker):
+        # Mock a detection model that detects one object in the first image and two in the second
+        def detect(images, verbose=False):
+            results = []
+            for boxes in ([[10, 10, 50, 50]], [[0, 0, 20, 20], [30, 30, 60, 60]]):
+                result = mocker.Mock()
+                result.boxes.xyxy.cpu().numpy.return_value = np.array(boxes)
+                result.boxes.cls.cpu().numpy.return_value = np.zeros(len(boxes))
+                result.boxes.conf.cpu().numpy.return_value = np.ones(len(boxes)) * 0.9
+                results.append(result)
+            return results
+        detection_model = mocker.Mock(side_effect=detect)
+        detection_model.names = {0: 'Currency'}
+        classification_model = mocker.Mock()
+        classification_model.names = {0: '1 NIS', 1: '2 NIS', 2: '5 NIS'}
+        mocker.patch.object(MyModel, 'object_detection_model', detection_model)
+        mocker.patch.object(MyModel, 'classification_model', classification_model)
+        mock_classify = mocker.patch.object(MyModel, 'classify', return_value=(np.array([0, 1, 2]), np.array([0.9, 0.8, 0.7])))
+
+        images = [Image.new('RGB', (100, 100)), Image.new('RGB', (100, 100))]
+        inferred = MyModel.infer_images(images, [0.5, 0.5])
+
+        # Both images are detected in one call and all the crops are classified together
+        assert detection_model.call_count == 1
+        assert len(mock_classify.call_args[0][1]) == 3
+        assert inferred[0].boxes_and_classes() == [(10, 10, 50, 50, 'Currency', pytest.approx(0.9))]
+        assert [detections.cls_class_names.tolist() for detections in inferred] == [['1 NIS'], ['2 NIS', '5 NIS']]
+
+
+#----------------------------------------------------- load_models ------------------------------------------------------#
+
+
+class TestLoadModels:
+
+    # Test that the models are loaded once, on first use
+    def test_models_are_loaded_once(self, mocker):
+        mocker.patch.object(MyModel, 'object_detection_model', None)
+        mocker.patch.object(MyModel, 'classification_model', None)
+        mocker.patch.object(MyModel, 'startup_timings', {})
+        mock_yolo = mocker.Mock()
+        mocker.patch('app.ml.backends.import_yolo', return_value=mock_yolo)
+
+        MyModel.load_models()
+        MyModel.load_models()
+
+        assert mock_yolo.call_count == 2  # Detection and classification models
+        assert MyModel.object_detection_model is mock_yolo.return_value
+        assert "import_seconds" in MyModel.startup_timings
+        assert "weight_load_seconds" in MyModel.startup_timings
+
+    # Test that the warmup runs dummy inferences and records the first inference time
+    def test_warmup_records_first_inference(self, mocker):
+        mocker.patch.object(MyModel, 'object_detection_model', mocker.Mock())
+        mocker.patch.object(MyModel, 'classification_model', mocker.Mock())
+        mocker.patch.object(MyModel, 'startup_timings', {})
+        mocker.patch.object(settings, 'MODEL_WARMUP_RUNS', 2)
+        mock_detect = mocker.patch.object(MyModel, 'detect', return_value=Detections())
+        mock_classify = mocker.patch.object(MyModel, 'classify', return_value=(np.array([-1]), np.array([0.0])))
+
+        timings = MyModel.warmup()
+
+        assert mock_detect.call_count == 2
+        assert mock_classify.call_count == 2
+        assert "first_inference_seconds" in timings
+        assert "warmup_seconds" in timings
+
+        # A second warmup doesn't run the models again
+        MyModel.warmup()
+        assert mock_detect.call_count == 2
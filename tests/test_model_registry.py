@@ -0,0 +1,114 @@
+import pytest
+import asyncio
+import threading
+import numpy as np
+from sqlalchemy import create_engine, inspect, text
+from app.ml.model import MyModel
+from app.ml.detections import Detections
+from app.core.config import settings
+from app.db import db_models
+from app.db.database import add_missing_columns
+from app.ml.inference_executor import InferenceExecutor
+from app.services.prediction_cache import PredictionCache
+from app.services.model_registry import ModelRegistry
+
+
+@pytest.fixture
+def executor(mocker):
+    mocker.patch.object(settings, 'INFERENCE_WORKERS', 0)
+    mocker.patch.object(settings, 'MODEL_VERSION', 'v1')
+    mocker.patch.object(MyModel, 'object_detection_model', 'old detection model')
+    mocker.patch.object(MyModel, 'classification_model', 'old classification model')
+    mocker.patch.object(MyModel, 'model_version', 'v1')
+    mocker.patch('app.ml.model.log')
+    executor = InferenceExecutor()
+    mocker.patch('app.services.model_registry.inference_executor', executor)
+    return executor
+
+
+class TestModelRegistry:
+
+    # The new version is loaded next to the served one and both models switch together, the cached predictions are dropped
+    @pytest.mark.asyncio
+    async def test_swap_activates_the_new_version(self, executor, mocker):
+        mocker.patch.object(MyModel, 'load_version', return_value=('new detection model', 'new classification model'))
+        cache = PredictionCache()
+        cache.put('key', Detections())
+        mocker.patch('app.services.model_registry.prediction_cache', cache)
+        registry = ModelRegistry()
+
+        result = await registry.swap('models/new_detection.pt', 'models/new_classification.pt', 'v2')
+
+        assert result["swapped"] and result["previous_version"] == 'v1'
+        assert (MyModel.object_detection_model, MyModel.classification_model) == ('new detection model', 'new classification model')
+        assert registry.active_version == 'v2'
+        assert executor.model_paths == ('models/new_detection.pt', 'models/new_classification.pt')
+        assert registry.stats()["history"][0]["version"] == 'v2'
+
+        # Detections made by the previous version while the swap ran aren't cached
+        assert cache.stats()["entries"] == 0
+        cache.put('key', Detections(model_version='v1'))
+        assert cache.stats()["entries"] == 0
+
+        # Swapping to the served version does nothing
+        assert (await registry.swap(version='v2'))["swapped"] is False
+
+    # A model that can't be loaded leaves the served version in place
+    @pytest.mark.asyncio
+    async def test_failed_swap_keeps_the_served_version(self, executor, mocker):
+        mocker.patch.object(MyModel, 'load_version', side_effect=FileNotFoundError('models/missing.pt'))
+        mocker.patch('app.services.model_registry.log')
+        registry = ModelRegistry()
+
+        with pytest.raises(FileNotFoundError):
+            await registry.swap('models/missing.pt', version='v2')
+
+        assert registry.active_version == 'v1'
+        assert MyModel.object_detection_model == 'old detection model'
+
+    # The swap completes once the batches running on the previous version are done, new batches run on the new version
+    @pytest.mark.asyncio
+    async def test_swap_waits_for_running_batches(self, executor, mocker):
+        mocker.patch.object(MyModel, 'load_version', return_value=('new detection model', 'new classification model'))
+        release = threading.Event()
+        def infer_images(images, confidence_thresholds):
+            model_version = MyModel.model_version
+            release.wait(5)
+            return [Detections(model_version=model_version)]
+        mocker.patch.object(MyModel, 'infer_images', side_effect=infer_images)
+        mocker.patch.object(MyModel, 'load_models')
+        registry = ModelRegistry()
+
+        running_batch = asyncio.create_task(executor.infer_images(['image'], [0.5]))
+        await asyncio.sleep(0.05)
+        swap = asyncio.create_task(registry.swap(version='v2'))
+        await asyncio.sleep(0.05)
+
+        assert executor.model_version == 'v2'
+        assert not swap.done()
+        release.set()
+
+        assert (await running_batch)[0].model_version == 'v1'
+        assert (await swap)["drain_seconds"] > 0
+        assert executor.running_batches == {}
+
+    # The classified detections record the version of the models that made them
+    def test_infer_images_records_the_model_version(self, mocker):
+        mocker.patch.object(MyModel, 'load_models')
+        mocker.patch.object(MyModel, 'model_version', 'v3')
+        mocker.patch.object(MyModel, 'detect_batch', return_value=[Detections()])
+        mocker.patch.object(MyModel, 'classify', return_value=(np.array([], dtype=np.int32), np.array([])))
+        mocker.patch.object(MyModel, 'classification_model', mocker.Mock(names={}))
+
+        assert MyModel.infer_images([np.zeros((4, 4, 3), dtype=np.uint8)], [0.5])[0].model_version == 'v3'
+
+    # Tables created before a column was added get it on startup
+    def test_add_missing_columns(self, mocker):
+        mocker.patch('app.db.database.log')
+        engine = create_engine("sqlite://")
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE images (id VARCHAR PRIMARY KEY, base64_string VARCHAR)"))
+
+        add_missing_columns(engine, db_models.Base)
+
+        assert "model_version" in {column["name"] for column in inspect(engine).get_columns("images")}
@@ -157,3 +157,34 @@ class TestPredict:
             "ClassifiedObject": CurrencyInfo(quantity=1, return_currency_value=10.0)
         }
         assert isinstance(response.image, str)
+
+    # Test the detections response mode returns the detections instead of an annotated image
+    @pytest.mark.asyncio
+    async def test_detections_response_mode(self, mocker):
+        from app.api.endpoints.routes import predict
+        from app.schemas import PredictRequest
+        from app.services.currency_exchange import exchange_service
+        from app.services.prediction_cache import prediction_cache
+        from app.ml.detections import Detections
+        from app.ml.model import MyModel
+        from PIL import Image
+        import base64
+        import io
+
+        detections = Detections.from_tuples([(10, 20, 50, 60, 'Currency', 0.9)], [('5 NIS', 0.8)])
+        mocker.patch.object(exchange_service, 'CURRENCIES', ["EUR", "USD", "ILS"])
+        mocker.patch.object(prediction_cache, 'get_or_compute', mocker.AsyncMock(return_value=detections))
+        mocker.patch.object(MyModel, 'get_detected_counts', return_value={})
+        annotate = mocker.patch.object(MyModel, 'annotate_and_count')
+
+        buffered = io.BytesIO()
+        Image.new('RGB', (200, 100)).save(buffered, format="JPEG")
+        request = PredictRequest(image=base64.b64encode(buffered.getvalue()).decode(), return_currency="USD", response_mode="detections")
+
+        response = await predict(request, None, None)
+
+        annotate.assert_not_called()
+        assert response.image is None and response.overlay is None
+        assert len(response.detections) == 1
+        assert response.detections[0].box == [0.05, 0.2, 0.25, 0.6]
+        assert response.detections[0].currency == MyModel.currencies_dict['5 NIS']
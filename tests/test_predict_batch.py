@@ -0,0 +1,76 @@
+import base64
+import io
+import numpy as np
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import db_models
+from app.db.database import Base
+from app.ml.detections import Detections
+from app.schemas import BatchPredictRequest
+from tools.stub_models import layout_boxes, synthetic_image
+
+
+def encode(image):
+    buffered = io.BytesIO()
+    Image.fromarray(image).save(buffered, format="PNG")
+    return base64.b64encode(buffered.getvalue()).decode()
+
+def image_detections(image, confidence_threshold=0.5):
+    count = 2 if image.shape[1] == 320 else 3
+    xyxy = layout_boxes(image.shape[1], image.shape[0], count)
+    return Detections(xyxy, np.zeros(count), np.full(count, 0.9), np.zeros(count, dtype=int), np.full(count, 0.8),
+                      {0: "Currency"}, {0: "1 NIS"})
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+class TestPredictBatch:
+
+    # The images are inferred together, each gets its response, the total adds up the images and every image is saved in one commit
+    @pytest.mark.asyncio
+    async def test_batch_predict(self, mocker, db):
+        from app.api.endpoints.routes import predict_batch
+        from app.services.inference_scheduler import inference_scheduler
+        from app.core.config import settings
+        mocker.patch('app.ml.model.log')
+        mocker.patch('app.db.crud.log')
+        mocker.patch.object(settings, 'PREDICTION_CACHE_ENABLED', False)
+        predict = mocker.patch.object(inference_scheduler, 'predict', mocker.AsyncMock(side_effect=image_detections))
+        commit = mocker.spy(db, 'commit')
+        user = db_models.User(id="user-1", email="business@example.com", role="business")
+        images = [encode(synthetic_image(320, 240, 2, seed=1)), encode(synthetic_image(480, 360, 3, seed=2))]
+
+        response = await predict_batch(BatchPredictRequest(images=images, return_currency="NIS", response_mode="detections"), user, db)
+
+        assert predict.await_count == 2
+        assert [len(result.detections) for result in response.results] == [2, 3]
+        assert response.currencies["NIS_C_100"].quantity == 5 and response.total == 5.0
+        assert commit.call_count == 1
+        saved = {image.id: image for image in db.query(db_models.Image).all()}
+        assert [saved[result.image_id].currencies for result in response.results] == [{"NIS_C_100": 2}, {"NIS_C_100": 3}]
+
+    # A batch with an invalid image or too many images is rejected before any inference
+    @pytest.mark.asyncio
+    async def test_invalid_batch(self, mocker):
+        from app.api.endpoints.routes import predict_batch
+        from app.core.config import settings
+        mocker.patch('app.api.endpoints.routes.log')
+        mocker.patch.object(settings, 'PREDICT_BATCH_MAX_IMAGES', 2)
+        image = encode(synthetic_image(320, 240, 2))
+
+        with pytest.raises(HTTPException) as exc_info:
+            await predict_batch(BatchPredictRequest(images=[image, "invalid_base64"], return_currency="USD"), None, None)
+        assert exc_info.value.status_code == 400 and "Invalid image 1" in exc_info.value.detail
+
+        with pytest.raises(HTTPException) as exc_info:
+            await predict_batch(BatchPredictRequest(images=[image] * 3, return_currency="USD"), None, None)
+        assert exc_info.value.status_code == 400 and "Too many images" in exc_info.value.detail
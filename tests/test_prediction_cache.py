@@ -0,0 +1,93 @@
+import pytest
+import asyncio
+from PIL import Image
+from app.core.config import settings
+from app.services.prediction_cache import PredictionCache
+
+PREDICTION = ([(0, 0, 10, 10, "note", 0.9)], [("10 Euro", 0.8)])
+
+
+class TestPredictionCache:
+
+    # The same pixels and threshold are computed once, a different threshold is a different prediction
+    @pytest.mark.asyncio
+    async def test_identical_images_hit_the_cache(self, mocker):
+        mocker.patch.object(settings, 'PREDICTION_CACHE_ENABLED', True)
+        cache = PredictionCache()
+        calls = []
+        async def compute():
+            calls.append(1)
+            return PREDICTION
+
+        first = await cache.get_or_compute(Image.new("RGB", (20, 20), "white"), 0.5, compute)
+        second = await cache.get_or_compute(Image.new("RGB", (20, 20), "white"), 0.5, compute)
+        await cache.get_or_compute(Image.new("RGB", (20, 20), "white"), 0.6, compute)
+
+        assert first == second == PREDICTION
+        assert len(calls) == 2
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 2
+
+    # Concurrent identical requests share a single inference
+    @pytest.mark.asyncio
+    async def test_concurrent_identical_requests_are_coalesced(self, mocker):
+        mocker.patch.object(settings, 'PREDICTION_CACHE_ENABLED', True)
+        cache = PredictionCache()
+        calls = []
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return PREDICTION
+
+        results = await asyncio.gather(*[cache.get_or_compute(Image.new("RGB", (20, 20), "white"), 0.5, compute) for _ in range(5)])
+
+        assert results == [PREDICTION] * 5
+        assert len(calls) == 1
+        assert cache.stats()["coalesced"] == 4
+
+    # A failed inference isn't cached and is raised to every waiting request
+    @pytest.mark.asyncio
+    async def test_failed_inference_is_not_cached(self, mocker):
+        mocker.patch.object(settings, 'PREDICTION_CACHE_ENABLED', True)
+        cache = PredictionCache()
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("inference failed")
+
+        results = await asyncio.gather(*[cache.get_or_compute(Image.new("RGB", (20, 20)), 0.5, compute) for _ in range(2)], return_exceptions=True)
+
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert cache.stats()["entries"] == 0
+        assert cache.in_flight == {}
+
+    def test_least_recently_used_entry_is_evicted(self, mocker):
+        mocker.patch.object(settings, 'PREDICTION_CACHE_MAX_ENTRIES', 2)
+        cache = PredictionCache()
+
+        cache.put("a", PREDICTION)
+        cache.put("b", PREDICTION)
+        cache.get("a")
+        cache.put("c", PREDICTION)
+
+        assert list(cache.entries) == ["a", "c"]
+        assert cache.evictions == 1
+
+    # Entries are evicted when the cache holds more than PREDICTION_CACHE_MAX_MB
+    def test_memory_bound_eviction(self, mocker):
+        cache = PredictionCache()
+        cache.put("a", PREDICTION)
+        mocker.patch.object(settings, 'PREDICTION_CACHE_MAX_MB', cache.current_bytes * 1.5 / 2 ** 20)
+
+        cache.put("b", PREDICTION)
+
+        assert list(cache.entries) == ["b"]
+        assert cache.current_bytes == cache.entries["b"][1]
+
+    def test_expired_entry_is_a_miss(self, mocker):
+        mocker.patch.object(settings, 'PREDICTION_CACHE_TTL_SECONDS', 0)
+        cache = PredictionCache()
+
+        cache.put("a", PREDICTION)
+
+        assert cache.get("a") is None
+        assert cache.expirations == 1
@@ -0,0 +1,78 @@
+import asyncio
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from app.core.config import settings
+from app.services.prediction_jobs import PredictionJobs, JobQueueFull, report_stage
+
+
+class TestPredictionJobs:
+
+    # A job reports its stages as it runs, its result is kept until the TTL expires
+    @pytest.mark.asyncio
+    async def test_job_stages_and_expiry(self, mocker):
+        jobs = PredictionJobs()
+        async def run(job):
+            report_stage("detected", objects=2)
+            await asyncio.sleep(0.01)
+            report_stage("classified", currencies={"USD_B_1": 2})
+            return "result"
+
+        job = jobs.submit(run, user_id="user-1")
+        assert job.status == "queued"
+        while not job.finished:
+            await job.wait_for_events(len(job.events), timeout=1)
+
+        assert job.result == "result"
+        assert [event["stage"] for event in job.events] == ["queued", "running", "detected", "classified", "done"]
+        assert jobs.get(job.id, "user-2") is None and jobs.get(job.id, "user-1") is job
+        mocker.patch.object(settings, 'PREDICTION_JOB_TTL_SECONDS', -1)
+        assert jobs.get(job.id, "user-1") is None and jobs.stats()["expired"] == 1
+        jobs.pool_task.cancel()
+
+    # Failed jobs keep their error, submissions past PREDICTION_JOB_MAX_QUEUED are rejected
+    @pytest.mark.asyncio
+    async def test_failed_job_and_full_queue(self, mocker):
+        mocker.patch('app.services.prediction_jobs.log')
+        mocker.patch.object(settings, 'PREDICTION_JOB_WORKERS', 1)
+        mocker.patch.object(settings, 'PREDICTION_JOB_MAX_QUEUED', 1)
+        jobs = PredictionJobs()
+        release = asyncio.Event()
+        async def fail(job):
+            await release.wait()
+            raise HTTPException(status_code=400, detail="Invalid image")
+
+        failed = jobs.submit(fail)
+        while failed.status == "queued": # Until the worker takes it
+            await asyncio.sleep(0)
+        jobs.submit(fail)
+        with pytest.raises(JobQueueFull):
+            jobs.submit(fail)
+        release.set()
+        while not failed.finished:
+            await failed.wait_for_events(len(failed.events), timeout=1)
+
+        assert failed.status == "failed" and failed.error == {"status_code": 400, "detail": "Invalid image"}
+        assert jobs.stats()["rejected"] == 1
+        jobs.pool_task.cancel()
+
+    # The job routes: submit, stream the stages as Server-Sent Events and fetch the PredictResponse
+    def test_job_routes(self, mocker):
+        from app.api.endpoints import routes
+        from app.schemas import PredictResponse
+        async def predict(request, user, db):
+            report_stage("detected", objects=0)
+            return PredictResponse(currencies={}, image=None, image_id=None)
+        mocker.patch.object(routes, 'predict', predict)
+        mocker.patch.object(routes, 'prediction_jobs', PredictionJobs())
+        app = FastAPI()
+        app.include_router(routes.router, prefix="/api")
+
+        with TestClient(app) as client:
+            job_id = client.post("/api/jobs", json={"image": "", "return_currency": "USD"}).json()["job_id"]
+            events = client.get(f"/api/jobs/{job_id}/events").text
+            result = client.get(f"/api/jobs/{job_id}/result")
+
+        assert "event: detected" in events and events.rstrip().split("\n\n")[-1].startswith("event: done")
+        assert result.status_code == 200 and result.json()["currencies"] == {}
+        assert client.get("/api/jobs/unknown").status_code == 404
@@ -0,0 +1,76 @@
+import json
+import threading
+import time
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.core import profiling
+from app.core.config import settings
+from app.core.profiling import SamplingProfiler, ProfilingMiddleware, should_profile, write_profile, list_profiles, profile_path
+
+
+def busy_stage(seconds):
+    end_time = time.perf_counter() + seconds
+    while time.perf_counter() < end_time:
+        pass
+
+
+class TestProfiling:
+
+    # The stacks of the other threads are sampled, root first, into a speedscope profile per thread
+    def test_sampling_profiler(self):
+        profiler = SamplingProfiler(0.001).start()
+        worker = threading.Thread(target=busy_stage, args=(0.2,), name="inference")
+        worker.start()
+        worker.join()
+        profile = profiler.stop().to_speedscope("POST /api/predict")
+
+        frames = profile["shared"]["frames"]
+        inference_profile = next(p for p in profile["profiles"] if p["name"].startswith("inference"))
+        assert inference_profile["type"] == "sampled" and len(inference_profile["samples"]) == len(inference_profile["weights"]) > 10
+        assert any(frames[stack[-1]]["name"] == "busy_stage" for stack in inference_profile["samples"])
+        assert all(frames[stack[0]]["name"] != "busy_stage" for stack in inference_profile["samples"])
+
+    # Requests are profiled with the secret header, or sampled among the /predict requests
+    def test_should_profile(self, mocker):
+        mocker.patch.object(settings, "PROFILING_SECRET", "s3cret")
+        mocker.patch.object(settings, "PROFILING_SAMPLE_RATE", 0)
+        assert should_profile("/api/get_images", {"x-profile": "s3cret"})
+        assert not should_profile("/api/predict", {"x-profile": "wrong"})
+
+        mocker.patch.object(settings, "PROFILING_SAMPLE_RATE", 1)
+        assert should_profile("/api/predict", {})
+        assert not should_profile("/api/get_images", {})
+
+    # Only the most recent profiles are kept, and only listed profiles can be read
+    def test_profiles_files(self, tmp_path, mocker):
+        mocker.patch.object(settings, "PROFILING_MAX_FILES", 2)
+        for i in range(3):
+            write_profile({"profiles": []}, f"profile{i}", str(tmp_path))
+            time.sleep(0.01)
+
+        assert [profile["name"] for profile in list_profiles(str(tmp_path))] == ["profile2.speedscope.json", "profile1.speedscope.json"]
+        assert profile_path("profile2.speedscope.json", str(tmp_path)) == str(tmp_path / "profile2.speedscope.json")
+        assert profile_path("../profile2.speedscope.json", str(tmp_path)) is None
+
+    # A profiled request gets an x-profile-id header naming its profile file
+    def test_middleware(self, tmp_path, mocker):
+        mocker.patch.object(settings, "PROFILING_SECRET", "s3cret")
+        mocker.patch.object(settings, "PROFILING_SAMPLE_RATE", 0)
+        mocker.patch.object(profiling, "PROFILES_DIR", str(tmp_path))
+        mocker.patch.object(profiling, "log")
+        app = FastAPI()
+        app.add_middleware(ProfilingMiddleware)
+
+        @app.get("/api/slow")
+        def slow():
+            busy_stage(0.05)
+            return {}
+
+        client = TestClient(app)
+        assert "x-profile-id" not in client.get("/api/slow").headers
+        profile_id = client.get("/api/slow", headers={"X-Profile": "s3cret"}).headers["x-profile-id"]
+
+        with open(tmp_path / profile_id) as f:
+            profile = json.load(f)
+        assert profile["name"] == "GET /api/slow"
+        assert any(frame["name"] == "busy_stage" for frame in profile["shared"]["frames"])
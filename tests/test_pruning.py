@@ -0,0 +1,62 @@
+import pytest
+import numpy as np
+from app.ml.model import MyModel
+from app.core.config import settings
+from app.ml.detections import Detections
+from app.ml.pruning import prune_boxes
+from app.ml.inference_executor import InferenceExecutor
+
+CLASSIFICATION_NAMES = {0: '1 NIS', 1: '5 NIS', 2: 'object'}
+
+
+class TestPruning:
+
+    # Boxes with no area or a side under min_side are dropped, the less confident of two overlapping boxes is a duplicate
+    def test_prune_boxes(self):
+        xyxy = np.array([[10, 10, 50, 50],    # Kept
+                         [11, 11, 50, 51],    # Duplicate of the first box
+                         [60, 60, 60, 90],    # No width
+                         [100, 100, 104, 140],# Undersized
+                         [200, 200, 240, 240]])
+        confidences = np.array([0.9, 0.8, 0.9, 0.9, 0.6])
+
+        keep, undersized, duplicates = prune_boxes(xyxy, confidences, min_side=8, duplicate_iou=0.85)
+
+        assert keep.tolist() == [0, 4]
+        assert (undersized, duplicates) == (2, 1)
+        assert prune_boxes(xyxy, confidences, min_side=0, duplicate_iou=1)[0].tolist() == [0, 1, 3, 4]
+
+    # Confident known denominations keep the detector's class and aren't classified, the others still are
+    def test_early_exit(self, mocker):
+        mocker.patch.object(settings, 'CLASSIFICATION_EARLY_EXIT_CONFIDENCE', 0.8)
+        detections = Detections.from_tuples([(0, 0, 40, 40, '5 NIS', 0.9), (50, 0, 90, 40, '1 NIS', 0.5), (100, 0, 140, 40, 'object', 0.95)])
+
+        pruned, to_classify = MyModel.prune_detections(detections, CLASSIFICATION_NAMES)
+
+        assert to_classify.tolist() == [False, True, True]
+        assert pruned.pruned == {"undersized": 0, "duplicates": 0, "early_exits": 1}
+        MyModel.set_pruned_classifications(pruned, to_classify, np.array([0, -1]), np.array([0.7, 0.0]), CLASSIFICATION_NAMES)
+        assert pruned.classified_objects() == [('5 NIS', pytest.approx(0.9)), ('1 NIS', pytest.approx(0.7)), ('Unknown', 0.0)]
+
+    # Only the crops left after pruning are classified
+    def test_classify_detections_skips_pruned_objects(self, mocker):
+        mocker.patch.object(settings, 'CLASSIFICATION_EARLY_EXIT_CONFIDENCE', 0)
+        mock_classify = mocker.patch.object(MyModel, 'classify', return_value=(np.array([1]), np.array([0.9])))
+        YOLO_model = mocker.Mock(names=CLASSIFICATION_NAMES)
+        detections = Detections.from_tuples([(0, 0, 40, 40, 'object', 0.9), (1, 1, 40, 40, 'object', 0.8), (50, 50, 52, 90, 'object', 0.9)])
+
+        classified = MyModel.classify_detections(YOLO_model, np.zeros((100, 100, 3), dtype=np.uint8), detections)
+
+        assert len(mock_classify.call_args[0][1]) == 1
+        assert classified.classified_objects() == [('5 NIS', pytest.approx(0.9))]
+
+    # The executor reports the classifier calls the pruning saved
+    def test_pruning_stats(self):
+        executor = InferenceExecutor()
+        detections = Detections.from_tuples([(0, 0, 40, 40, 'object', 0.9)] * 3)
+        detections.pruned = {"undersized": 1, "duplicates": 0, "early_exits": 2}
+
+        executor.record_pruning([detections])
+
+        assert executor.pruning_stats()["classifier_calls_saved"] == 3
+        assert executor.pruning_stats()["saved_fraction"] == 0.75
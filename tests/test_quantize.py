@@ -0,0 +1,26 @@
+import numpy as np
+from PIL import Image
+from tools.quantize import letterbox, counts_agreement
+
+
+class TestQuantize:
+
+    # Calibration images are fed to the model the way ultralytics feeds it: padded to a square, RGB, NCHW in [0, 1]
+    def test_letterbox(self):
+        tensor = letterbox(Image.new("RGB", (200, 100), color="white"), 64)
+
+        assert tensor.shape == (1, 3, 64, 64)
+        assert tensor.dtype == np.float32
+        assert tensor[0, :, 32, 32].tolist() == [1.0, 1.0, 1.0]
+        assert np.allclose(tensor[0, :, 0, 32], 114 / 255)
+
+    def test_counts_agreement(self):
+        fp32_counts = {"a.jpg": {"USD_B_1": 2}, "b.jpg": {"EUR_C_100": 1}}
+        int8_counts = {"a.jpg": {"USD_B_1": 2}, "b.jpg": {"EUR_C_200": 1}}
+
+        result = counts_agreement(fp32_counts, int8_counts)
+
+        assert result["exact_count_images"] == 1
+        assert result["fp32_objects"] == 3
+        assert result["count_errors"] == 2
+        assert list(result["mismatches"]) == ["b.jpg"]
@@ -0,0 +1,101 @@
+import io
+import numpy as np
+from PIL import Image
+from app.core.config import settings
+from app.ml.image_decode import decode_image, decoded_pixels
+from app.ml.model import MyModel
+from app.ml.tiling import should_tile, tile_grid, merge_tile_boxes, cut_by_tile_edge
+
+
+def empty_result(mocker):
+    result = mocker.Mock()
+    result.boxes.xyxy.cpu().numpy.return_value = np.zeros((0, 4))
+    result.boxes.cls.cpu().numpy.return_value = np.zeros(0)
+    result.boxes.conf.cpu().numpy.return_value = np.zeros(0)
+    return result
+
+
+class TestTiling:
+
+    def test_should_tile(self):
+        assert should_tile((6000, 8000, 3), min_pixels=20_000_000)
+        assert not should_tile((3024, 4032, 3), min_pixels=20_000_000)
+        assert not should_tile((6000, 8000, 3), min_pixels=0)
+
+    # The tiles cover the image, overlap their neighbours and don't go past its edges
+    def test_tile_grid_covers_the_image(self):
+        tiles = tile_grid((1000, 1500, 3), tile_size=640, overlap=0.2)
+
+        assert len(tiles) == 3 * 2
+        assert tiles[:, 0].min() == 0 and tiles[:, 1].min() == 0
+        assert tiles[:, 2].max() == 1500 and tiles[:, 3].max() == 1000
+        assert np.all(tiles[:, 2] - tiles[:, 0] == 640)
+        assert tiles[1, 0] < tiles[0, 2] - 128
+
+    # A box cut by a tile's edge is merged into its whole view, separate objects are kept
+    def test_merge_tile_boxes(self):
+        xyxy = np.array([[600, 100, 640, 160],   # Cut by the first tile's edge
+                         [600, 100, 680, 160],   # Whole in the next tile
+                         [800, 100, 880, 160]])  # Another object
+        cut = np.concatenate([cut_by_tile_edge(xyxy[:1], (0, 0, 640, 640), (1000, 1500, 3)),
+                              cut_by_tile_edge(xyxy[1:], (512, 0, 1152, 640), (1000, 1500, 3))])
+
+        assert cut.tolist() == [True, False, False]
+        assert merge_tile_boxes(xyxy, sources=[1, 2, 2], cut=cut, threshold=0.6).tolist() == [1, 2]
+
+    # A coin lying on a banknote is inside the banknote's box but isn't a duplicate of it, whichever pass or tile saw them
+    def test_merge_tile_boxes_keeps_objects_on_larger_objects(self):
+        xyxy = np.array([[0, 0, 1000, 500], [100, 100, 150, 150]])
+
+        assert merge_tile_boxes(xyxy).tolist() == [0, 1]
+        assert merge_tile_boxes(xyxy, sources=[0, 1], cut=[False, False]).tolist() == [0, 1]
+        assert merge_tile_boxes(xyxy, sources=[0, 0], cut=[False, True]).tolist() == [0, 1] # Same pass, never duplicates
+        assert merge_tile_boxes(np.array([[0, 0, 100, 100], [2, 0, 100, 98]]), sources=[0, 1]).tolist() == [0] # The same object seen twice
+
+    # Large images are detected in tiles batched with the full image pass, the boxes are mapped to the image
+    def test_detect_batch_tiles_large_images(self, mocker):
+        mocker.patch('app.ml.model.settings.TILED_INFERENCE_MIN_PIXELS', 500_000)
+        mocker.patch('app.ml.model.log')
+
+        def predict(inputs, verbose=False):
+            results = []
+            for model_input in inputs:
+                result = mocker.Mock()
+                # Each tile sees an object at its top left corner, the full image pass sees nothing
+                boxes = np.array([[10, 10, 50, 50]]) if model_input.shape[:2] == (640, 640) else np.zeros((0, 4))
+                result.boxes.xyxy.cpu().numpy.return_value = boxes
+                result.boxes.cls.cpu().numpy.return_value = np.zeros(len(boxes))
+                result.boxes.conf.cpu().numpy.return_value = np.full(len(boxes), 0.9)
+                results.append(result)
+            return results
+        YOLO_model = mocker.Mock(side_effect=predict)
+        YOLO_model.names = {0: 'Currency'}
+
+        detections = MyModel.detect(YOLO_model, np.zeros((1000, 1500, 3), dtype=np.uint8))
+
+        assert len(YOLO_model.call_args[0][0]) == 1 + 6
+        assert len(detections) == 6
+        assert [10, 10, 50, 50] in detections.xyxy.tolist()
+        assert [1500 - 630, 1000 - 630, 1500 - 590, 1000 - 590] in detections.xyxy.tolist()
+
+    # An upload over TILED_INFERENCE_MIN_PIXELS is decoded at full resolution and tiled, a phone photo under it is decoded downscaled
+    # and detected in a single pass
+    def test_only_uploads_over_the_min_pixels_are_tiled(self, mocker):
+        mocker.patch('app.ml.model.log')
+        mocker.patch.object(settings, 'TILED_INFERENCE_MIN_PIXELS', 8_000_000)
+        YOLO_model = mocker.Mock(side_effect=lambda inputs, verbose=False: [empty_result(mocker) for _ in (inputs if isinstance(inputs, list) else [inputs])])
+        YOLO_model.names = {0: 'Currency'}
+
+        passes = {}
+        for width, height in [(4032, 3024), (3000, 2000)]:
+            buffered = io.BytesIO()
+            Image.new('RGB', (width, height), (120, 90, 60)).save(buffered, format="JPEG")
+            image = decode_image(buffered.getvalue(), target_side=1600)
+            assert decoded_pixels(buffered.getvalue(), target_side=1600) == image.shape[0] * image.shape[1]
+            YOLO_model.reset_mock()
+            MyModel.detect_batch(YOLO_model, [image], [0.5])
+            inputs = [call[0][0] for call in YOLO_model.call_args_list]
+            passes[(width, height)] = (image.shape[:2], sum(len(batch) if isinstance(batch, list) else 1 for batch in inputs))
+
+        assert passes[(4032, 3024)] == ((3024, 4032), 1 + len(tile_grid((3024, 4032))))
+        assert passes[(3000, 2000)] == ((2000, 3000), 1)
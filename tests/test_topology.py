@@ -0,0 +1,81 @@
+import json
+import queue
+import pytest
+import torch
+from app.core.config import Settings, settings
+from app.ml import topology
+from tools.autotune import candidate_configs, select_best, topology_settings, collect_results, ConfigFailed
+
+
+class TestTopology:
+
+    # The cores are split between the inference processes unless the threads are set
+    def test_inference_threads(self, mocker):
+        mocker.patch('app.ml.topology.available_cores', return_value=8)
+        mocker.patch.object(settings, 'SERVER_WORKERS', 2)
+        mocker.patch.object(settings, 'INFERENCE_WORKERS', 2)
+        mocker.patch.object(settings, 'INFERENCE_THREADS', 0)
+        assert topology.inference_threads() == 2
+
+        mocker.patch.object(settings, 'INFERENCE_WORKERS', 0) # Inference in a thread of each server process
+        assert topology.inference_threads() == 4
+
+        mocker.patch.object(settings, 'INFERENCE_THREADS', 3)
+        assert topology.inference_threads() == 3
+
+    # The threads are applied to torch, an oversubscribing topology is logged
+    def test_apply_topology(self, mocker):
+        threads = torch.get_num_threads()
+        mocker.patch('app.ml.topology.available_cores', return_value=2)
+        mocker.patch('app.ml.topology.applied_threads', None)
+        mocker.patch.dict('os.environ', {})
+        mocker.patch.object(settings, 'INFERENCE_WORKERS', 2)
+        mocker.patch.object(settings, 'INFERENCE_THREADS', 3)
+        mock_log = mocker.patch('app.ml.topology.log')
+        try:
+            assert topology.apply_topology() == 3
+            assert torch.get_num_threads() == 3
+            assert "oversubscribes" in mock_log.call_args_list[0][0][0]
+        finally:
+            torch.set_num_threads(threads)
+
+    # Settings load the topology file written by the autotuner, the environment still overrides it
+    def test_settings_load_the_topology_file(self, tmp_path, mocker):
+        topology_file = tmp_path / "inference_topology.json"
+        topology_file.write_text(json.dumps(topology_settings({"processes": 2, "threads": 4, "batch_size": 8})))
+        mocker.patch.dict(Settings.model_config, {"json_file": str(topology_file)})
+        mocker.patch.dict('os.environ', {"INFERENCE_MAX_BATCH_SIZE": "2"})
+
+        loaded = Settings()
+
+        assert (loaded.INFERENCE_WORKERS, loaded.INFERENCE_THREADS, loaded.INFERENCE_MAX_BATCH_SIZE) == (2, 4, 2)
+
+    def test_candidate_configs_dont_oversubscribe(self):
+        configs = candidate_configs([1, 2, 4], None, [1, 8], cores=4)
+
+        assert {"processes": 4, "threads": 1, "batch_size": 8} in configs
+        assert all(config["processes"] * config["threads"] <= 4 for config in configs)
+
+    # The best configuration is the fastest one meeting the latency bound
+    def test_select_best(self):
+        results = [{"images_per_second": 10, "p95_ms": 400}, {"images_per_second": 14, "p95_ms": 900}]
+
+        assert select_best(results)["images_per_second"] == 14
+        assert select_best(results, max_p95_ms=500)["images_per_second"] == 10
+        assert select_best(results, max_p95_ms=100)["p95_ms"] == 400
+
+    # A benchmark process that crashes or reports an error fails its configuration instead of hanging the autotuner
+    def test_collect_results_fails_on_dead_processes(self, mocker):
+        results_queue = queue.Queue()
+        results_queue.put((10, 1.0, [0.1]))
+        crashed = [mocker.Mock(exitcode=0), mocker.Mock(exitcode=-9)]
+
+        with pytest.raises(ConfigFailed, match="exited with code -9"):
+            collect_results(crashed, results_queue, timeout=60)
+
+        results_queue.put("RuntimeError: model load failed")
+        with pytest.raises(ConfigFailed, match="model load failed"):
+            collect_results([mocker.Mock(exitcode=None)], results_queue, timeout=60)
+
+        with pytest.raises(ConfigFailed, match="no results"):
+            collect_results([mocker.Mock(exitcode=None)], results_queue, timeout=0)
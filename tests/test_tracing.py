@@ -0,0 +1,86 @@
+import json
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.core.config import settings
+from app.core.tracing import Trace, TracingMiddleware, current_trace, span
+from app.ml.detections import Detections
+from app.services.inference_scheduler import InferenceScheduler
+
+
+class TestTracing:
+
+    # Without a trace, spans record nothing
+    def test_span_without_trace(self):
+        with span("detect") as detect_span:
+            pass
+        assert detect_span.trace is None
+
+    # Spans opened inside a span are its children, a stage run twice is summed in the Server-Timing header
+    def test_nested_spans_and_server_timing(self):
+        trace = Trace("POST /api/predict")
+        token = current_trace.set(trace)
+        try:
+            with span("count"):
+                with span("exchange_rates"):
+                    pass
+            with span("count"):
+                pass
+        finally:
+            current_trace.reset(token)
+        trace.finish()
+
+        (rates_id, rates_parent, *_), (count_id, count_parent, *_), _ = trace.spans
+        assert rates_parent == count_id and count_parent == trace.span_id
+        header = trace.server_timing()
+        assert header.count("count;dur=") == 1
+        assert "exchange_rates;dur=" in header
+        assert "total;dur=" in header
+
+    # The middleware returns the Server-Timing header and exports the request's spans as OTLP JSON
+    def test_middleware(self, tmp_path, mocker):
+        export_file = tmp_path / "traces.jsonl"
+        mocker.patch.object(settings, 'TRACING_ENABLED', True)
+        mocker.patch.object(settings, 'TRACING_EXPORT_FILE', str(export_file))
+        app = FastAPI()
+        app.add_middleware(TracingMiddleware)
+
+        @app.get("/traced")
+        async def traced():
+            with span("image_decode", pixels=12):
+                pass
+            return {}
+
+        response = TestClient(app).get("/traced")
+
+        assert "image_decode;dur=" in response.headers["server-timing"]
+        spans = json.loads(export_file.read_text().splitlines()[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        assert [s["name"] for s in spans] == ["GET /traced", "image_decode"]
+        assert spans[1]["parentSpanId"] == spans[0]["spanId"]
+        assert spans[1]["attributes"] == [{"key": "pixels", "value": {"intValue": "12"}}]
+
+        # Tracing off: no header
+        mocker.patch.object(settings, 'TRACING_ENABLED', False)
+        assert "server-timing" not in TestClient(app).get("/traced").headers
+
+    # The scheduler traces the stages of the batch a request ran in, the rest of its wait is the queue
+    @pytest.mark.asyncio
+    async def test_scheduler_records_batch_stages(self, mocker):
+        detections = Detections()
+        detections.timings = {"detect": 0.02, "classify": 0.01, "batch_size": 3}
+        mocker.patch('app.services.inference_scheduler.inference_executor.infer_images', mocker.AsyncMock(return_value=[detections]))
+        mocker.patch('app.services.inference_scheduler.log')
+        scheduler = InferenceScheduler()
+        trace = Trace("POST /api/predict")
+        token = current_trace.set(trace)
+        try:
+            await scheduler.predict("image")
+        finally:
+            current_trace.reset(token)
+            scheduler.worker_task.cancel()
+
+        spans = {name: (start_ns, end_ns, attributes) for _, _, name, start_ns, end_ns, attributes in trace.spans}
+        assert set(spans) == {"queue", "detect", "classify"}
+        assert spans["detect"][1] - spans["detect"][0] == pytest.approx(0.02e9, abs=1)
+        assert spans["detect"][1] == spans["classify"][0]
+        assert spans["classify"][2] == {"batch_size": 3}
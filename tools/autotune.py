@@ -0,0 +1,183 @@
+# Autotune the inference topology: run MyModel.predict_image on synthetic images with every candidate
+# (processes x intra-op threads x batch size) and write the best configuration to the topology file Settings loads
+# Batch sizes above 1 run the batched path of the inference scheduler (MyModel.infer_images, then annotate_and_count per image)
+#
+# Usage: python -m tools.autotune [--processes 1 2 4] [--threads 2 4] [--batch-sizes 1 4 8] [--seconds 10] [--max-p95-ms 500] [--output inference_topology.json]
+import argparse
+import json
+import multiprocessing
+import queue
+import sys
+import time
+import numpy as np
+from app.core.config import settings, INFERENCE_TOPOLOGY_FILE
+from app.ml.model import MyModel
+from app.ml.topology import apply_topology, available_cores
+
+STARTUP_TIMEOUT_SECONDS = 600 # Max time the processes of a configuration take to load and warm up the models
+RESULTS_MARGIN_SECONDS = 60 # Extra time given to the processes to report after the measured time
+
+# A configuration that couldn't be benchmarked: one of its processes failed, crashed or didn't report in time
+class ConfigFailed(Exception):
+    pass
+
+# Synthetic photos: noise with bright discs the size of coins, so the detector has something to propose
+def synthetic_images(count, width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        yy, xx = np.ogrid[:height, :width]
+        for x, y, radius in zip(rng.integers(0, width, 10), rng.integers(0, height, 10), rng.integers(height // 30, height // 10, 10)):
+            image[(xx - x) ** 2 + (yy - y) ** 2 <= radius ** 2] = rng.integers(150, 256, 3, dtype=np.uint8)
+        images.append(image)
+    return images
+
+# The candidate configurations: every process count with the cores split between the processes (and half of that),
+# unless threads are given, and every batch size. Configurations using more threads than cores are skipped
+def candidate_configs(process_counts, thread_counts, batch_sizes, cores):
+    configs = []
+    for processes in process_counts:
+        threads_options = thread_counts or sorted({max(1, cores // processes), max(1, cores // processes // 2)})
+        for threads in threads_options:
+            if processes * threads > cores and not thread_counts:
+                continue
+            configs.extend({"processes": processes, "threads": threads, "batch_size": batch_size} for batch_size in batch_sizes)
+    return configs
+
+# Runs in every process of a configuration: load and warm up the models, then predict batches until the time is up
+# A failing process reports its error instead of results and breaks the start barrier, so its peers don't wait for it
+def benchmark_process(threads, batch_size, images, seconds, return_currency, start_barrier, results_queue):
+    try:
+        settings.INFERENCE_THREADS = threads
+        apply_topology()
+        MyModel.load_models()
+        MyModel.run_warmup(MyModel.object_detection_model, MyModel.classification_model)
+        start_barrier.wait(STARTUP_TIMEOUT_SECONDS)
+
+        latencies = []
+        processed = 0
+        start_time = time.perf_counter()
+        while time.perf_counter() - start_time < seconds:
+            batch = [images[(processed + i) % len(images)] for i in range(batch_size)]
+            batch_start_time = time.perf_counter()
+            if batch_size == 1:
+                MyModel.predict_image(batch[0], return_currency)
+            else:
+                for image, detections in zip(batch, MyModel.infer_images(batch, [0.5] * batch_size)):
+                    MyModel.annotate_and_count(image, detections, return_currency)
+            latencies.append(time.perf_counter() - batch_start_time)
+            processed += batch_size
+        results_queue.put((processed, time.perf_counter() - start_time, latencies))
+    except Exception as e:
+        start_barrier.abort()
+        results_queue.put(f"{type(e).__name__}: {e}")
+
+# Wait for the results of a configuration's processes, raises ConfigFailed when one reports an error, exits without reporting
+# (a crash, an OOM kill) or the results don't come in time
+def collect_results(processes, results_queue, timeout):
+    deadline = time.monotonic() + timeout
+    results = []
+    while len(results) < len(processes):
+        try:
+            result = results_queue.get(timeout=1)
+        except queue.Empty:
+            exit_codes = [process.exitcode for process in processes if process.exitcode not in (None, 0)]
+            if exit_codes:
+                raise ConfigFailed(f"a benchmark process exited with code {exit_codes[0]}")
+            if time.monotonic() > deadline:
+                raise ConfigFailed(f"no results after {timeout:.0f}s")
+            continue
+        if isinstance(result, str):
+            raise ConfigFailed(result)
+        results.append(result)
+    return results
+
+# Run a configuration's processes at the same time, returns its throughput and latencies (a request waits for its whole batch)
+def run_config(config, images, seconds, return_currency="USD"):
+    mp_context = multiprocessing.get_context("spawn")
+    start_barrier = mp_context.Barrier(config["processes"])
+    results_queue = mp_context.Queue()
+    processes = [mp_context.Process(target=benchmark_process, args=(config["threads"], config["batch_size"], images, seconds, return_currency, start_barrier, results_queue))
+                 for _ in range(config["processes"])]
+    for process in processes:
+        process.start()
+    try:
+        results = collect_results(processes, results_queue, STARTUP_TIMEOUT_SECONDS + seconds + RESULTS_MARGIN_SECONDS)
+    except ConfigFailed:
+        start_barrier.abort()
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+
+    latencies = np.array([latency for _, _, process_latencies in results for latency in process_latencies])
+    return {
+        **config,
+        "images_per_second": round(sum(processed / elapsed for processed, elapsed, _ in results), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2),
+    }
+
+# The configuration with the highest throughput among those meeting the p95 latency bound (the lowest p95 when none does)
+def select_best(results, max_p95_ms=0):
+    if not results:
+        raise ValueError("No configuration was benchmarked")
+    eligible = [result for result in results if not max_p95_ms or result["p95_ms"] <= max_p95_ms]
+    if not eligible:
+        return min(results, key=lambda result: result["p95_ms"])
+    return max(eligible, key=lambda result: (result["images_per_second"], -result["p95_ms"]))
+
+# The settings a configuration maps to, a single process runs inference in a thread of the server process
+def topology_settings(config):
+    return {
+        "INFERENCE_WORKERS": config["processes"] if config["processes"] > 1 else 0,
+        "INFERENCE_THREADS": config["threads"],
+        "INFERENCE_MAX_BATCH_SIZE": config["batch_size"],
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the fastest inference topology and write it to the topology file Settings loads")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4], help="Numbers of inference processes (capped to the cores)")
+    parser.add_argument("--threads", type=int, nargs="+", help="Intra-op threads per process (default: the cores split between the processes, and half of that)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--seconds", type=float, default=10, help="Measured time per configuration, after the warmup")
+    parser.add_argument("--images", type=int, default=8, help="Number of synthetic images")
+    parser.add_argument("--width", type=int, default=2016)
+    parser.add_argument("--height", type=int, default=1512)
+    parser.add_argument("--max-p95-ms", type=float, default=0, help="Only pick configurations with a p95 latency under this (0 = no bound)")
+    parser.add_argument("--output", default=INFERENCE_TOPOLOGY_FILE, help="Topology file to write the best configuration to")
+    parser.add_argument("--report", help="Path of a JSON report of every configuration")
+    args = parser.parse_args(argv)
+
+    cores = available_cores()
+    configs = candidate_configs([p for p in args.processes if p <= cores] or [1], args.threads, args.batch_sizes, cores)
+    images = synthetic_images(args.images, args.width, args.height)
+
+    results, failures = [], []
+    print(f"{'processes':>9} {'threads':>7} {'batch':>5} {'images/s':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for config in configs:
+        try:
+            result = run_config(config, images, args.seconds)
+        except ConfigFailed as e:
+            failures.append({**config, "error": str(e)})
+            print(f"{config['processes']:>9} {config['threads']:>7} {config['batch_size']:>5} failed - {e}")
+            continue
+        results.append(result)
+        print(f"{result['processes']:>9} {result['threads']:>7} {result['batch_size']:>5} {result['images_per_second']:>9} {result['p50_ms']:>8} {result['p95_ms']:>8}")
+
+    best = select_best(results, args.max_p95_ms)
+    with open(args.output, "w") as f:
+        json.dump(topology_settings(best), f, indent=2)
+    print(f"Best configuration: {best} - written to {args.output}")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"cores": cores, "results": results, "failures": failures, "best": best}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
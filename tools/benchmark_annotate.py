@@ -0,0 +1,103 @@
+# Microbenchmark of MyModel.annotate_image: the per-box cost of the sprite renderer against the previous renderer
+# (textbbox + text per label, a print per box and an Image.fromarray(np.array(image)) round trip) on images with many objects
+#
+# Usage: python -m tools.benchmark_annotate [--objects 50 100 200] [--width 2016 --height 1512] [--runs 20]
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+import numpy as np
+from PIL import Image, ImageDraw
+from app.ml.detections import Detections
+from app.ml.model import MyModel
+
+DENOMINATIONS = ["0.1 NIS", "5 NIS", "100 NIS", "0.5 Euro", "2 Euro", "50 Euro", "0.25 USD", "1 USD BILL", "20 USD", "Unknown"]
+
+# The renderer annotate_image used before the sprite renderer, kept here as the benchmark's reference
+def previous_annotate_image(image, boxes_and_classes, classified_objects):
+    draw = ImageDraw.Draw(image)
+    for (x1, y1, x2, y2, original_class, confidence), (classified_class, class_confidence) in zip(boxes_and_classes, classified_objects):
+        color = "red"
+        if classified_class != "Unknown":
+            if "NIS" in classified_class:
+                color = "blue"
+            elif "Euro" in classified_class:
+                color = "orange"
+            elif "USD" in classified_class:
+                color = "green"
+        draw.rectangle([x1, y1, x2, y2], outline=color, width=2)
+        if classified_class != "Unknown":
+            label = f"{classified_class} ({class_confidence:.2f})"
+        else:
+            label = f"{original_class} ({confidence:.2f}) - Unknown"
+        text_bbox = draw.textbbox((x1, y1), label)
+        draw.rectangle(text_bbox, fill=color)
+        draw.text((x1, y1), label, fill="white")
+        print(f"Drawing bounding box for {classified_class} from {(x1, y1)} to {(x2, y2)}")
+    return Image.fromarray(np.array(image))
+
+# Random detections spread over the image, with random denominations and confidences
+def random_detections(count, width, height, rng):
+    x1 = rng.integers(0, width - 100, count)
+    y1 = rng.integers(0, height - 100, count)
+    sizes = rng.integers(40, 100, (count, 2))
+    names = rng.choice(DENOMINATIONS, count)
+    boxes_and_classes = [(int(x), int(y), int(x + w), int(y + h), "Currency", float(conf))
+                         for x, y, (w, h), conf in zip(x1, y1, sizes, rng.uniform(0.5, 1.0, count))]
+    classified_objects = [(str(name), 0.0 if name == "Unknown" else float(conf)) for name, conf in zip(names, rng.uniform(0.5, 1.0, count))]
+    return boxes_and_classes, classified_objects
+
+def time_runs(function, runs):
+    timings = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start_time)
+    return float(np.median(timings))
+
+def benchmark(object_counts, width, height, runs, max_side):
+    rng = np.random.default_rng(0)
+    image = np.full((height, width, 3), 200, dtype=np.uint8)
+    report = {}
+    for count in object_counts:
+        boxes_and_classes, classified_objects = random_detections(count, width, height, rng)
+        detections = Detections.from_tuples(boxes_and_classes, classified_objects)
+
+        with contextlib.redirect_stdout(io.StringIO()): # The previous renderer's prints aren't written to the terminal
+            previous_seconds = time_runs(lambda: previous_annotate_image(Image.fromarray(image), boxes_and_classes, classified_objects), runs)
+        sprite_seconds = time_runs(lambda: MyModel.annotate_image(image, detections), runs)
+        empty_seconds = time_runs(lambda: MyModel.annotate_image(image, Detections()), runs) # The canvas copy, paid once per image
+        report[count] = {
+            "previous_ms": round(previous_seconds * 1000, 2),
+            "sprites_ms": round(sprite_seconds * 1000, 2),
+            "previous_us_per_box": round((previous_seconds - empty_seconds) / count * 1e6, 1),
+            "sprites_us_per_box": round((sprite_seconds - empty_seconds) / count * 1e6, 1),
+        }
+        if max_side:
+            report[count]["sprites_downscaled_ms"] = round(time_runs(lambda: MyModel.annotate_image(image, detections, max_side=max_side), runs) * 1000, 2)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the per-box cost of annotate_image")
+    parser.add_argument("--objects", type=int, nargs="+", default=[50, 100, 200], help="Numbers of objects per image")
+    parser.add_argument("--width", type=int, default=2016)
+    parser.add_argument("--height", type=int, default=1512)
+    parser.add_argument("--runs", type=int, default=20, help="Runs per renderer, the median is reported")
+    parser.add_argument("--max-side", type=int, default=1024, help="Also time rendering to a downscaled output of this long side (0 = skip)")
+    parser.add_argument("--output", help="Path of a JSON report")
+    args = parser.parse_args(argv)
+
+    report = benchmark(args.objects, args.width, args.height, args.runs, args.max_side)
+    print(f"{'objects':>8} {'previous ms':>12} {'sprites ms':>11} {'previous us/box':>16} {'sprites us/box':>15}")
+    for count, result in report.items():
+        print(f"{count:>8} {result['previous_ms']:>12} {result['sprites_ms']:>11} {result['previous_us_per_box']:>16} {result['sprites_us_per_box']:>15}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# Benchmark the stages of the MyModel pipeline (detect_and_collect_objects, classify_objects, annotate_image, get_detected_counts)
+# and the end to end predict_image on synthetic images with controlled object counts and resolutions,
+# with the deterministic stub models of tools.stub_models or the real weights. A compare mode reports the regressions between two runs
+#
+# Usage: python -m tools.benchmark_pipeline [--models stub|real] [--objects 1 10 50 200] [--resolutions 1024x768 2016x1512] [--runs 10] [--output bench.json]
+#        python -m tools.benchmark_pipeline --compare baseline.json candidate.json [--threshold 0.1]
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+from app.core.config import settings
+from app.ml.model import MyModel
+from app.services.currency_exchange import exchange_service
+from tools.stub_models import StubClassificationModel, StubDetectionModel, synthetic_image
+
+STAGES = ["detect_and_collect_objects", "classify_objects", "annotate_image", "get_detected_counts", "predict_image"]
+RETURN_CURRENCY = "USD"
+
+def parse_resolution(resolution):
+    width, height = resolution.lower().split("x")
+    return int(width), int(height)
+
+# Median and p95 of a stage's timings, in ms
+def summarize(timings):
+    timings = np.array(timings) * 1000
+    return {"median_ms": round(float(np.median(timings)), 3), "p95_ms": round(float(np.percentile(timings, 95)), 3)}
+
+def time_stage(function, runs):
+    function() # Warmup run, not measured
+    timings = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start_time)
+    return timings
+
+# Serve the stub models (one per object count) or the real weights through MyModel
+def use_models(models, object_count):
+    if models == "stub":
+        MyModel.object_detection_model = StubDetectionModel(object_count)
+        MyModel.classification_model = StubClassificationModel()
+    else:
+        MyModel.load_models()
+
+# Time every stage on one image, each stage gets the previous stage's output
+def benchmark_case(width, height, object_count, runs):
+    image = synthetic_image(width, height, object_count)
+    detection_model, classification_model = MyModel.object_detection_model, MyModel.classification_model
+
+    crops, boxes_and_classes = MyModel.detect_and_collect_objects(detection_model, image)
+    classified_objects = MyModel.classify_objects(classification_model, crops)
+    stages = {
+        "detect_and_collect_objects": lambda: MyModel.detect_and_collect_objects(detection_model, image),
+        "classify_objects": lambda: MyModel.classify_objects(classification_model, crops),
+        "annotate_image": lambda: MyModel.annotate_image(image, boxes_and_classes, classified_objects),
+        "get_detected_counts": lambda: MyModel.get_detected_counts(classified_objects, RETURN_CURRENCY),
+        "predict_image": lambda: MyModel.predict_image(image, RETURN_CURRENCY),
+    }
+    result = {stage: summarize(time_stage(stages[stage], runs)) for stage in STAGES}
+    result["detected_objects"] = len(boxes_and_classes)
+    return result
+
+def run_benchmarks(models, object_counts, resolutions, runs):
+    # Fixed exchange rates, the benchmark doesn't depend on the rates cache file or the exchange rate API
+    exchange_service.rates = dict(exchange_service.backup_rates)
+    exchange_service.last_update = settings.TIME_NOW
+
+    results = {}
+    for width, height in resolutions:
+        for object_count in object_counts:
+            use_models(models, object_count)
+            results[f"{width}x{height}/{object_count}"] = benchmark_case(width, height, object_count, runs)
+    return {
+        "meta": {"models": models, "runs": runs, "model_backend": settings.MODEL_BACKEND, "python": platform.python_version(),
+                 "machine": platform.machine(), "cores": os.cpu_count(), "date": settings.TIME_NOW.isoformat()},
+        "results": results,
+    }
+
+# Stages whose median got slower than the baseline's by more than threshold (and min_ms, so noise on tiny stages isn't reported)
+def compare(baseline, candidate, threshold=0.1, min_ms=0.05):
+    rows = []
+    for case, stages in candidate["results"].items():
+        baseline_stages = baseline["results"].get(case)
+        if baseline_stages is None:
+            continue
+        for stage in STAGES:
+            if stage not in stages or stage not in baseline_stages:
+                continue
+            before, after = baseline_stages[stage]["median_ms"], stages[stage]["median_ms"]
+            change = (after - before) / before if before else 0.0
+            rows.append({"case": case, "stage": stage, "baseline_ms": before, "candidate_ms": after, "change": round(change, 4),
+                         "regression": change > threshold and after - before > min_ms})
+    return rows
+
+def print_results(report):
+    print(f"{'case':>16} {'objects':>7} " + " ".join(f"{stage[:18]:>18}" for stage in STAGES))
+    for case, result in report["results"].items():
+        print(f"{case:>16} {result['detected_objects']:>7} " + " ".join(f"{result[stage]['median_ms']:>18}" for stage in STAGES))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the MyModel pipeline stages")
+    parser.add_argument("--models", choices=["stub", "real"], default="stub", help="Deterministic stub models or the weights set in the settings")
+    parser.add_argument("--objects", type=int, nargs="+", default=[1, 10, 50, 200], help="Numbers of objects per image (stub models)")
+    parser.add_argument("--resolutions", nargs="+", default=["1024x768", "2016x1512"], help="Image resolutions as WIDTHxHEIGHT")
+    parser.add_argument("--runs", type=int, default=10, help="Measured runs per stage, after a warmup run")
+    parser.add_argument("--output", help="Path of the JSON results")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="Compare two results files instead of benchmarking")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown of a stage's median reported as a regression")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            candidate = json.load(f)
+        rows = compare(baseline, candidate, args.threshold)
+        for row in rows:
+            marker = "REGRESSION" if row["regression"] else ""
+            print(f"{row['case']:>16} {row['stage']:>28} {row['baseline_ms']:>10} -> {row['candidate_ms']:>10} ms {row['change']:>+8.1%} {marker}")
+        regressions = [row for row in rows if row["regression"]]
+        print(f"{len(regressions)} regressions over {args.threshold:.0%}")
+        return 1 if regressions else 0
+
+    report = run_benchmarks(args.models, args.objects, [parse_resolution(resolution) for resolution in args.resolutions], args.runs)
+    print_results(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
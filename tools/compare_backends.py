@@ -0,0 +1,142 @@
+# Compare the inference backends against the reference PyTorch models on a fixed image set
+# Reports the latency of detection + classification and how well each backend's detections agree with PyTorch's
+#
+# Usage: python -m tools.compare_backends --images <images dir> --backends onnx openvino torchscript [--export] [--runs 3]
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image, ImageOps
+from app.core.config import settings
+from app.ml import backends
+from app.ml.detections import box_overlaps
+from app.ml.model import MyModel
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# Load the images of a directory as RGB PIL images, sorted by name so every run uses the same order
+def load_images(images_dir):
+    images = {}
+    for file_name in sorted(os.listdir(images_dir)):
+        if file_name.lower().endswith(IMAGE_EXTENSIONS):
+            with Image.open(os.path.join(images_dir, file_name)) as image:
+                images[file_name] = ImageOps.exif_transpose(image).convert("RGB")
+    if not images:
+        raise ValueError(f"No images found in {images_dir}")
+    return images
+
+# Greedily match candidate detections to reference detections with the same detected class and IoU >= iou_threshold
+# Returns the matched (reference index, candidate index) pairs
+def match_detections(reference, candidate, iou_threshold=0.5):
+    if not len(reference) or not len(candidate):
+        return []
+    same_class = reference.det_class_names[:, None] == candidate.det_class_names[None, :]
+    ious = np.where(same_class, box_overlaps(reference.xyxy, candidate.xyxy), 0.0)
+
+    pairs = []
+    while True:
+        ref_index, cand_index = np.unravel_index(np.argmax(ious), ious.shape)
+        if ious[ref_index, cand_index] < iou_threshold:
+            return pairs
+        pairs.append((int(ref_index), int(cand_index)))
+        ious[ref_index, :] = 0.0
+        ious[:, cand_index] = 0.0
+
+# Run detection + classification of one image, returns its classified Detections and the seconds it took
+def run_pipeline(detection_model, classification_model, image, confidence_threshold):
+    start_time = time.perf_counter()
+    detections = MyModel.detect(detection_model, image, confidence_threshold=confidence_threshold)
+    detections = MyModel.classify_detections(classification_model, image, detections)
+    return detections, time.perf_counter() - start_time
+
+# Run every image through a backend's models, the first run of each image is a warmup and isn't timed
+def run_backend(backend, images, runs, confidence_threshold, precision="fp32"):
+    detection_model = backends.load_model(settings.OBJECT_DETECTION_MODEL, backend, precision)
+    classification_model = backends.load_model(settings.CLASSIFICATION_MODEL, backend, precision)
+
+    outputs = {}
+    latencies = []
+    for name, image in images.items():
+        outputs[name], _ = run_pipeline(detection_model, classification_model, image, confidence_threshold)
+        for _ in range(runs):
+            latencies.append(run_pipeline(detection_model, classification_model, image, confidence_threshold)[1])
+    return outputs, latencies
+
+# Compare a backend's outputs with the reference outputs, image by image
+def agreement(reference_outputs, candidate_outputs, iou_threshold):
+    reference_total = candidate_total = matched_total = same_classification_total = 0
+    for name, reference in reference_outputs.items():
+        candidate = candidate_outputs[name]
+        pairs = match_detections(reference, candidate, iou_threshold)
+        reference_total += len(reference)
+        candidate_total += len(candidate)
+        matched_total += len(pairs)
+        if pairs:
+            ref_indexes, cand_indexes = map(list, zip(*pairs))
+            same_classification_total += int((reference.cls_class_names[ref_indexes] == candidate.cls_class_names[cand_indexes]).sum())
+
+    return {
+        "reference_detections": reference_total,
+        "detections": candidate_total,
+        "matched_detections": matched_total,
+        "detection_recall": round(matched_total / reference_total, 4) if reference_total else 1.0,
+        "detection_precision": round(matched_total / candidate_total, 4) if candidate_total else 1.0,
+        "classification_agreement": round(same_classification_total / matched_total, 4) if matched_total else 1.0,
+    }
+
+def latency_summary(latencies):
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "runs": len(latencies),
+        "mean_ms": round(float(latencies_ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 2),
+    }
+
+def compare_backends(images, backend_names, runs=3, confidence_threshold=0.5, iou_threshold=0.5):
+    reference_outputs, reference_latencies = run_backend("pytorch", images, runs, confidence_threshold)
+    report = {"pytorch": {"latency": latency_summary(reference_latencies)}}
+
+    for backend in backend_names:
+        outputs, latencies = run_backend(backend, images, runs, confidence_threshold)
+        report[backend] = {"latency": latency_summary(latencies), "agreement": agreement(reference_outputs, outputs, iou_threshold)}
+        report[backend]["speedup"] = round(report["pytorch"]["latency"]["mean_ms"] / max(report[backend]["latency"]["mean_ms"], 1e-9), 2)
+    return report
+
+def print_report(report):
+    print(f"{'backend':<12} {'mean ms':>9} {'p95 ms':>9} {'speedup':>8} {'recall':>8} {'precision':>10} {'cls agree':>10}")
+    for backend, result in report.items():
+        latency = result["latency"]
+        agreement_result = result.get("agreement", {})
+        print(f"{backend:<12} {latency['mean_ms']:>9} {latency['p95_ms']:>9} {result.get('speedup', 1.0):>8} "
+              f"{agreement_result.get('detection_recall', 1.0):>8} {agreement_result.get('detection_precision', 1.0):>10} "
+              f"{agreement_result.get('classification_agreement', 1.0):>10}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the inference backends against the reference PyTorch models")
+    parser.add_argument("--images", required=True, help="Directory of the fixed image set")
+    parser.add_argument("--backends", nargs="+", default=["onnx", "openvino", "torchscript"], choices=[b for b in backends.BACKENDS if b != "pytorch"])
+    parser.add_argument("--export", action="store_true", help="Export the .pt weights to the backends before comparing")
+    parser.add_argument("--runs", type=int, default=3, help="Timed runs per image and backend")
+    parser.add_argument("--confidence", type=float, default=0.5, help="Detection confidence threshold")
+    parser.add_argument("--iou", type=float, default=0.5, help="Min IoU for two detections to agree")
+    parser.add_argument("--output", default="backend_report.json", help="Path of the JSON report")
+    args = parser.parse_args(argv)
+
+    if args.export:
+        for backend in args.backends:
+            backends.export_model(settings.OBJECT_DETECTION_MODEL, backend)
+            backends.export_model(settings.CLASSIFICATION_MODEL, backend)
+
+    report = compare_backends(load_images(args.images), args.backends, args.runs, args.confidence, args.iou)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report)
+    print(f"Report saved to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+# Load test the HTTP API offline: start app.main:app in a separate process with the deterministic stub models of tools.stub_models,
+# a temporary database, pinned exchange rates and a stubbed Google token verifier, then replay a weighted mix of authenticated and
+# anonymous requests to /api/predict, /api/get_images and /auth/login at a fixed concurrency and report the requests per second,
+# p50/p95/p99 latencies and a latency histogram per scenario
+#
+# Usage: python -m tools.load_test [--concurrency 16] [--duration 30] [--mix predict_auth=4 predict_anon=2 get_images=2 login=1]
+#                                  [--users 8] [--objects 10] [--seconds-per-image 0.02] [--response-mode image] [--output load.json] [--server-log server.log]
+import argparse
+import asyncio
+import base64
+import io
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+import httpx
+import numpy as np
+from PIL import Image
+from tools.stub_models import StubClassificationModel, StubDetectionModel, synthetic_image
+
+SCENARIOS = ["predict_auth", "predict_anon", "get_images", "login", "google_signin"]
+DEFAULT_MIX = ["predict_auth=4", "predict_anon=2", "get_images=2", "login=1"]
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+PASSWORD = "LoadTest1234"
+
+# ----------------------------------------------------------- Server process ----------------------------------------------------------- #
+
+# Google ID tokens are not verified against Google: the token is the Google user id of a load test user
+def verify_stub_google_token(token, request, client_id):
+    return {"aud": client_id, "iss": "accounts.google.com", "sub": token, "email": f"{token}@google.loadtest.dev", "name": f"Google {token}"}
+
+# Runs in the server process: the settings are overridden through the environment before the app is imported,
+# and its console output goes to server_log, so it doesn't interleave with the report
+def serve(port, work_dir, object_count, seconds_per_image, seconds_per_crop, prediction_cache, server_log=None):
+    with open(server_log or os.devnull, "a") as log_file:
+        os.dup2(log_file.fileno(), sys.stdout.fileno())
+        os.dup2(log_file.fileno(), sys.stderr.fileno())
+
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(work_dir, 'load_test.db')}",
+        "INFERENCE_WORKERS": "0", # The stub models live in the server process
+        "PREDICTION_CACHE_ENABLED": str(prediction_cache),
+        "MODEL_WATCH_INTERVAL_SECONDS": "0",
+    })
+    for key in ["JWT_ACCESS_SECRET_KEY", "JWT_REFRESH_SECRET_KEY", "GOOGLE_CLIENT_IOS_ID", "GOOGLE_CLIENT_ANDROID_ID", "EXCHANGE_RATE_API_KEY"]:
+        os.environ.setdefault(key, f"load-test-{key.lower()}")
+
+    import uvicorn
+    from app.api.endpoints import auth
+    from app.core.config import settings
+    from app.main import app
+    from app.ml.model import MyModel
+    from app.services.currency_exchange import exchange_service
+
+    # Stub models, already loaded so the warmup doesn't look for the weights
+    MyModel.object_detection_model = StubDetectionModel(object_count, seconds_per_image)
+    MyModel.classification_model = StubClassificationModel(seconds_per_crop)
+    MyModel.model_version = "stub"
+
+    # Fresh exchange rates in a cache file of the work dir, so the rates task never calls the exchange rate API
+    exchange_service.CACHE_FILE = os.path.join(work_dir, "exchange_rates_cache.json")
+    exchange_service.rates = dict(exchange_service.backup_rates)
+    exchange_service.last_update = settings.TIME_NOW
+    exchange_service.save_rates_to_file()
+
+    auth.id_token.verify_oauth2_token = verify_stub_google_token
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def wait_until_ready(client, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not process.is_alive():
+            raise RuntimeError(f"The server process exited with code {process.exitcode}")
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"The server wasn't ready after {timeout} seconds")
+
+# ----------------------------------------------------------- Load generator ----------------------------------------------------------- #
+
+# Parse "scenario=weight" pairs into {scenario: weight}
+def parse_mix(pairs):
+    mix = {}
+    for pair in pairs:
+        scenario, _, weight = pair.partition("=")
+        if scenario not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{scenario}', expected one of {SCENARIOS}")
+        mix[scenario] = float(weight or 1)
+        if mix[scenario] < 0:
+            raise ValueError(f"Negative weight for scenario '{scenario}'")
+    if not any(mix.values()):
+        raise ValueError("The mix has no scenario with a positive weight")
+    return mix
+
+# Base64 JPEG photos of the synthetic images, each one different so the prediction cache can't answer the requests alone
+def encoded_images(count, width, height, object_count):
+    images = []
+    for seed in range(count):
+        buffered = io.BytesIO()
+        Image.fromarray(synthetic_image(width, height, object_count, seed=seed)).save(buffered, format="JPEG", quality=90)
+        images.append(base64.b64encode(buffered.getvalue()).decode())
+    return images
+
+# Register the load test users and log them in, returns their (email, access token)
+async def create_users(client, count):
+    users = []
+    for i in range(count):
+        email = f"user{i}@loadtest.dev"
+        response = await client.post("/auth/register", json={"email": email, "name": f"Load test {i}", "password": PASSWORD})
+        if response.status_code not in (200, 400): # 400: registered by a previous run on the same database
+            raise RuntimeError(f"Registering {email} failed: {response.status_code} {response.text}")
+        response = await client.post("/auth/login", json={"email": email, "password": PASSWORD})
+        response.raise_for_status()
+        users.append((email, response.json()["access_token"]))
+    return users
+
+# Send one request of a scenario, returns its status code
+async def send_request(client, scenario, rng, users, images, response_mode, return_currency):
+    email, access_token = rng.choice(users)
+    authorization = {"Authorization": f"Bearer {access_token}"}
+    if scenario in ("predict_auth", "predict_anon"):
+        body = {"image": rng.choice(images), "return_currency": return_currency, "response_mode": response_mode}
+        response = await client.post("/api/predict", json=body, headers=authorization if scenario == "predict_auth" else None)
+    elif scenario == "get_images":
+        response = await client.get("/api/get_images", headers=authorization)
+    elif scenario == "login":
+        response = await client.post("/auth/login", json={"email": email, "password": PASSWORD})
+    else:
+        response = await client.post("/auth/google-signin", json={"token_id": f"google-{rng.randrange(len(users))}"})
+    await response.aread()
+    return response.status_code
+
+# Closed loop: `concurrency` clients each send their next request as soon as the previous one is answered, until the time is up
+# or `max_requests` were sent. Returns the (scenario, status code, latency in seconds) of every request and the elapsed time
+async def run_load(client, mix, concurrency, duration, max_requests, users, images, response_mode="image", return_currency="USD", seed=0):
+    scenarios, weights = list(mix), list(mix.values())
+    samples = []
+    sent = 0
+    start_time = time.perf_counter()
+
+    async def run_client(client_index):
+        nonlocal sent
+        rng = random.Random(seed * 1000 + client_index)
+        while time.perf_counter() - start_time < duration and (not max_requests or sent < max_requests):
+            sent += 1
+            scenario = rng.choices(scenarios, weights)[0]
+            request_start_time = time.perf_counter()
+            try:
+                status_code = await send_request(client, scenario, rng, users, images, response_mode, return_currency)
+            except httpx.HTTPError:
+                status_code = 0 # Connection error or timeout
+            samples.append((scenario, status_code, time.perf_counter() - request_start_time))
+
+    await asyncio.gather(*[run_client(i) for i in range(concurrency)])
+    return samples, time.perf_counter() - start_time
+
+# ----------------------------------------------------------- Report ----------------------------------------------------------- #
+
+# Count of latencies per bucket, the last bucket holds the latencies over the last bound
+def histogram(latencies_ms, buckets_ms=HISTOGRAM_BUCKETS_MS):
+    counts = np.bincount(np.searchsorted(buckets_ms, latencies_ms, side="left"), minlength=len(buckets_ms) + 1)
+    labels = [f"<={bound}ms" for bound in buckets_ms] + [f">{buckets_ms[-1]}ms"]
+    return dict(zip(labels, counts.tolist()))
+
+def summarize(samples, elapsed):
+    latencies_ms = np.array([latency for _, _, latency in samples]) * 1000
+    statuses = {}
+    for _, status_code, _ in samples:
+        statuses[str(status_code)] = statuses.get(str(status_code), 0) + 1
+    summary = {"requests": len(samples), "rps": round(len(samples) / elapsed, 2) if elapsed else 0.0, "statuses": statuses,
+               "errors": sum(1 for _, status_code, _ in samples if not 200 <= status_code < 300)}
+    if len(samples):
+        summary.update({"mean_ms": round(float(latencies_ms.mean()), 2), "max_ms": round(float(latencies_ms.max()), 2),
+                        **{f"p{q}_ms": round(float(np.percentile(latencies_ms, q)), 2) for q in (50, 95, 99)},
+                        "histogram": histogram(latencies_ms)})
+    return summary
+
+# The overall and per scenario summaries of a run
+def build_report(samples, elapsed, meta=None):
+    scenarios = sorted({scenario for scenario, _, _ in samples}, key=SCENARIOS.index)
+    return {
+        "meta": meta or {},
+        "elapsed_seconds": round(elapsed, 3),
+        "overall": summarize(samples, elapsed),
+        "scenarios": {scenario: summarize([sample for sample in samples if sample[0] == scenario], elapsed) for scenario in scenarios},
+    }
+
+def print_report(report, bar_width=40):
+    print(f"{'scenario':>14} {'requests':>8} {'rps':>8} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, summary in [*report["scenarios"].items(), ("overall", report["overall"])]:
+        if summary["requests"]:
+            print(f"{name:>14} {summary['requests']:>8} {summary['rps']:>8} {summary['errors']:>6} "
+                  f"{summary['p50_ms']:>9} {summary['p95_ms']:>9} {summary['p99_ms']:>9} {summary['max_ms']:>9}")
+    overall_histogram = report["overall"].get("histogram", {})
+    most = max(overall_histogram.values(), default=0)
+    print("\nLatency histogram (all requests)")
+    for label, count in overall_histogram.items():
+        print(f"{label:>10} {count:>8} {'#' * round(bar_width * count / most) if most else ''}")
+
+async def load_test(args, work_dir):
+    port = args.port or free_port()
+    mp_context = multiprocessing.get_context("spawn")
+    server = mp_context.Process(target=serve, args=(port, work_dir, args.objects, args.seconds_per_image, args.seconds_per_crop, args.prediction_cache, args.server_log))
+    server.start()
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=args.timeout) as client:
+            await wait_until_ready(client, server, args.startup_timeout)
+            users = await create_users(client, args.users)
+            images = encoded_images(args.images, *args.resolution, args.objects)
+            samples, elapsed = await run_load(client, parse_mix(args.mix), args.concurrency, args.duration, args.requests, users, images,
+                                              args.response_mode, args.return_currency, args.seed)
+    finally:
+        server.terminate()
+        server.join()
+
+    meta = {"concurrency": args.concurrency, "mix": parse_mix(args.mix), "users": args.users, "objects": args.objects,
+            "resolution": "x".join(map(str, args.resolution)), "seconds_per_image": args.seconds_per_image,
+            "seconds_per_crop": args.seconds_per_crop, "response_mode": args.response_mode, "prediction_cache": args.prediction_cache}
+    return build_report(samples, elapsed, meta)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline HTTP load test of the API with the stub models")
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of clients sending requests at the same time")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to send requests for")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests (0 = only the duration)")
+    parser.add_argument("--mix", nargs="+", default=DEFAULT_MIX, help=f"Weighted scenarios as scenario=weight, scenarios: {', '.join(SCENARIOS)}")
+    parser.add_argument("--users", type=int, default=8, help="Number of registered users the authenticated requests are spread over")
+    parser.add_argument("--images", type=int, default=8, help="Number of distinct synthetic photos sent to /api/predict")
+    parser.add_argument("--resolution", type=lambda value: tuple(map(int, value.lower().split("x"))), default=(1024, 768), help="Photos' WIDTHxHEIGHT")
+    parser.add_argument("--objects", type=int, default=10, help="Objects per photo found by the stub detector")
+    parser.add_argument("--seconds-per-image", type=float, default=0.0, help="Emulated detection time per image")
+    parser.add_argument("--seconds-per-crop", type=float, default=0.0, help="Emulated classification time per crop")
+    parser.add_argument("--response-mode", choices=["image", "detections", "overlay"], default="image")
+    parser.add_argument("--return-currency", default="USD")
+    parser.add_argument("--prediction-cache", action="store_true", help="Keep the prediction cache on (off by default, so every prediction runs the models)")
+    parser.add_argument("--port", type=int, default=0, help="Port of the server (default: a free port)")
+    parser.add_argument("--timeout", type=float, default=60, help="Request timeout in seconds")
+    parser.add_argument("--startup-timeout", type=float, default=60, help="Seconds to wait for the server to be ready")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server-log", help="File to write the server's console output to (default: discarded)")
+    parser.add_argument("--output", help="Path of the JSON report")
+    args = parser.parse_args(argv)
+    parse_mix(args.mix) # Fail on an invalid mix before starting the server
+
+    with tempfile.TemporaryDirectory(prefix="cashcam_load_test_") as work_dir:
+        report = asyncio.run(load_test(args, work_dir))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+# Measure the peak memory and time /predict's image handling takes per request, with the previous decode path and the reduced-copy one
+# Each path runs in a fresh process so its peak RSS isn't hidden by an earlier run. The model forward passes aren't run,
+# only the image copies each path makes around them (decode, detection input, crops source, annotation, JPEG encode)
+#
+# Usage: python -m tools.measure_decode_memory [--image <photo.jpg>] [--width 4032 --height 3024] [--runs 3]
+import argparse
+import base64
+import io
+import json
+import multiprocessing
+import resource
+import sys
+import time
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw
+from app.ml.image_decode import decode_image, detection_input
+
+# Resident set size of the process in MB
+def current_rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+# Peak resident set size of the process in MB since the last reset_peak_rss()
+def peak_rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# Reset the peak RSS to the current RSS, so the imports' peak doesn't hide the measured path's
+def reset_peak_rss():
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+def annotate(image):
+    ImageDraw.Draw(image).rectangle([10, 10, 200, 200], outline="red", width=2)
+    return image
+
+# The copies /predict made before the reduced-copy path: Image.open + convert('RGB'), np.array in detect_and_collect_objects,
+# ultralytics' own RGB -> BGR copy of the PIL image, then Image.fromarray(np.array(image)) in annotate_image
+def previous_path(encoded_image):
+    image = Image.open(io.BytesIO(base64.b64decode(encoded_image)))
+    image = image.convert("RGB")
+    img_np = np.array(image)
+    model_input = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+    annotated_image = Image.fromarray(np.array(annotate(image)))
+    annotated_image.save(io.BytesIO(), format="JPEG")
+    return img_np.shape, model_input.shape
+
+# The reduced-copy path: one decoded RGB array shared by the stages, a downscaled detection input and one copy to draw on
+def reduced_copy_path(encoded_image):
+    image = decode_image(base64.b64decode(encoded_image))
+    model_input, _ = detection_input(image)
+    annotated_image = annotate(Image.fromarray(image))
+    annotated_image.save(io.BytesIO(), format="JPEG")
+    return image.shape, model_input.shape
+
+PATHS = {"previous": previous_path, "reduced_copy": reduced_copy_path}
+
+def measure(path_name, encoded_image, results):
+    reset_peak_rss()
+    rss_before = current_rss_mb()
+    start_time = time.perf_counter()
+    decoded_shape, model_input_shape = PATHS[path_name](encoded_image)
+    results.put({
+        "seconds": time.perf_counter() - start_time,
+        "peak_mb": max(peak_rss_mb() - rss_before, 0.0),
+        "decoded_shape": decoded_shape,
+        "model_input_shape": model_input_shape,
+    })
+
+# Run a path in a fresh process and return its measurement
+def measure_in_process(path_name, encoded_image):
+    mp_context = multiprocessing.get_context("spawn")
+    results = mp_context.Queue()
+    process = mp_context.Process(target=measure, args=(path_name, encoded_image, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def synthetic_photo(width, height):
+    # Smooth gradients plus noise, compresses like a photo rather than like a flat image
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)), (x + y) / 2], axis=2)
+    pixels = np.clip(pixels + np.random.default_rng(0).normal(0, 8, pixels.shape), 0, 255).astype(np.uint8)
+    buffered = io.BytesIO()
+    Image.fromarray(pixels).save(buffered, format="JPEG", quality=90)
+    return buffered.getvalue()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the peak memory of /predict's image decode path before and after the reduced-copy path")
+    parser.add_argument("--image", help="Photo to measure with (default: a synthetic JPEG of --width x --height)")
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--runs", type=int, default=3, help="Runs per path, each in a fresh process")
+    parser.add_argument("--output", help="Path of a JSON report")
+    args = parser.parse_args(argv)
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            image_data = f.read()
+    else:
+        image_data = synthetic_photo(args.width, args.height)
+    encoded_image = base64.b64encode(image_data).decode()
+
+    report = {}
+    for path_name in PATHS:
+        runs = [measure_in_process(path_name, encoded_image) for _ in range(args.runs)]
+        report[path_name] = {
+            "peak_mb": round(float(np.median([run["peak_mb"] for run in runs])), 1),
+            "ms": round(float(np.median([run["seconds"] for run in runs])) * 1000, 1),
+            "decoded_shape": runs[0]["decoded_shape"],
+            "model_input_shape": runs[0]["model_input_shape"],
+        }
+        print(f"{path_name:<13} peak {report[path_name]['peak_mb']:>7} MB  {report[path_name]['ms']:>7} ms  "
+              f"decoded {report[path_name]['decoded_shape']}  detection input {report[path_name]['model_input_shape']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
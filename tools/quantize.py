@@ -0,0 +1,161 @@
+# Quantize the detection and classification models to INT8 (static post-training quantization with ONNX Runtime)
+# The activation ranges are calibrated on a directory of sample cash photos: the detection model on the full photos
+# and the classification model on the objects the FP32 detection model crops from them.
+# Also writes an accuracy vs latency report comparing the get_detected_counts denomination counts of the FP32 and INT8 models.
+# Serve the quantized models with MODEL_BACKEND=onnx and MODEL_PRECISION=int8
+#
+# Usage: python -m tools.quantize --calibration-images <images dir> [--eval-images <images dir>] [--method minmax] [--runs 3]
+import argparse
+import json
+import os
+import sys
+import numpy as np
+import onnx
+from PIL import Image
+from onnxruntime.quantization import CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quantize_static
+from app.core.config import settings
+from app.ml import backends
+from app.ml.model import MyModel
+from tools.compare_backends import load_images, run_backend, latency_summary
+
+CALIBRATION_METHODS = {"minmax": CalibrationMethod.MinMax, "entropy": CalibrationMethod.Entropy, "percentile": CalibrationMethod.Percentile}
+
+# Resize and pad an image to a (size, size) float32 NCHW tensor in [0, 1], the way ultralytics feeds an ONNX model
+def letterbox(image, size):
+    image = image if isinstance(image, Image.Image) else Image.fromarray(image)
+    scale = min(size / image.width, size / image.height)
+    resized = image.convert("RGB").resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.BILINEAR)
+    padded = Image.new("RGB", (size, size), (114, 114, 114))
+    padded.paste(resized, ((size - resized.width) // 2, (size - resized.height) // 2))
+    return (np.asarray(padded, dtype=np.float32) / 255.0).transpose(2, 0, 1)[None]
+
+# Feeds the calibration images to ONNX Runtime one at a time
+class ImageCalibrationReader(CalibrationDataReader):
+    def __init__(self, model_path, images, image_size):
+        self.input_name = onnx.load(model_path, load_external_data=False).graph.input[0].name
+        self.images = iter(images)
+        self.image_size = image_size
+
+    def get_next(self):
+        image = next(self.images, None)
+        return None if image is None else {self.input_name: letterbox(image, self.image_size)}
+
+# Quantize a FP32 ONNX model, the ultralytics metadata (class names, stride, image size) is copied so YOLO() can load it
+def quantize_model(fp32_path, int8_path, calibration_images, image_size, method):
+    quantize_static(
+        fp32_path,
+        int8_path,
+        ImageCalibrationReader(fp32_path, calibration_images, image_size),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        calibrate_method=CALIBRATION_METHODS[method])
+
+    fp32_model = onnx.load(fp32_path, load_external_data=False)
+    int8_model = onnx.load(int8_path)
+    onnx.helper.set_model_props(int8_model, {prop.key: prop.value for prop in fp32_model.metadata_props})
+    onnx.save(int8_model, int8_path)
+    return int8_path
+
+# Export a .pt model to FP32 ONNX if needed and quantize it, returns the INT8 model's path
+def quantize(model_path, calibration_images, image_size, method):
+    fp32_path = backends.resolve_model_path(model_path, "onnx", "fp32")
+    if not os.path.exists(fp32_path):
+        fp32_path = backends.export_model(model_path, "onnx", imgsz=image_size)
+    int8_path = backends.resolve_model_path(model_path, "onnx", "int8")
+    print(f"Quantizing {fp32_path} to {int8_path} on {len(calibration_images)} calibration images")
+    return quantize_model(fp32_path, int8_path, calibration_images, image_size, method)
+
+# Crop the objects the FP32 detection model finds in the calibration photos, the classification model is calibrated on them
+def calibration_crops(images, confidence_threshold):
+    detection_model = backends.load_model(settings.OBJECT_DETECTION_MODEL, "onnx", "fp32")
+    crops = []
+    for image in images:
+        image = np.asarray(image)
+        crops.extend(MyModel.detect(detection_model, image, confidence_threshold=confidence_threshold).crops(image))
+    return crops
+
+# Denomination counts of every image, as get_detected_counts returns them to the user
+def denomination_counts(outputs, return_currency):
+    return {name: {currency: info.quantity for currency, info in MyModel.get_detected_counts(detections, return_currency).items()}
+            for name, detections in outputs.items()}
+
+# Compare the denomination counts of the INT8 models with the FP32 ones, image by image
+def counts_agreement(fp32_counts, int8_counts):
+    exact_images = 0
+    fp32_total = count_errors = 0
+    mismatches = {}
+    for name, fp32_image_counts in fp32_counts.items():
+        int8_image_counts = int8_counts[name]
+        errors = sum(abs(fp32_image_counts.get(currency, 0) - int8_image_counts.get(currency, 0)) for currency in set(fp32_image_counts) | set(int8_image_counts))
+        fp32_total += sum(fp32_image_counts.values())
+        count_errors += errors
+        if errors == 0:
+            exact_images += 1
+        else:
+            mismatches[name] = {"fp32": fp32_image_counts, "int8": int8_image_counts}
+
+    return {
+        "images": len(fp32_counts),
+        "exact_count_images": exact_images,
+        "exact_count_rate": round(exact_images / len(fp32_counts), 4) if fp32_counts else 1.0,
+        "fp32_objects": fp32_total,
+        "count_errors": count_errors,
+        "mismatches": mismatches,
+    }
+
+def model_size_mb(model_path, backend, precision):
+    return round(os.path.getsize(backends.resolve_model_path(model_path, backend, precision)) / 2 ** 20, 2)
+
+def report_precisions(images, runs, confidence_threshold, return_currency):
+    report = {}
+    counts = {}
+    for precision in backends.PRECISIONS:
+        outputs, latencies = run_backend("onnx", images, runs, confidence_threshold, precision)
+        counts[precision] = denomination_counts(outputs, return_currency)
+        report[precision] = {
+            "latency": latency_summary(latencies),
+            "detection_model_mb": model_size_mb(settings.OBJECT_DETECTION_MODEL, "onnx", precision),
+            "classification_model_mb": model_size_mb(settings.CLASSIFICATION_MODEL, "onnx", precision),
+        }
+    report["int8"]["speedup"] = round(report["fp32"]["latency"]["mean_ms"] / max(report["int8"]["latency"]["mean_ms"], 1e-9), 2)
+    report["int8"]["counts"] = counts_agreement(counts["fp32"], counts["int8"])
+    return report
+
+def print_report(report):
+    print(f"{'precision':<10} {'mean ms':>9} {'p95 ms':>9} {'detection MB':>13} {'classification MB':>18}")
+    for precision in backends.PRECISIONS:
+        result = report[precision]
+        print(f"{precision:<10} {result['latency']['mean_ms']:>9} {result['latency']['p95_ms']:>9} {result['detection_model_mb']:>13} {result['classification_model_mb']:>18}")
+    counts = report["int8"]["counts"]
+    print(f"INT8 speedup: {report['int8']['speedup']}x - same denomination counts as FP32 on {counts['exact_count_images']}/{counts['images']} images "
+          f"({counts['count_errors']} count errors over {counts['fp32_objects']} FP32 objects)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Quantize the detection and classification models to INT8 and compare them with FP32")
+    parser.add_argument("--calibration-images", required=True, help="Directory of sample cash photos used to calibrate the quantization")
+    parser.add_argument("--eval-images", help="Directory of the photos the report is made on (default: the calibration images)")
+    parser.add_argument("--method", default="minmax", choices=list(CALIBRATION_METHODS), help="Calibration method of the activation ranges")
+    parser.add_argument("--image-size", type=int, default=640, help="Image size the models are calibrated at")
+    parser.add_argument("--runs", type=int, default=3, help="Timed runs per image and precision")
+    parser.add_argument("--confidence", type=float, default=0.5, help="Detection confidence threshold")
+    parser.add_argument("--return-currency", default="USD", help="Return currency passed to get_detected_counts")
+    parser.add_argument("--output", default="quantization_report.json", help="Path of the JSON report")
+    args = parser.parse_args(argv)
+
+    calibration_images = list(load_images(args.calibration_images).values())
+    quantize(settings.OBJECT_DETECTION_MODEL, calibration_images, args.image_size, args.method)
+    crops = calibration_crops(calibration_images, args.confidence) or calibration_images # No objects found, calibrate on the full photos
+    quantize(settings.CLASSIFICATION_MODEL, crops, args.image_size, args.method)
+
+    report = report_precisions(load_images(args.eval_images or args.calibration_images), args.runs, args.confidence, args.return_currency)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report)
+    print(f"Report saved to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+# Deterministic stand-ins for the two YOLO models, with the results API MyModel reads (result.boxes.xyxy/cls/conf .cpu().numpy()
+# and model.names), for benchmarks and load tests that run without the weights
+#
+# The detector finds the objects synthetic_image() draws for the same object count, the classifier names each crop by its size
+import math
+import time
+import numpy as np
+from PIL import Image
+
+CLASSIFICATION_NAMES = {0: "0.1 NIS", 1: "1 NIS", 2: "5 NIS", 3: "10 NIS", 4: "50 NIS", 5: "1 Euro", 6: "2 Euro", 7: "20 Euro", 8: "0.25 USD", 9: "1 USD BILL"}
+
+class StubTensor:
+    def __init__(self, array):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+class StubBoxes:
+    def __init__(self, xyxy, cls, conf):
+        self.xyxy, self.cls, self.conf = StubTensor(xyxy), StubTensor(cls), StubTensor(conf)
+
+class StubResult:
+    def __init__(self, xyxy, cls, conf):
+        self.boxes = StubBoxes(np.asarray(xyxy, dtype=np.float32).reshape(-1, 4), np.asarray(cls, dtype=np.float32), np.asarray(conf, dtype=np.float32))
+
+# Boxes of `count` objects laid out on a grid over a width x height image, each inset in its cell
+def layout_boxes(width, height, count):
+    if count <= 0:
+        return np.zeros((0, 4), dtype=np.float32)
+    columns = math.ceil(math.sqrt(count * width / height))
+    rows = math.ceil(count / columns)
+    cell_width, cell_height = width / columns, height / rows
+    cells = np.arange(count)
+    x1 = (cells % columns) * cell_width + cell_width * 0.1
+    y1 = (cells // columns) * cell_height + cell_height * 0.1
+    return np.stack([x1, y1, x1 + cell_width * 0.8, y1 + cell_height * 0.8], axis=1).astype(np.float32)
+
+# A synthetic photo: a textured background with `count` discs where the stub detector finds them
+def synthetic_image(width, height, count, seed=0):
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width, 3), 90, dtype=np.uint8) + rng.integers(0, 40, (height, width, 1), dtype=np.uint8)
+    yy, xx = np.ogrid[:height, :width]
+    for x1, y1, x2, y2 in layout_boxes(width, height, count).tolist():
+        center_x, center_y, radius = (x1 + x2) / 2, (y1 + y2) / 2, min(x2 - x1, y2 - y1) / 2
+        image[(xx - center_x) ** 2 + (yy - center_y) ** 2 <= radius ** 2] = rng.integers(150, 256, 3, dtype=np.uint8)
+    return image
+
+def as_batch(images):
+    return images if isinstance(images, list) else [images]
+
+def image_size(image):
+    return image.size if isinstance(image, Image.Image) else (image.shape[1], image.shape[0])
+
+# Stub detection model: `object_count` objects per image at the layout_boxes positions, seconds_per_image emulates the model's cost
+class StubDetectionModel:
+    names = {0: "Currency"}
+
+    def __init__(self, object_count=10, seconds_per_image=0.0):
+        self.object_count = object_count
+        self.seconds_per_image = seconds_per_image
+
+    def __call__(self, images, verbose=False, **kwargs):
+        images = as_batch(images)
+        if self.seconds_per_image:
+            time.sleep(self.seconds_per_image * len(images))
+        results = []
+        for image in images:
+            xyxy = layout_boxes(*image_size(image), self.object_count)
+            confidences = 0.6 + 0.39 * ((np.arange(len(xyxy)) * 7919) % 100) / 100
+            results.append(StubResult(xyxy, np.zeros(len(xyxy)), confidences))
+        return results
+
+# Stub classification model: one box per crop, named after the crop's size so the same crop always gets the same denomination
+class StubClassificationModel:
+    names = CLASSIFICATION_NAMES
+
+    def __init__(self, seconds_per_crop=0.0):
+        self.seconds_per_crop = seconds_per_crop
+
+    def __call__(self, images, verbose=False, **kwargs):
+        images = as_batch(images)
+        if self.seconds_per_crop:
+            time.sleep(self.seconds_per_crop * len(images))
+        results = []
+        for image in images:
+            width, height = image_size(image)
+            results.append(StubResult([[0, 0, width, height]], [(width * 31 + height) % len(self.names)], [0.9]))
+        return results